@@ -0,0 +1,449 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Upload a tree of files to the artifacts server.
+
+This script runs on the workers, with their python (2.7 or 3), and only
+uses the standard library. It walks the current directory once, following
+symbolic links as ``find -L`` does, and sends every file with a PUT request
+over a bounded pool of keep-alive connections.
+
+With ``--dedup``, only the files whose content is unknown to the server
+are sent, the others are linked on the server side.
+
+The result of every file is written to a JSON manifest::
+
+    {"url": ..., "dedup": ...,
+     "files": [{"path": ..., "size": ..., "digest": ..., "status": ...,
+                "seconds": ..., "error": ...}, ...],
+     "uploaded": ..., "linked": ..., "resumed": ..., "failed": ...,
+     "bytes": ..., "linked_bytes": ..., "resumed_bytes": ...,
+     "seconds": ...}
+
+where the status of a file is ``uploaded``, ``linked`` or ``failed``.
+Results are also appended to ``<manifest>.journal`` while the upload runs.
+
+With ``--resume``, the files sent by the previous upload to the same url,
+according to its manifest or journal, are not sent again. They are kept
+in the new manifest, flagged ``resumed``.
+
+The exit status is 1 when a file could not be uploaded.
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from http.client import HTTPConnection, HTTPException
+    from queue import Empty, Queue
+    from urllib.parse import quote, urlsplit
+except ImportError:  # python 2
+    from urllib import quote
+
+    from httplib import HTTPConnection, HTTPException
+    from Queue import Empty, Queue
+    from urlparse import urlsplit
+
+BLOCK_SIZE = 64 * 1024
+"""Size of the blocks read to hash files."""
+
+LOOKUP_BATCH = 1000
+"""Number of digests looked up per request."""
+
+
+def walk(root, exclude=()):
+    """Yield the relative paths of the files below root, sorted.
+
+    As ``find -L`` does, symbolic links to a parent directory are not
+    followed, rather than looping until the paths are too long.
+
+    """
+    exclude = set(os.path.realpath(path) for path in exclude)
+    # the (device, inode) of the parents of the directories to walk
+    parents = {}
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        try:
+            stat = os.stat(dirpath)
+        except OSError:
+            continue
+        key = (stat.st_dev, stat.st_ino)
+        ancestors = parents.pop(dirpath, frozenset())
+        if key in ancestors:
+            del dirnames[:]
+            continue
+        ancestors = ancestors | set([key])
+        dirnames.sort()
+        for dirname in dirnames:
+            parents[os.path.join(dirpath, dirname)] = ancestors
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if not os.path.isfile(path):
+                continue
+            if os.path.realpath(path) in exclude:
+                continue
+            yield os.path.relpath(path, root).replace(os.sep, '/')
+
+
+class ResponseError(HTTPException):
+    """The server answered a request with an error status."""
+
+    def __init__(self, status, reason):
+        super(ResponseError, self).__init__('%d %s' % (status, reason))
+        self.status = status
+
+
+def sha256sum(path):
+    """Return the hex sha256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_:
+        for block in iter(lambda: file_.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Uploader(object):
+    """Send files to an upload url with a pool of keep-alive connections.
+
+    With ``dedup``, files are hashed first and the server is asked which
+    of their digests it already holds (``POST /lookup``). Only the other
+    files are sent, with their digest; the known ones are linked by the
+    server to the blob it holds (``PUT /link/<container>/<path>``).
+    Servers without these endpoints get every file.
+
+    Args:
+        url (str): url of the container, the path of each file is appended
+            to it.
+        jobs (int): number of connections.
+        timeout (float): timeout of the socket operations, in seconds.
+        dedup (bool): only send the files unknown to the server.
+
+    """
+
+    def __init__(self, url, jobs=16, timeout=600, dedup=False):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/') + '/'
+        base, _, container = self.prefix.rstrip('/').rpartition('/upload/')
+        self.link_prefix = '%s/link/%s/' % (base, container)
+        self.lookup_path = base + '/lookup'
+        self.url = url
+        self.jobs = jobs
+        self.timeout = timeout
+        self.dedup = dedup
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            self.connections += 1
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    @staticmethod
+    def _request(connection, method, path, body=None, headers=None):
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        data = response.read()
+        if not 200 <= response.status < 300:
+            raise ResponseError(response.status, response.reason)
+        return data
+
+    def put(self, connection, root, path, digest=None):
+        """Send a file, return its size."""
+        size = os.path.getsize(os.path.join(root, path))
+        headers = {
+            'Content-Length': str(size),
+            'Content-Type': 'application/octet-stream',
+        }
+        if digest is not None:
+            headers['X-Checksum-Sha256'] = digest
+        with open(os.path.join(root, path), 'rb') as body:
+            self._request(connection, 'PUT', self.prefix + quote(path),
+                          body, headers)
+        return size
+
+    def link(self, connection, path, digest):
+        """Have the server store the blob of a digest at path."""
+        self._request(connection, 'PUT', self.link_prefix + quote(path),
+                      b'', {'Content-Length': '0',
+                            'X-Checksum-Sha256': digest})
+
+    def lookup(self, digests):
+        """Return the digests held by the server, or None if unsupported."""
+        digests = sorted(digests)
+        present = set()
+        connection = self._connect()
+        try:
+            for index in range(0, len(digests), LOOKUP_BATCH):
+                body = json.dumps(
+                    {'sha256': digests[index:index + LOOKUP_BATCH]})
+                answer = self._request(
+                    connection, 'POST', self.lookup_path, body.encode(),
+                    {'Content-Type': 'application/json'})
+                present.update(json.loads(answer.decode())['sha256'])
+        except (EnvironmentError, HTTPException, ValueError, KeyError):
+            return None
+        finally:
+            connection.close()
+        return present
+
+    def _pool(self, func, items, connect=True):
+        """Call ``func(connection, item)`` on items from parallel threads.
+
+        Returns the list of ``(item, result, error)`` tuples, in no
+        particular order.
+
+        """
+        queue = Queue()
+        for item in items:
+            queue.put(item)
+        results = []
+
+        def work():
+            connection = self._connect() if connect else None
+            reused = False
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    break
+                while True:
+                    try:
+                        results.append((item, func(connection, item), None))
+                        reused = True
+                        break
+                    except (EnvironmentError, HTTPException) as exc:
+                        if connection is not None:
+                            # the connection may be in any state
+                            connection.close()
+                            connection = self._connect()
+                        if reused and not isinstance(exc, ResponseError):
+                            # the server may have closed an idle connection
+                            reused = False
+                            continue
+                        results.append((item, None, exc))
+                        break
+            if connection is not None:
+                connection.close()
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(max(1, min(self.jobs, queue.qsize())))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def upload(self, root, paths, previous=None, journal=None):
+        """Upload files, return the manifest of the upload.
+
+        Args:
+            root (str): directory the paths are relative to.
+            paths (iterable): paths of the files to upload.
+            previous (dict): results of a previous upload to the same url,
+                by path; the files it sent which did not change size since
+                are not sent again.
+            journal (file): where to write the result of every file sent,
+                as soon as it is known, one JSON object per line.
+
+        """
+        start = time.time()
+        previous = previous or {}
+        results = []
+        pending = []
+        for path in paths:
+            done = previous.get(path)
+            try:
+                unchanged = (
+                    done is not None
+                    and done['status'] in ('uploaded', 'linked')
+                    and done['size'] == os.path.getsize(
+                        os.path.join(root, path)))
+            except EnvironmentError:
+                # the file is gone, sending it again reports the failure
+                unchanged = False
+            if unchanged:
+                result = dict(done, resumed=True)
+                result.pop('seconds', None)
+                results.append(result)
+            else:
+                pending.append(path)
+
+        digests = {}
+        present = set()
+        dedup = self.dedup
+        if dedup:
+            digests = dict(
+                (path, digest) for path, digest, _ in self._pool(
+                    lambda _, path: sha256sum(os.path.join(root, path)),
+                    pending, connect=False)
+                if digest is not None)
+            present = self.lookup(set(digests.values()))
+            if present is None:
+                dedup, present = False, set()
+
+        def send(connection, path):
+            begin = time.time()
+            result = {'path': path, 'size': None}
+            digest = digests.get(path)
+            if digest is not None:
+                result['digest'] = digest
+            if digest in present:
+                try:
+                    self.link(connection, path, digest)
+                    result['size'] = os.path.getsize(
+                        os.path.join(root, path))
+                    result['status'] = 'linked'
+                except ResponseError as exc:
+                    # the blob may be gone since the lookup
+                    if exc.status not in (404, 409):
+                        raise
+            if 'status' not in result:
+                result['size'] = self.put(connection, root, path, digest)
+                result['status'] = 'uploaded'
+            result['seconds'] = round(time.time() - begin, 6)
+            if journal is not None:
+                with self._lock:
+                    journal.write(json.dumps(result) + '\n')
+                    journal.flush()
+            return result
+
+        for path, result, error in self._pool(send, pending):
+            if error is not None:
+                result = {'path': path, 'size': None, 'status': 'failed',
+                          'error': str(error) or error.__class__.__name__}
+            results.append(result)
+
+        results.sort(key=lambda result: result['path'])
+        resumed = [r for r in results if r.get('resumed')]
+        sent = [r for r in results if not r.get('resumed')]
+        uploaded = [r for r in sent if r['status'] == 'uploaded']
+        linked = [r for r in sent if r['status'] == 'linked']
+        return {
+            'url': self.url,
+            'dedup': dedup,
+            'files': results,
+            'uploaded': len(uploaded),
+            'linked': len(linked),
+            'resumed': len(resumed),
+            'failed': len(sent) - len(uploaded) - len(linked),
+            'bytes': sum(r['size'] for r in uploaded),
+            'linked_bytes': sum(r['size'] for r in linked),
+            'resumed_bytes': sum(r['size'] for r in resumed),
+            'seconds': round(time.time() - start, 6),
+            'connections': self.connections,
+        }
+
+
+def load_previous(path, url):
+    """Return the results of the previous upload to url, by path.
+
+    They are read from the manifest at path or, when the previous upload
+    did not complete, from its journal.
+
+    """
+    results = []
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('url') == url:
+            results = manifest['files']
+    except (EnvironmentError, ValueError, KeyError):
+        try:
+            with open(path + '.journal') as journal:
+                header = json.loads(journal.readline())
+                if header.get('url') == url:
+                    # the last line may be truncated
+                    for line in journal:
+                        try:
+                            results.append(json.loads(line))
+                        except ValueError:
+                            break
+        except (EnvironmentError, ValueError):
+            pass
+    return dict((result['path'], result) for result in results)
+
+
+def write_manifest(path, manifest):
+    """Write the manifest atomically."""
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.rename(path + '.tmp', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('url', help='url of the artifacts container')
+    parser.add_argument('--manifest', required=True,
+                        help='where to write the manifest of the upload')
+    parser.add_argument('--jobs', type=int, default=16,
+                        help='number of parallel connections')
+    parser.add_argument('--max-time', type=float, default=600,
+                        help='timeout of each network operation')
+    parser.add_argument('--dedup', action='store_true',
+                        help='only send the files unknown to the server')
+    parser.add_argument('--resume', action='store_true',
+                        help='do not send again the files sent by the '
+                        'previous upload to the same url')
+    args = parser.parse_args(argv)
+
+    previous = load_previous(args.manifest, args.url) if args.resume else {}
+    # never leave the manifest of a previous upload behind
+    for path in (args.manifest, args.manifest + '.journal'):
+        if os.path.exists(path):
+            os.remove(path)
+
+    uploader = Uploader(args.url, jobs=args.jobs, timeout=args.max_time,
+                        dedup=args.dedup)
+    paths = walk('.', exclude=[os.path.abspath(__file__), args.manifest,
+                               args.manifest + '.tmp',
+                               args.manifest + '.journal'])
+    directory = os.path.dirname(os.path.abspath(args.manifest))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(args.manifest + '.journal', 'w') as journal:
+        journal.write(json.dumps({'url': args.url}) + '\n')
+        manifest = uploader.upload('.', paths, previous, journal)
+    write_manifest(args.manifest, manifest)
+    os.remove(args.manifest + '.journal')
+
+    for result in manifest['files']:
+        if result['status'] == 'failed':
+            sys.stderr.write('failed to upload %s: %s\n' % (
+                result['path'], result['error']))
+    if manifest['resumed']:
+        sys.stdout.write('skipped %d files (%d bytes) sent by the previous '
+                         'upload\n' % (manifest['resumed'],
+                                       manifest['resumed_bytes']))
+    sys.stdout.write(
+        'uploaded %d files (%d bytes), linked %d files (%d bytes) in %.1fs '
+        'over %d connections, %d failed\n' % (
+            manifest['uploaded'], manifest['bytes'], manifest['linked'],
+            manifest['linked_bytes'], manifest['seconds'],
+            manifest['connections'], manifest['failed']))
+    return 1 if manifest['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
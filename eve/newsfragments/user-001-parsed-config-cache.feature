@@ -0,0 +1 @@
+Cache parsed yaml configurations by content hash on the master.
@@ -0,0 +1 @@
+Select the stage of a branch with a compiled branch-pattern index.
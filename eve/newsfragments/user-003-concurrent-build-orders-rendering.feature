@@ -0,0 +1 @@
+Render the properties of all triggered stages concurrently.
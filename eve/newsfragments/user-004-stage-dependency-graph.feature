@@ -0,0 +1 @@
+Stages can declare `depends_on`; TriggerStages then starts each stage as soon as its dependencies succeed, cancels downstream stages on failure and reports the critical path.
@@ -0,0 +1 @@
+Count the running builds used by `simultaneous_builds` from the build messages instead of querying the database for every pending request. The running builds of all the builders are loaded from the database when the master starts, then every `RUNNING_BUILDS_RECONCILE_INTERVAL` seconds.
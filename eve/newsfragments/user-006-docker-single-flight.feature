@@ -0,0 +1 @@
+Docker image operations now lock per image instead of master-wide: identical concurrent builds, pulls and pushes run once, and `DOCKER_MAX_CONCURRENT_OPERATIONS` caps the operations running together.
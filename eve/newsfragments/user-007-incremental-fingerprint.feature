@@ -0,0 +1 @@
+Compute docker context fingerprints on the master from a persistent per-file index, rehashing only the files that changed.
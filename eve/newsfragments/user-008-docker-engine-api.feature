@@ -0,0 +1 @@
+Docker workers can talk to the docker daemon through its API over a pool of keep-alive unix socket connections (`DOCKER_WORKER_BACKEND=api`); the command line client remains the default.
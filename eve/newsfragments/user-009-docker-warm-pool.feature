@@ -0,0 +1 @@
+Docker workers can stay up between builds of frequently used images (`DOCKER_WARM_POOL_SIZE`, `DOCKER_WARM_POOL_TTL`, `DOCKER_WARM_POOL_WINDOW`), so that the next compatible build skips the container start; disabled by default.
@@ -0,0 +1 @@
+Kubernetes pod workers follow their pods with a single shared watch on the `app=eve` pods instead of polling the status of each pod from a sleeping thread.
@@ -0,0 +1 @@
+Kube pod workers share a single kubernetes API client: its credentials are loaded once and refreshed periodically (`KUBE_CLIENT_REFRESH_INTERVAL`) or when rejected, its connections are pooled, and the latency of its calls is logged as histograms.
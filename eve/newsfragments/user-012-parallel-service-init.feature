@@ -0,0 +1 @@
+Kube pod stages requesting a `worker_service` create their worker pod while the service is initialized, and hold the worker until the init is done; the service teardown no longer delays the next build of the worker.
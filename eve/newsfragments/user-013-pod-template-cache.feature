@@ -0,0 +1 @@
+Kube pod workers compile each worker template once and reuse the validated pod of builds rendering it with the same images and variables; the hit rates of both caches are available from `TEMPLATE_CACHE` and `POD_CACHE`.
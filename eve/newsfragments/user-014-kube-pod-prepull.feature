@@ -0,0 +1 @@
+Kube pod stages can pull their images on the cluster as soon as they are in the registry (`KUBE_POD_PREPULL`); the worker pod prefers the node of the placeholder pod, which is deleted once the worker pod runs or after `KUBE_POD_PREPULL_DEADLINE` seconds.
@@ -0,0 +1 @@
+Kube pod workers can be given a cpu and memory budget for the pods of the namespace (`KUBE_POD_CPU_BUDGET`, `KUBE_POD_MEMORY_BUDGET`); build requests whose pod does not fit stay queued on the master until running pods release their resources, and the queue depth and wait times are logged.
@@ -0,0 +1 @@
+The pods left behind by the kube workers of a master, for instance after it crashed, are deleted in bulk when it starts then periodically, with one collection delete per worker (`KUBE_POD_REAPER_INTERVAL`, `KUBE_POD_REAPER_MIN_AGE`).
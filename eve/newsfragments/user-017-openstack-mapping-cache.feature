@@ -0,0 +1 @@
+The OpenStack mapping file and the default heat worker scripts are read once and cached until they change on disk, and the mapping is indexed for constant time lookups.
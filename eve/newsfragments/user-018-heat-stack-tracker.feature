@@ -0,0 +1 @@
+The status of the heat stacks of the OpenStack workers is polled for all stacks at once, more often right after a change and less while nothing happens, and stacks are deleted in the background instead of holding the end of the stage.
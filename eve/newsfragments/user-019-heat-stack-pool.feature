@@ -0,0 +1 @@
+OpenStack workers can keep their heat stack once their build is done, when their image and flavor are in demand (`OS_STACK_POOL_SIZE`, `OS_STACK_POOL_TTL`, `OS_STACK_POOL_WINDOW`), and builds rendering the same stack start on them without waiting for a new stack.
@@ -0,0 +1 @@
+The parameters of the heat stacks render concurrently, the OpenStack mapping and worker scripts are read out of the reactor thread, and the render time of each parameter is recorded, and logged when a render is slow.
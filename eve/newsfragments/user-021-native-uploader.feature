@@ -0,0 +1 @@
+Upload artifacts with a worker-side uploader streaming files over keep-alive connections and reporting per-file results in a manifest.
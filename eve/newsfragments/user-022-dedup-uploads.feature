@@ -0,0 +1 @@
+Artifacts uploads can skip the files whose content the artifacts already hold, which are then copied on the server side (dedup option of Upload, ARTIFACTS_DEDUP).
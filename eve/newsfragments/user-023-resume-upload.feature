@@ -0,0 +1 @@
+Retries of a failed artifacts upload only send the files which failed or were not sent, and report the bytes saved in a retry log.
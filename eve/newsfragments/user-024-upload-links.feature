@@ -0,0 +1 @@
+The links of an upload are found in the manifest of the uploader, matching all the url patterns in a single pass instead of running find for each of them.
@@ -0,0 +1 @@
+The artifacts and commit revision steps read their logs as they stream and only keep the lines they need, instead of buffering the whole output in the master.
@@ -0,0 +1,143 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Log observers keeping only what the steps need from their logs.
+
+Unlike `buildbot.process.logobserver.BufferLogObserver`, which keeps the
+whole output of a command in the memory of the master until the step is
+complete, these observers read the log line by line as it streams and
+only keep the lines, or parts of lines, they are looking for.
+
+"""
+
+from buildbot.process.logobserver import LogObserver
+
+
+class StreamingLineObserver(LogObserver):
+    """Call `lineReceived` for each line of a log, as it streams.
+
+    Empty lines are kept, and lines cut across chunks of data are put back
+    together. Only the beginning of a line longer than ``max_line_length``
+    is kept.
+
+    Args:
+        streams (str): the streams to read, ``'o'`` for stdout and ``'e'``
+            for stderr.
+        max_line_length (int): maximum number of characters kept per line.
+
+    """
+
+    def __init__(self, streams='o', max_line_length=16384):
+        super(StreamingLineObserver, self).__init__()
+        self.streams = streams
+        self.max_line_length = max_line_length
+        self._partial = {}
+
+    def _dataReceived(self, stream, data):
+        if stream not in self.streams:
+            return
+        lines = data.split('\n')
+        partial = self._partial.pop(stream, '')
+        lines[0] = partial + lines[0]
+        for line in lines[:-1]:
+            self.lineReceived(stream, line[:self.max_line_length])
+        if lines[-1]:
+            self._partial[stream] = lines[-1][:self.max_line_length]
+
+    def outReceived(self, data):
+        self._dataReceived('o', data)
+
+    def errReceived(self, data):
+        self._dataReceived('e', data)
+
+    def finishReceived(self):
+        for stream, line in sorted(self._partial.items()):
+            self.lineReceived(stream, line)
+        self._partial = {}
+
+    def lineReceived(self, stream, line):
+        raise NotImplementedError
+
+
+class FirstMatchObserver(StreamingLineObserver):
+    """Keep the first line matching each of a set of regular expressions.
+
+    Args:
+        patterns (dict): compiled regular expressions, by name, searched
+            in each line.
+        streams (str): the streams to read, as in `StreamingLineObserver`.
+
+    Attributes:
+        matches (dict): the match object of the first line matching each
+            pattern, by name.
+
+    """
+
+    def __init__(self, patterns, streams='o', **kwargs):
+        super(FirstMatchObserver, self).__init__(streams, **kwargs)
+        self.patterns = patterns
+        self.matches = {}
+
+    def lineReceived(self, stream, line):
+        if len(self.matches) == len(self.patterns):
+            return
+        for name, pattern in self.patterns.items():
+            if name in self.matches:
+                continue
+            match = pattern.search(line)
+            if match is not None:
+                self.matches[name] = match
+
+
+class BlockObserver(StreamingLineObserver):
+    """Keep the blocks of lines following some header lines.
+
+    A block is made of the lines following a header, up to the next empty
+    line. Only the first block following each header is kept.
+
+    Attributes:
+        headers (set): the header lines to look for.
+        blocks (dict): the lines of the block of each header found.
+
+    """
+
+    def __init__(self, headers=(), **kwargs):
+        super(BlockObserver, self).__init__(**kwargs)
+        self.headers = set(headers)
+        self.blocks = {}
+        self._current = None
+
+    def lineReceived(self, stream, line):
+        if self._current is not None:
+            if line == '':
+                self._current = None
+            else:
+                self._current.append(line)
+        elif line in self.headers and line not in self.blocks:
+            self._current = self.blocks[line] = []
+
+
+def replace_log_observer(step, logname, old, new):
+    """Replace an observer added to a step before its log is created.
+
+    For steps replacing the observer set up by their parent class, which
+    would otherwise also see the whole log.
+
+    """
+    # pylint: disable=protected-access
+    step._pendingLogObservers.remove((logname, old))
+    step.addLogObserver(logname, new)
@@ -16,18 +16,27 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor,
 # Boston, MA  02110-1301, USA.
 
+import random
+
 from buildbot.config import BuilderConfig
 from buildbot.plugins import steps, util
 from buildbot.process.factory import BuildFactory
 from buildbot.util.logger import Logger
 from twisted.internet import defer
 
+from ..util.running_builds import RunningBuildsReconciler, get_running_builds
+
 log = Logger()
 
 
 @defer.inlineCallbacks
 def canStartBuild(builder, wfb, request):
-    """Ensure we can run simultaneous builds on a stage."""
+    """Ensure we can run simultaneous builds on a stage.
+
+    Workers with an ``admit`` method (see `EveKubeLatentWorker`) may also
+    hold the request until they have the resources to run it.
+
+    """
     log.debug('Checking if we can start...')
     simultaneous_builds = request.properties.getProperty('simultaneous_builds')
     if simultaneous_builds:
@@ -35,7 +44,8 @@ def canStartBuild(builder, wfb, request):
             simultaneous_builds = int(simultaneous_builds)
         except ValueError:
             # When the object can be casted into an int ignore the value
-            return True
+            simultaneous_builds = None
+    if simultaneous_builds:
         log.debug('%d simultaneous builds are allowed' % simultaneous_builds)
         name = request.properties.getProperty(
             'virtual_builder_name',
@@ -43,16 +53,56 @@ def canStartBuild(builder, wfb, request):
         )
         builderid = yield builder.getBuilderIdForName(name)
         log.debug('Checking running builds for %s...' % name)
-        builds = yield builder.master.db.builds.getBuilds(
-            builderid=builderid,
-            complete=False
-        )
-        running_builds = len(builds)
+        running_builds = yield get_running_builds(
+            builder.master,
+            util.env.RUNNING_BUILDS_RECONCILE_INTERVAL
+        ).count(builderid)
         log.debug('%d builds are running for %s' % (running_builds, name))
-        return simultaneous_builds > running_builds
+        if simultaneous_builds <= running_builds:
+            return False
+
+    admit = getattr(getattr(wfb, 'worker', None), 'admit', None)
+    if admit is not None:
+        admitted = yield admit(request)
+        return admitted
     return True
 
 
+@defer.inlineCallbacks
+def nextWorker(builder, wfbs, request):
+    """Prefer the workers whose running instance suits the build.
+
+    Docker workers and heat stacks kept warm between builds (see
+    `DockerWarmPool` and `HeatStackPool`) are picked first when they can
+    run the request; otherwise a worker without instance is preferred, so
+    that the warm ones stay available. When all the workers are warm with
+    other instances, the one idle for the longest time is stopped and the
+    request waits for it.
+
+    """
+    if not wfbs:
+        return None
+    fresh = []
+    warm = []
+    for wfb in wfbs:
+        if (getattr(wfb.worker, 'container_spec', None) is None
+                and getattr(wfb.worker, 'stack_spec', None) is None):
+            fresh.append(wfb)
+            continue
+        compatible = yield wfb.worker.isCompatibleWithBuild(
+            request.properties)
+        if compatible:
+            log.debug('Reusing warm worker %s' % wfb.worker.name)
+            return wfb
+        warm.append(wfb.worker)
+    if fresh:
+        return random.choice(fresh)
+    make_room = getattr(warm[0], 'make_room', None)
+    if make_room is not None and make_room(warm):
+        return None
+    return random.choice(wfbs)
+
+
 def triggerable_builder(builder_name, workers):
     factory = BuildFactory()
     factory.addStep(steps.CancelOldBuild(name='prevent unuseful restarts'))
@@ -84,4 +134,11 @@ def triggerable_builder(builder_name, workers):
         workernames=[w.name for w in workers],
         factory=factory,
         collapseRequests=False,
-        canStartBuild=canStartBuild)
+        canStartBuild=canStartBuild,
+        nextWorker=nextWorker)
+
+
+def running_builds_reconciler():
+    """Return the service loading the running builds of the builders."""
+    return RunningBuildsReconciler(
+        interval=util.env.RUNNING_BUILDS_RECONCILE_INTERVAL)
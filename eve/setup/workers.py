@@ -24,9 +24,41 @@ from buildbot import version
 from buildbot.plugins import util, worker
 from buildbot.process.properties import Property, Transform
 from buildbot.worker.local import LocalWorker
+from twisted.internet import defer, threads
 from twisted.logger import Logger
 from twisted.python.reflect import namedModule
 
+from ..util.cache import FileCache
+from ..worker.docker.engine_api import (DockerEngineClient,
+                                        socket_path_from_docker_host)
+from ..worker.docker.warm_pool import DockerWarmPool
+from ..worker.kubernetes.admission import AdmissionController
+from ..worker.kubernetes.api_client import KubeClient
+from ..worker.kubernetes.pod_reaper import KubePodReaper
+from ..worker.openstack_heat.openstack_heat_worker import heat_client
+from ..worker.openstack_heat.stack_pool import HeatStackPool
+from ..worker.openstack_heat.stack_tracker import StackTracker
+
+# the mapping and scripts are read at every start of a heat worker
+OPENSTACK_MAPPINGS = FileCache()
+WORKER_SCRIPTS = FileCache()
+
+
+class ThreadedTransform(Transform):
+    """A `Transform` whose function is called in a thread.
+
+    For functions reading files, which must not block the reactor.
+
+    """
+
+    @defer.inlineCallbacks
+    def getRenderingFor(self, iprops):
+        rfunction = yield iprops.render(self._function)
+        rargs = yield iprops.render(self._args)
+        rkwargs = yield iprops.render(self._kwargs)
+        result = yield threads.deferToThread(rfunction, *rargs, **rkwargs)
+        defer.returnValue(result)
+
 
 def local_workers():
     workers = []
@@ -40,8 +72,38 @@ def local_workers():
     return workers
 
 
+def docker_engine():
+    """Return the docker engine API client shared by the docker workers.
+
+    Returns `None` when the docker workers use the command line client.
+
+    """
+    if util.env.DOCKER_WORKER_BACKEND == 'cli':
+        return None
+    assert util.env.DOCKER_WORKER_BACKEND == 'api', (
+        'DOCKER_WORKER_BACKEND must be either cli or api')
+    socket_path = socket_path_from_docker_host(util.env.DOCKER_HOST)
+    assert socket_path, 'the docker api backend requires a unix DOCKER_HOST'
+    return DockerEngineClient(
+        socket_path=socket_path,
+        api_version=util.env.DOCKER_API_VERSION or None,
+        pool_size=util.env.MAX_DOCKER_WORKERS)
+
+
+def docker_warm_pool():
+    """Return the warm pool of the docker workers, if enabled."""
+    if util.env.DOCKER_WARM_POOL_SIZE <= 0:
+        return None
+    return DockerWarmPool(
+        max_idle_per_image=util.env.DOCKER_WARM_POOL_SIZE,
+        ttl=util.env.DOCKER_WARM_POOL_TTL,
+        window=util.env.DOCKER_WARM_POOL_WINDOW)
+
+
 def docker_workers():
     workers = []
+    engine = docker_engine()
+    warm_pool = docker_warm_pool()
     for i in range(util.env.MAX_DOCKER_WORKERS):
         workers.append(
             worker.EveDockerLatentWorker(
@@ -53,11 +115,33 @@ def docker_workers():
                 max_cpus=util.env.DOCKER_CONTAINER_MAX_CPU,
                 image=Property('docker_image'),
                 keepalive_interval=300,
+                engine=engine,
+                warm_pool=warm_pool,
             ))
     return workers
 
 
-def kube_pod_workers():
+def kube_admission():
+    """Return the admission controller of the kube workers, if enabled."""
+    if not (util.env.KUBE_POD_CPU_BUDGET or util.env.KUBE_POD_MEMORY_BUDGET):
+        return None
+    cpu_budget = memory_budget = None
+    if util.env.KUBE_POD_CPU_BUDGET:
+        cpu_budget = util.convert_to_cpus(util.env.KUBE_POD_CPU_BUDGET)
+    if util.env.KUBE_POD_MEMORY_BUDGET:
+        memory_budget = util.convert_to_bytes(util.env.KUBE_POD_MEMORY_BUDGET)
+    return AdmissionController(cpu_budget=cpu_budget,
+                               memory_budget=memory_budget)
+
+
+def kube_client():
+    """Return the kubernetes API client shared by the kube services."""
+    return KubeClient(
+        pool_size=util.env.MAX_KUBE_POD_WORKERS,
+        refresh_interval=util.env.KUBE_CLIENT_REFRESH_INTERVAL)
+
+
+def kube_pod_workers(client=None):
     workers = []
     NodeAffinity = namedtuple('NodeAffinity', ('key', 'value'))
     node_affinity = None
@@ -72,6 +156,9 @@ def kube_pod_workers():
         service_data = util.env.KUBE_SERVICE_DATA
         assert service
 
+    # a single pool of connections and credentials for all the workers
+    client = client or kube_client()
+    admission = kube_admission()
     for i in range(util.env.MAX_KUBE_POD_WORKERS):
         workers.append(
             worker.EveKubeLatentWorker(
@@ -89,57 +176,113 @@ def kube_pod_workers():
                 active_deadline=util.env.KUBE_POD_ACTIVE_DEADLINE,
                 service=service,
                 service_data=service_data,
+                kube_client=client,
+                admission=admission,
             ))
     return workers
 
 
-def openstack_mapping(provider, field, value, region=None):
+def kube_pod_reaper(workers, client=None):
+    """Return the reaper of the stale pods of the workers, if enabled."""
+    if util.env.KUBE_POD_REAPER_INTERVAL <= 0:
+        return None
+    return KubePodReaper(
+        namespace=util.env.KUBE_POD_NAMESPACE,
+        workernames=[w.name for w in workers],
+        interval=util.env.KUBE_POD_REAPER_INTERVAL,
+        min_age=util.env.KUBE_POD_REAPER_MIN_AGE,
+        kube_client=client or kube_client())
+
+
+def index_openstack_mapping(mapping, on_error=None):
+    """Index the entries of an openstack mapping file.
+
+    The first entry of a provider matching a field and value wins, and
+    the entries following an invalid one are ignored, as for a scan of
+    the file.
+
+    Args:
+        mapping (dict): the contents of the mapping file.
+        on_error (callable): called with the errors found in the file.
+
+    Returns:
+        A dict of the new values indexed by ``(provider, field, original
+        value)``, and the set of the providers of the file.
+
+    """
+    on_error = on_error or (lambda err: None)
+    if not isinstance(mapping, dict):
+        on_error('the mapping is not a dict')
+        return {}, set()
+
+    index = {}
+    for provider, provider_map in mapping.items():
+        broken_fields = set()
+        for chunk in provider_map or []:
+            try:
+                field_sections = list(chunk.items())
+            except AttributeError as err:
+                on_error(err)
+                break
+            for field, field_section in field_sections:
+                if field in broken_fields or not field_section:
+                    continue
+                try:
+                    original_value = field_section['original_value']
+                    new_value = field_section['new_value']
+                except (AttributeError, KeyError, TypeError) as err:
+                    on_error(err)
+                    broken_fields.add(field)
+                    continue
+                if new_value is None:
+                    continue
+                try:
+                    index.setdefault(
+                        (provider, field, original_value), new_value)
+                except TypeError as err:
+                    on_error(err)
+    return index, set(mapping)
+
+
+def load_openstack_mapping(path):
     logger = Logger('eve.setup.workers')
 
-    mapping = {}
+    def error_openstack_mapping(err):
+        logger.error('An error occured while loading the mapping file at '
+                     '{path}: {err}', path=path, err=err)
+
+    with open(path) as mapping_file:
+        mapping = yaml.load(mapping_file.read())
+    return index_openstack_mapping(mapping, error_openstack_mapping)
+
+
+def openstack_mapping(provider, field, value, region=None):
+    logger = Logger('eve.setup.workers')
     mapping_path = util.env.OS_MAPPING_FILE_PATH
 
-    def error_openstack_mapping(err):
+    try:
+        index, providers = OPENSTACK_MAPPINGS.get(mapping_path,
+                                                  load_openstack_mapping)
+    except (OSError, IOError, yaml.YAMLError) as err:
         logger.error('An error occured while loading the mapping file at '
                      '{path}: {err}', path=mapping_path, err=err)
+        return value
 
     if region:
         provider_id = '{0}_{1}'.format(provider, region)
     else:
         provider_id = provider
+    if provider_id not in providers:
+        provider_id = provider
     try:
-        with open(mapping_path) as mapping_file:
-            mapping = yaml.load(mapping_file.read())
-    except (OSError, IOError, yaml.YAMLError) as err:
-        error_openstack_mapping(err)
+        return index.get((provider_id, field, value), value)
+    except TypeError:
         return value
 
-    try:
-        provider_map = mapping[provider_id]
-    except KeyError:
-        try:
-            provider_map = mapping[provider]
-        except KeyError:
-            provider_map = []
-
-    for chunk in provider_map:
-        try:
-            field_section = chunk.get(field, None)
-        except AttributeError as err:
-            error_openstack_mapping(err)
-            break
-        if not field_section:
-            continue
-
-        try:
-            original_value = field_section['original_value']
-            new_value = field_section['new_value']
-        except (AttributeError, KeyError) as err:
-            error_openstack_mapping(err)
-            break
-        if original_value == value and new_value is not None:
-            return new_value
-    return value
+
+def read_file(path):
+    with open(path) as file_:
+        return file_.read()
 
 
 def openstack_worker_script(default_script_path, user_script_contents):
@@ -158,9 +301,10 @@ def openstack_worker_script(default_script_path, user_script_contents):
         return user_script_contents
 
     try:
-        with open(join(dirname(dirname(abspath(__file__))), 'bin',
-                  default_script_path)) as script:
-            contents = script.read()
+        contents = WORKER_SCRIPTS.get(
+            join(dirname(dirname(abspath(__file__))), 'bin',
+                 default_script_path),
+            read_file)
     except (OSError, IOError) as err:
         logger.error('An error occured while loading the default script file '
                      '{path}: {err}', path=default_script_path, err=err)
@@ -169,19 +313,29 @@ def openstack_worker_script(default_script_path, user_script_contents):
     return contents
 
 
+def openstack_stack_pool():
+    """Return the pool of the heat stacks, if enabled."""
+    if util.env.OS_STACK_POOL_SIZE <= 0:
+        return None
+    return HeatStackPool(
+        max_idle_per_flavor=util.env.OS_STACK_POOL_SIZE,
+        ttl=util.env.OS_STACK_POOL_TTL,
+        window=util.env.OS_STACK_POOL_WINDOW)
+
+
 def openstack_heat_workers():
     workers = []
     template = open(join(dirname(dirname(abspath(__file__))), 'etc',
                          'single_node_heat_template.yml')).read()
 
     params = {
-        'flavor': Transform(
+        'flavor': ThreadedTransform(
             openstack_mapping,
             provider=util.env.OS_PROVIDER,
             field="flavor",
             value=Property('openstack_flavor'),
             region=util.env.OS_REGION_NAME),
-        'image': Transform(
+        'image': ThreadedTransform(
             openstack_mapping,
             provider=util.env.OS_PROVIDER,
             field="image",
@@ -193,19 +347,19 @@ def openstack_heat_workers():
         'network_private': util.env.OS_NETWORK_PRIVATE,
         'network_public': util.env.OS_NETWORK_PUBLIC,
         'network_service': util.env.OS_NETWORK_SERVICE,
-        'script_boot': Transform(
+        'script_boot': ThreadedTransform(
             openstack_worker_script,
             default_script_path=util.env.OS_SCRIPT_BOOT_FILE_PATH,
             user_script_contents=None),
-        'script_init': Transform(
+        'script_init': ThreadedTransform(
             openstack_worker_script,
             default_script_path=util.env.OS_SCRIPT_INIT_FILE_PATH,
             user_script_contents=Property('init.sh')),
-        'script_requirements': Transform(
+        'script_requirements': ThreadedTransform(
             openstack_worker_script,
             default_script_path=util.env.OS_SCRIPT_REQUIREMENTS_FILE_PATH,
             user_script_contents=Property('requirements.sh')),
-        'script_start': Transform(
+        'script_start': ThreadedTransform(
             openstack_worker_script,
             default_script_path=util.env.OS_SCRIPT_START_FILE_PATH,
             user_script_contents=Property('start.sh')),
@@ -217,6 +371,12 @@ def openstack_heat_workers():
         'redhat_activationkey': util.env.REDHAT_ACTIVATIONKEY,
     }
 
+    # a single client and poll loop for the stacks of all the workers
+    stack_tracker = StackTracker(heat_client(
+        util.env.OS_AUTH_URL, util.env.OS_USERNAME, util.env.OS_PASSWORD,
+        util.env.OS_PROJECT_DOMAIN_ID, util.env.OS_TENANT_NAME,
+        util.env.OS_REGION_NAME, util.env.OS_IDENTITY_API_VERSION))
+    stack_pool = openstack_stack_pool()
     for i in range(util.env.MAX_OPENSTACK_WORKERS):
         name = 'hw%03d-%s' % (i, util.env.SUFFIX)
         password = util.password_generator()
@@ -237,6 +397,7 @@ def openstack_heat_workers():
                 os_project_name=util.env.OS_TENANT_NAME,
                 os_region_name=util.env.OS_REGION_NAME,
                 os_identity_api_version=util.env.OS_IDENTITY_API_VERSION,
-                build_wait_timeout=0,  # do not reuse the stack
+                stack_tracker=stack_tracker,
+                stack_pool=stack_pool,
                 keepalive_interval=300))
     return workers
@@ -17,20 +17,32 @@
 # Boston, MA  02110-1301, USA.
 """Steps allowing eve to interact with artifacts."""
 
+import fnmatch
+import json
 import os
 import re
+import shlex
 from collections import defaultdict
 
 from buildbot.plugins import util
-from buildbot.process import logobserver
 from buildbot.process.properties import Interpolate
 from buildbot.process.results import FAILURE, SKIPPED
 from buildbot.steps.shell import ShellCommand
+from buildbot.steps.worker import CompositeStepMixin
 from packaging import version
 from twisted.internet import defer, reactor
 
+from ..process.logobserver import (BlockObserver, FirstMatchObserver,
+                                   replace_log_observer)
+from ..util.cache import FileCache
 from .property import EvePropertyFromCommand
 
+UPLOADER = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'bin',
+                        'eve_upload.py')
+"""Path of the uploader run on the workers by `Upload`."""
+
+UPLOADER_SCRIPTS = FileCache()
+
 
 def get_artifacts_base_name():
     """Give containing the base name of artifacts container."""
@@ -77,15 +89,20 @@ class GetArtifactsFromStage(EvePropertyFromCommand):
             ],
             **kwargs
         )
-        self.observer = logobserver.BufferLogObserver(wantStdout=True,
-                                                      wantStderr=True)
-        self.addLogObserver('stdio', self.observer)
+        # only keep the lines needed from the output of curl
+        observer = FirstMatchObserver({
+            'location': re.compile('^Location: .*/download/([^/]+)/$')})
+        replace_log_observer(self, 'stdio', self.observer, observer)
+        self.observer = observer
+        self.error_observer = FirstMatchObserver({
+            'notfound': re.compile(re.escape(
+                'curl: (22) The requested URL returned error: '
+                '404 Not Found'))}, streams='e')
+        self.addLogObserver('stdio', self.error_observer)
 
     def commandComplete(self, cmd):  # NOQA flake8 to ignore camelCase
         if cmd.didFail():
-            notfound = ('curl: (22) The requested URL returned error: '
-                        '404 Not Found')
-            if notfound in self.observer.getStderr():
+            if 'notfound' in self.error_observer.matches:
                 self.stdio_log.addStderr('No artifacts found for this git '
                                          'commit, this may mean they are '
                                          'expired.\n')
@@ -93,12 +110,9 @@ class GetArtifactsFromStage(EvePropertyFromCommand):
 
         # parse the response headers to get the container from redirection
         artifacts_name = 'fatal: unable to parse artifacts name'
-        lines = self.observer.getStdout().splitlines()
-        for line in lines:
-            reg = re.search('^Location: .*/download/([^/]+)/$', line)
-            if reg:
-                artifacts_name = reg.group(1)
-                break
+        location = self.observer.matches.get('location')
+        if location is not None:
+            artifacts_name = location.group(1)
 
         self.setProperty(self.property, str(artifacts_name),
                          'GetArtifactsFromStage')
@@ -146,10 +160,64 @@ class SetArtifactsPrivateURL(EvePropertyFromCommand):
             logEnviron=False)
 
 
-class Upload(ShellCommand):
+def read_file(path):
+    with open(path) as file_:
+        return file_.read()
+
+
+class LinkMatcher(object):
+    """Find the paths matching a list of ``find -path`` patterns.
+
+    The patterns are compiled together, so that the paths which do not
+    match any of them, usually most of them, are rejected with a single
+    regular expression match.
+    """
+
+    def __init__(self, patterns):
+        regexps = [fnmatch.translate('./' + pattern) for pattern in patterns]
+        self.patterns = [re.compile(regexp) for regexp in regexps]
+        self.any = re.compile('|'.join(regexps)) if regexps else None
+
+    def matches(self, paths):
+        """Return the list of the paths matching each pattern.
+
+        Args:
+            paths (iterable): paths, relative to the uploaded directory
+                and starting with ``./`` as printed by ``find``.
+
+        """
+        matches = [[] for _ in self.patterns]
+        if self.any is None:
+            return matches
+        for path in paths:
+            if not self.any.match(path):
+                continue
+            for index, pattern in enumerate(self.patterns):
+                if pattern.match(path):
+                    matches[index].append(path)
+        return matches
+
+
+class Upload(ShellCommand, CompositeStepMixin):
     """Upload class to handle artifacts uploads.
 
     Compatible only with Artifacts version >= 3.
+
+    The files are sent by `eve_upload.py`, installed in the builder
+    directory before the upload, which streams them over a pool of
+    keep-alive connections and writes the result of every file in a
+    manifest (available in `manifest` once the step is complete). The
+    ``find | xargs | curl`` pipeline is used instead on workers without
+    python 2.7 or 3, or when the uploader could not be installed.
+
+    With ``dedup`` (``ARTIFACTS_DEDUP`` by default), the files are hashed
+    on the worker and only those whose content the artifacts do not hold
+    yet are sent; the others are copied from the stored content by the
+    artifacts, into the container of the build.
+
+    When the upload fails, it is retried (``retry`` is a ``(delay,
+    repeats)`` tuple) by a step which resumes it: only the files which
+    failed, or which the failed attempt did not get to, are sent again.
     """
 
     renderables = [
@@ -160,10 +228,26 @@ class Upload(ShellCommand):
     DEFAULT_UPLOAD_MAX_TIME = 3600
     """Maximum upload time, in seconds."""
 
-    def __init__(self, source, urls=None, **kwargs):
+    UPLOAD_JOBS = 16
+    """Number of parallel connections used to upload files."""
+
+    UPLOADER_DIR = '.eve'
+    """Directory of the builder where the uploader is installed."""
+
+    PYTHON_PROBE = ('PYTHON=$(command -v python3 || command -v python) && '
+                    '"$PYTHON" -c "import argparse" 2>/dev/null')
+    """Set ``PYTHON`` to a python able to run the uploader (not 2.6)."""
+
+    uploader = None
+    manifest = None
+
+    def __init__(self, source, urls=None, dedup=None, resume=False,
+                 **kwargs):
         name = kwargs.pop('name', 'send artifacts to artifact repository')
         self._retry = kwargs.pop('retry', (0, 1))
         self.source = source
+        self.dedup = dedup
+        self.resume = resume
         self._kwargs = kwargs
         self._urls = urls
         self._upload_max_time = kwargs.get(
@@ -180,12 +264,46 @@ class Upload(ShellCommand):
             maxTime=self._upload_max_time + 10,
             **kwargs
         )
-        self.observer = logobserver.BufferLogObserver(wantStdout=True,
-                                                      wantStderr=True)
+        # only keep the output of the find commands of the links
+        self.observer = BlockObserver()
         self.addLogObserver('stdio', self.observer)
 
+    @property
+    def manifest_path(self):
+        return os.path.join(self.getProperty('builddir'), self.UPLOADER_DIR,
+                            'upload-manifest.json')
+
     @property
     def upload_command(self):
+        legacy = self.legacy_upload_command + self.find_links_commands
+        if self.uploader is None:
+            return legacy
+        # the links are found in the manifest of the uploader
+        return [
+            ('if {probe}; then '
+             '"$PYTHON" {uploader} --manifest {manifest} --jobs {jobs} '
+             '--max-time {upload_time}{dedup}{resume} '
+             '"http://artifacts/upload/{container}/"; '
+             'else {legacy}; fi').format(
+                probe=self.PYTHON_PROBE,
+                uploader=shlex.quote(self.uploader),
+                manifest=shlex.quote(self.manifest_path),
+                jobs=self.UPLOAD_JOBS,
+                dedup=' --dedup' if self.use_dedup else '',
+                resume=' --resume' if self.resume else '',
+                upload_time=self._upload_max_time,
+                container=self.get_container(),
+                legacy=' && '.join(legacy))]
+
+    @property
+    def use_dedup(self):
+        """Whether only the files unknown to the artifacts are sent."""
+        if self.dedup is None:
+            return bool(util.env.ARTIFACTS_DEDUP)
+        return self.dedup
+
+    @property
+    def legacy_upload_command(self):
         distribution = self.getProperty('distribution_id')
         xargs = "xargs -0 -n 1 -t"
         # some alpine distribution do not support the -P option on xargs
@@ -210,32 +328,36 @@ class Upload(ShellCommand):
         else:
             return util.env.ARTIFACTS_PREFIX + self.getProperty('build_id')
 
-    def set_command(self, urls):
-        command = self.upload_command
-
-        # compute configured urls
+    @property
+    def find_links_commands(self):
+        """Commands listing the files matching the links, one per link."""
+        return [
+            'echo -e "\\n{header}\\n'
+            '$(find -L . -type f -path \'./{path}\')'
+            '\\n\\n"'.format(header=link['header'], path=link['path'])
+            for link in self._links]
+
+    @staticmethod
+    def parse_urls(urls):
+        """Return the links configured by the urls of the step."""
         links = []
-        if urls:
-            for upath in urls:
-                if isinstance(upath, tuple) or isinstance(upath, list):
-                    link = {'name': upath[0], 'path': upath[1]}
-                else:
-                    link = {'path': upath}
-                link['header'] = 'find files matching {path}:'.format(
-                    path=link['path'])
-                links.append(link)
-
-        for link in links:
-            command.append(
-                'echo -e "\\n{header}\\n'
-                '$(find -L . -type f -path \'./{path}\')'
-                '\\n\\n"'.format(
-                    header=link['header'],
-                    path=link['path']
-                ))
+        for upath in urls or []:
+            if isinstance(upath, tuple) or isinstance(upath, list):
+                link = {'name': upath[0], 'path': upath[1]}
+            else:
+                link = {'path': upath}
+            link['header'] = 'find files matching {path}:'.format(
+                path=link['path'])
+            links.append(link)
+        return links
+
+    def set_links(self, links):
         self._links = links
+        self.observer.headers = set(link['header'] for link in links)
 
-        return ' && '.join(command)
+    def set_command(self, urls):
+        self.set_links(self.parse_urls(urls))
+        return ' && '.join(self.upload_command)
 
     def check_artifacts_name(self):
         """Check that artifacts name has not been overwritten."""
@@ -252,13 +374,73 @@ class Upload(ShellCommand):
     # name patterns
     PREFIX_PATTERN_ELEMENTS = re.compile(r'\\\d+')
 
+    @defer.inlineCallbacks
+    def install_uploader(self):
+        """Copy the uploader to the builder directory of the worker.
+
+        Returns:
+            A deferred firing with the path of the uploader on the worker,
+            or `None` if it could not be installed.
+
+        """
+        builddir = self.getProperty('builddir')
+        if not builddir:
+            defer.returnValue(None)
+        try:
+            script = UPLOADER_SCRIPTS.get(UPLOADER, read_file)
+        except (OSError, IOError):
+            defer.returnValue(None)
+        path = os.path.join(builddir, self.UPLOADER_DIR, 'eve_upload.py')
+        installed = yield self.downloadFileContentToWorker(
+            path, script, workdir=builddir)
+        if installed is None:
+            defer.returnValue(None)
+        defer.returnValue(path)
+
+    @defer.inlineCallbacks
+    def read_manifest(self):
+        """Fetch the manifest written by the uploader on the worker."""
+        if self.uploader is None:
+            defer.returnValue(None)
+        content = yield self.getFileContentFromWorker(self.manifest_path)
+        if content is None:
+            defer.returnValue(None)
+        try:
+            manifest = json.loads(content)
+        except ValueError:
+            defer.returnValue(None)
+        yield self.addCompleteLog('manifest', content)
+        if self.resume:
+            yield self.addCompleteLog('retry', self.retry_summary(manifest))
+        defer.returnValue(manifest)
+
+    @staticmethod
+    def retry_summary(manifest):
+        """Describe what a resumed upload saved."""
+        return (
+            'files already sent by the previous attempts: {resumed} '
+            '({resumed_bytes} bytes saved)\n'
+            'files sent by this attempt: {uploaded} ({bytes} bytes)\n'
+            'files copied by the artifacts: {linked} '
+            '({linked_bytes} bytes)\n'
+            'files which failed: {failed}\n'.format(
+                **dict({'linked': 0, 'linked_bytes': 0, 'resumed': 0,
+                        'resumed_bytes': 0}, **manifest)))
+
+    @defer.inlineCallbacks
     def commandComplete(self, cmd):  # NOQA flake8 to ignore camelCase
+        self.manifest = yield self.read_manifest()
+
         # if command failed or was skipped, no need to publish urls
         if self.evaluateCommand(cmd) in [SKIPPED, FAILURE]:
             return
 
-        # extracts file path used in urls, in command output:
-        links = self._get_links_from_stdout()
+        # extracts file path used in urls, from the manifest of the
+        # uploader, or the command output when it was not used
+        if self.manifest is not None:
+            links = self._get_links_from_manifest()
+        else:
+            links = self._get_links_from_stdout()
 
         # append path to names if several links share the same name
         paths = defaultdict(int)
@@ -279,22 +461,20 @@ class Upload(ShellCommand):
             ))
             self.addURL(name, url)
 
+    def _get_links_from_manifest(self):
+        """Match the files of the manifest against all the links at once."""
+        matcher = LinkMatcher([link['path'] for link in self._links])
+        return self._get_links(matcher.matches(
+            './' + result['path'] for result in self.manifest['files']))
+
     def _get_links_from_stdout(self):
-        lines = self.observer.getStdout().split('\n')
-        links = set()
-        for link in self._links:
-            matches = []
-            try:
-                start = lines.index(link['header'])
-            except ValueError:
-                # lines may be empty or not have the header
-                # (missing an expected artefact)
-                continue
-            for line in lines[start + 1:]:
-                if line == '':
-                    break
-                matches.append(line)
+        """Read the files matching the links from the output of find."""
+        return self._get_links([self.observer.blocks.get(link['header'], [])
+                                for link in self._links])
 
+    def _get_links(self, matches_by_link):
+        links = set()
+        for link, matches in zip(self._links, matches_by_link):
             if not matches:
                 continue
             if (len(matches) == 1
@@ -331,6 +511,9 @@ class Upload(ShellCommand):
     @defer.inlineCallbacks
     def run(self):
         self.check_artifacts_name()
+        self.uploader = yield self.install_uploader()
+        urls = yield self.build.render(self._urls)
+        self.command = self.set_command(urls)
         result = yield super(Upload, self).run()
         if result == FAILURE:
             delay, repeats = self._retry
@@ -344,6 +527,8 @@ class Upload(ShellCommand):
                 self.build.addStepsAfterCurrentStep([self.__class__(
                     source=self.source,
                     urls=self._urls,
+                    dedup=self.dedup,
+                    resume=True,
                     retry=(delay, repeats - 1),
                     **self._kwargs)])
                 defer.returnValue(SKIPPED)
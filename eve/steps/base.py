@@ -17,31 +17,57 @@
 # Boston, MA  02110-1301, USA.
 
 import os
+from copy import deepcopy
 from os.path import abspath, dirname, join
 
 import yaml
 
+from ..util.cache import LRUCache, content_hash
+
+IMPLICIT_STAGES_PATH = join(dirname(dirname(abspath(__file__))),
+                            'etc', 'implicit-stages.yml')
+
+# Parsed configurations, indexed by the sha256 of the raw yaml file. Entries
+# are deep copied on read, steps are free to modify what they get.
+CONFIG_CACHE = LRUCache(max_entries=32, copy=deepcopy)
+
+_implicit_config = None
+
+
+def get_implicit_config():
+    """Return the implicit stages, parsed once per process."""
+    global _implicit_config  # pylint: disable=global-statement
+    if _implicit_config is None:
+        with open(IMPLICIT_STAGES_PATH) as config_file:
+            _implicit_config = yaml.load(config_file.read())
+    return _implicit_config
+
+
+def parse_eve_config(raw_config):
+    """Parse a main.yml file content and add the implicit stages to it."""
+    implicit_config = get_implicit_config()
+    config = yaml.load(raw_config)
+    if isinstance(config, dict):
+        for key in implicit_config['stages']:
+            config['stages'][key] = implicit_config['stages'][key]
+    return config
+
 
 class ConfigurableStepMixin():
     """Base class for a step that access the setting in the main.yml."""
 
+    eve_config_digest = None
+
     def getEveConfig(self):
-        """Load Eve's config file on the master and returns the data."""
-        implicit_config = {}
-        try:
-            implicit_conf = join(dirname(dirname(abspath(__file__))),
-                                 'etc', 'implicit-stages.yml')
-            with open(implicit_conf) as config_file:
-                implicit_config = yaml.load(config_file.read())
-        except yaml.YAMLError:
-            raise
-        try:
-            conf = os.path.expanduser(self.getProperty('conf_path'))
-            with open(conf) as config_file:
-                config = yaml.load(config_file.read())
-                if isinstance(config, dict):
-                    for key in implicit_config['stages']:
-                        config['stages'][key] = implicit_config['stages'][key]
-                return config
-        except yaml.YAMLError:
-            raise
+        """Load Eve's config file on the master and returns the data.
+
+        The parsed result is shared between all the steps reading the same
+        file content; the returned data is a private copy.
+
+        """
+        conf = os.path.expanduser(self.getProperty('conf_path'))
+        with open(conf, 'rb') as config_file:
+            raw_config = config_file.read().decode('utf-8')
+        self.eve_config_digest = content_hash(raw_config)
+        return CONFIG_CACHE.get(self.eve_config_digest,
+                                lambda: parse_eve_config(raw_config))
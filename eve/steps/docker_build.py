@@ -17,21 +17,70 @@
 # Boston, MA  02110-1301, USA.
 """All docker build related steps."""
 
-from buildbot.locks import MasterLock
-from buildbot.process import logobserver
-from buildbot.process.results import FAILURE, SUCCESS
+from buildbot.plugins import util
+from buildbot.process.results import FAILURE, SUCCESS, Results
 from buildbot.steps.master import MasterShellCommand
-from twisted.internet import defer
+from twisted.internet import defer, threads
 
-DOCKER_BUILD_LOCK = MasterLock('docker_build')
+from ..util.fingerprint import ContextFingerprinter
+from ..util.single_flight import SingleFlight
+
+_DOCKER_OPERATIONS = None
+_FINGERPRINTER = None
+
+
+def get_docker_operations():
+    """Return the coordinator of the docker operations of the master.
+
+    Operations on the same image run one after the other, identical
+    operations requested concurrently run once, and at most
+    ``DOCKER_MAX_CONCURRENT_OPERATIONS`` operations run at the same time.
+
+    """
+    global _DOCKER_OPERATIONS  # pylint: disable=global-statement
+    if _DOCKER_OPERATIONS is None:
+        _DOCKER_OPERATIONS = SingleFlight(
+            max_concurrent=util.env.DOCKER_MAX_CONCURRENT_OPERATIONS)
+    return _DOCKER_OPERATIONS
+
+
+def get_fingerprinter():
+    """Return the docker context fingerprinter of the master."""
+    global _FINGERPRINTER  # pylint: disable=global-statement
+    if _FINGERPRINTER is None:
+        _FINGERPRINTER = ContextFingerprinter(
+            index_path=util.env.DOCKER_FINGERPRINT_INDEX_PATH or None)
+    return _FINGERPRINTER
 
 
 class DockerStep(MasterShellCommand):
+    renderables = [
+        'image',
+    ]
+
     def __init__(self, label, image, command, **kwargs):
         self.label = label
         self.image = image
         super(DockerStep, self).__init__(command, logEnviron=False, **kwargs)
 
+    @defer.inlineCallbacks
+    def runDockerOperation(self, operation):  # flake8: noqa
+        """Run the command, or share the result of an identical one.
+
+        Args:
+            operation (str): name of the operation done on the image.
+
+        """
+        result, shared = yield get_docker_operations().run(
+            (operation, self.image),
+            super(DockerStep, self).run,
+            lock_key=self.image)
+        if shared:
+            yield self.addCompleteLog(
+                'shared', '{0} of {1} shared with another build: {2}\n'.format(
+                    operation, self.image, Results[result]))
+        defer.returnValue(result)
+
     def __eq__(self, other):
         return (isinstance(other, self.__class__)
                 and self.image == other.image
@@ -56,18 +105,11 @@ class DockerBuild(DockerStep):
 
     """
 
-    renderables = [
-        'image',
-    ]
-
     def __init__(self, label, image, context_dir='.', dockerfile=None,
                  is_retry=False, labels=None, build_args=None, **kwargs):
         kwargs.setdefault('name',
                           '[{0}] build'.format(label)[0:49])
         self.is_retry = is_retry
-        kwargs.setdefault('locks', []).append(
-            DOCKER_BUILD_LOCK.access('exclusive')
-        )
         command = ['docker', 'build', '--tag', image]
 
         if labels:
@@ -101,7 +143,8 @@ class DockerBuild(DockerStep):
 
     @defer.inlineCallbacks
     def run(self):
-        result = yield super(DockerBuild, self).run()
+        result = yield self.runDockerOperation(
+            'build --no-cache' if self.is_retry else 'build')
         if result == FAILURE:
             self.setProperty(
                 'DockerBuildFailed', self.image, self.name, runtime=True)
@@ -130,9 +173,6 @@ class DockerCheckLocalImage(DockerStep):
 
     def __init__(self, label, image, **kwargs):
         kwargs.setdefault('name', '[{0}] look up'.format(label)[:49])
-        kwargs.setdefault('locks', []).append(
-            DOCKER_BUILD_LOCK.access('exclusive')
-        )
         super(DockerCheckLocalImage, self).__init__(
             label, image, ['docker', 'image', 'inspect', image], **kwargs)
 
@@ -142,7 +182,7 @@ class DockerCheckLocalImage(DockerStep):
 
     @defer.inlineCallbacks
     def run(self):
-        result = yield super(DockerCheckLocalImage, self).run()
+        result = yield self.runDockerOperation('look up')
         self.setProperty(
             'exists_{0}'.format(self.label),
             result == SUCCESS,
@@ -155,7 +195,9 @@ class DockerComputeImageFingerprint(DockerStep):
     """Compute the fingerprint of a docker context.
 
     This step computes the sha256 fingerprint of an image given its context
-    and stores it to the property ``fingerprint_[label]``.
+    and stores it to the property ``fingerprint_[label]``. The fingerprint
+    is computed on the master, and only the files that changed since the
+    previous computation are read (see `ContextFingerprinter`).
 
     Parameters:
         label (str): the reference name of the image
@@ -167,23 +209,13 @@ class DockerComputeImageFingerprint(DockerStep):
     def __init__(self, label, context_dir, dockerfile=None, **kwargs):
         kwargs.setdefault('name',
                           '[{0}] fingerprint'.format(label)[:49])
-        command = (
-            'tar -c --mtime="1990-02-11 00:00Z" --group=0 '
-            '--owner=0 --numeric-owner --sort=name --mode=0 '
-            '{context_dir} {dockerfile} '
-            '| sha256sum | cut -f 1 -d " "'
-        ).format(
-            context_dir=context_dir,
-            dockerfile=str(dockerfile or '')
-        )
+        self.context_dir = context_dir
+        self.dockerfile = dockerfile
         super(DockerComputeImageFingerprint, self).__init__(
             label, context_dir,
-            command,
+            None,
             **kwargs
         )
-        self.observer = logobserver.BufferLogObserver(wantStdout=True,
-                                                      wantStderr=True)
-        self.addLogObserver('stdio', self.observer)
 
     def isNewStyle(self):  # flake8: noqa
         # needed because we redefine `run` below
@@ -191,17 +223,28 @@ class DockerComputeImageFingerprint(DockerStep):
 
     @defer.inlineCallbacks
     def run(self):
-        result = yield super(DockerComputeImageFingerprint, self).run()
+        paths = [self.context_dir]
+        if self.dockerfile:
+            paths.append(self.dockerfile)
         try:
-            fingerprint = self.observer.getStdout().splitlines()[0]
-        except IndexError:
+            fingerprint, stats = yield threads.deferToThread(
+                get_fingerprinter().fingerprint, self.masterWorkdir, paths)
+        except OSError as exc:
+            yield self.addCompleteLog(
+                'stdio', 'unable to fingerprint {0}: {1}\n'.format(
+                    ' '.join(paths), exc))
             defer.returnValue(FAILURE)
+        yield self.addCompleteLog('metrics', (
+            'files: {files}\n'
+            'hashed files: {hashed_files}\n'
+            'hashed bytes: {hashed_bytes}\n'
+            'duration: {duration:.3f}s\n').format(**stats))
         self.setProperty(
             'fingerprint_{0}'.format(self.label),
             fingerprint,
             'DockerComputeImageFingerprint',
             runtime=True)
-        defer.returnValue(result)
+        defer.returnValue(SUCCESS)
 
 
 class DockerPull(DockerStep):
@@ -221,9 +264,6 @@ class DockerPull(DockerStep):
     def __init__(self, label, image, **kwargs):
         kwargs.setdefault('name',
                           '[{0}] pull'.format(label)[:49])
-        kwargs.setdefault('locks', []).append(
-            DOCKER_BUILD_LOCK.access('exclusive')
-        )
         super(DockerPull, self).__init__(
             label, image, ['docker', 'pull', image], **kwargs)
 
@@ -233,7 +273,7 @@ class DockerPull(DockerStep):
 
     @defer.inlineCallbacks
     def run(self):
-        result = yield super(DockerPull, self).run()
+        result = yield self.runDockerOperation('pull')
         self.setProperty(
             'exists_{0}'.format(self.label),
             result == SUCCESS,
@@ -254,16 +294,16 @@ class DockerPush(DockerStep):
 
     """
 
-    renderables = [
-        'image',
-    ]
-
     def __init__(self, label, image, **kwargs):
         kwargs.setdefault('name',
                           '[{0}] push'.format(label)[0:49])
-        kwargs.setdefault('locks', []).append(
-            DOCKER_BUILD_LOCK.access('exclusive')
-        )
         super(DockerPush, self).__init__(label, image,
                                          ['docker', 'push', image],
                                          **kwargs)
+
+    def isNewStyle(self):  # flake8: noqa
+        # needed because we redefine `run` below
+        return False
+
+    def run(self):
+        return self.runDockerOperation('push')
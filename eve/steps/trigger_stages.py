@@ -19,9 +19,11 @@
 from buildbot.plugins import util
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.properties import Properties
-from buildbot.process.results import SUCCESS
+from buildbot.process.results import (CANCELLED, EXCEPTION, FAILURE, SUCCESS,
+                                      WARNINGS, Results, worst_status)
 from buildbot.steps.trigger import Trigger
 from twisted.internet import defer
+from twisted.python import failure
 
 from ..util.build_order import BaseBuildOrder
 from ..worker.docker.build_order import DockerBuildOrder
@@ -64,10 +66,15 @@ class TriggerStages(BuildStep, ConfigurableStepMixin):
     def run(self):
         conf = self.getEveConfig()
 
+        # stages listed in `depends_on` are started along with the stages
+        # depending on them, in dependency order
+        dependencies = get_stage_dependencies(conf['stages'],
+                                              self.stage_names)
+
         preliminary_steps = []
         build_orders = []
 
-        for stage_name in self.stage_names:
+        for stage_name in dependencies:
             stage = conf['stages'][stage_name]
             worker = stage['worker']
 
@@ -88,16 +95,50 @@ class TriggerStages(BuildStep, ConfigurableStepMixin):
             for step in build_order.preliminary_steps:
                 preliminary_steps.append(step)
 
-        self.build.addStepsAfterCurrentStep([
-            ExecuteTriggerStages(
+        if any(dependencies.values()):
+            execute_step = ExecuteTriggerStagesGraph(
+                build_orders, dependencies,
+                **self._kwargs_for_exec_trigger_stages
+            )
+        else:
+            execute_step = ExecuteTriggerStages(
                 build_orders, **self._kwargs_for_exec_trigger_stages
             )
-        ])
+        self.build.addStepsAfterCurrentStep([execute_step])
         self.build.addStepsAfterCurrentStep(preliminary_steps)
 
         return SUCCESS
 
 
+def get_stage_dependencies(stages, stage_names):
+    """Return the `depends_on` graph of the given stages.
+
+    The returned dict maps each stage to the list of stages it depends on.
+    It contains the given stages, in order, followed by the stages they
+    depend on (directly or not) that were not listed.
+
+    Raises:
+        ValueError: a stage depends on a stage that does not exist.
+
+    """
+    dependencies = {}
+    to_visit = list(stage_names)
+    while to_visit:
+        stage_name = to_visit.pop(0)
+        if stage_name in dependencies:
+            continue
+        depends_on = stages[stage_name].get('depends_on') or []
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        for dependency in depends_on:
+            if dependency not in stages:
+                raise ValueError('stage %r depends on unknown stage %r' %
+                                 (stage_name, dependency))
+        dependencies[stage_name] = list(depends_on)
+        to_visit.extend(depends_on)
+    return dependencies
+
+
 class ExecuteTriggerStages(Trigger):
     """Execute simultaneously multiple build steps.
 
@@ -115,23 +156,21 @@ class ExecuteTriggerStages(Trigger):
 
     @defer.inlineCallbacks
     def getSchedulersAndProperties(self):
-        scheds_and_props = []
+        # wait for properties from preliminary steps; the renderables of all
+        # build orders are rendered concurrently, and only once when several
+        # build orders share the same renderable (e.g. a docker image)
+        renderer = _BatchRenderer()
+        for build_order in self._build_orders:
+            for value, _ in build_order.properties.values():
+                renderer.collect(value)
 
-        def set_property(value, build_order, name, source):
-            build_order.properties[name] = (value, source)
+        yield renderer.render(self.build)
 
+        scheds_and_props = []
         for build_order in self._build_orders:
-            # wait for properties from preliminary steps
-            setprop_defers = []
             for name, (value, source) in build_order.properties.items():
-                setprop_defer = self.build.render(value)
-                setprop_defer.addCallback(set_property,
-                                          build_order,
-                                          name,
-                                          source)
-                setprop_defers.append(setprop_defer)
-
-            yield defer.gatherResults(setprop_defers)
+                build_order.properties[name] = (renderer.rendered(value),
+                                                source)
 
             scheds_and_props.append({
                 'sched_name': build_order.scheduler,
@@ -149,3 +188,323 @@ class ExecuteTriggerStages(Trigger):
 
     def createTriggerProperties(self, properties):
         return Properties.fromDict(properties)
+
+
+class StageGraph(object):
+    """Track the progress of stages depending on each other.
+
+    A stage is ready once all the stages it depends on succeeded. When a
+    stage does not succeed, all the stages depending on it (directly or
+    not) are cancelled.
+
+    Args:
+        dependencies (dict): the stages each stage depends on.
+
+    Raises:
+        ValueError: the graph refers to an unknown stage or has a cycle.
+
+    """
+
+    SUCCESSFUL = (SUCCESS, WARNINGS)
+
+    def __init__(self, dependencies):
+        self.dependencies = {stage: list(deps)
+                             for stage, deps in dependencies.items()}
+        self.dependents = {stage: [] for stage in self.dependencies}
+        for stage, deps in self.dependencies.items():
+            for dependency in deps:
+                if dependency not in self.dependencies:
+                    raise ValueError('stage %r depends on unknown stage %r' %
+                                     (stage, dependency))
+                self.dependents[dependency].append(stage)
+        self.order = self._sort()
+
+        self.started = {}
+        self.finished = {}
+        self.results = {}
+        self.cancelled = []
+
+    def _sort(self):
+        """Return the stages in a dependency order (Kahn's algorithm)."""
+        missing = {stage: len(set(deps))
+                   for stage, deps in self.dependencies.items()}
+        order = [stage for stage in self.dependencies if not missing[stage]]
+        for stage in order:
+            for dependent in self.dependents[stage]:
+                missing[dependent] -= 1
+                if not missing[dependent]:
+                    order.append(dependent)
+        if len(order) != len(self.dependencies):
+            raise ValueError('stages %s have circular dependencies' %
+                             ', '.join(sorted(stage for stage in missing
+                                              if missing[stage])))
+        return order
+
+    def ready(self):
+        """Return the stages that can be started now."""
+        return [stage for stage in self.order
+                if stage not in self.started
+                and stage not in self.cancelled
+                and all(self.results.get(dependency) in self.SUCCESSFUL
+                        for dependency in self.dependencies[stage])]
+
+    def start(self, stage, when):
+        self.started[stage] = when
+
+    def finish(self, stage, result, when):
+        """Record the result of a stage.
+
+        Returns the list of stages cancelled because of this result.
+
+        """
+        self.finished[stage] = when
+        self.results[stage] = result
+        if result in self.SUCCESSFUL:
+            return []
+        cancelled = []
+        to_cancel = list(self.dependents[stage])
+        while to_cancel:
+            dependent = to_cancel.pop(0)
+            if dependent in self.started or dependent in self.cancelled:
+                continue
+            self.cancelled.append(dependent)
+            cancelled.append(dependent)
+            to_cancel.extend(self.dependents[dependent])
+        return cancelled
+
+    def cancel_pending(self):
+        """Cancel all the stages that were not started yet."""
+        cancelled = [stage for stage in self.order
+                     if stage not in self.started
+                     and stage not in self.cancelled]
+        self.cancelled.extend(cancelled)
+        return cancelled
+
+    def is_complete(self):
+        return all(stage in self.finished or stage in self.cancelled
+                   for stage in self.order)
+
+    def critical_path(self):
+        """Return the chain of stages that determined the total duration.
+
+        Starting from the last stage to finish, walk back through the
+        dependency that finished last, i.e. the one that held the stage.
+
+        """
+        def finished_last(stage):
+            return self.finished[stage], self.order.index(stage)
+
+        if not self.finished:
+            return []
+        stage = max(self.finished, key=finished_last)
+        path = [stage]
+        while True:
+            deps = [dependency for dependency in self.dependencies[stage]
+                    if dependency in self.finished]
+            if not deps:
+                break
+            stage = max(deps, key=finished_last)
+            path.append(stage)
+        path.reverse()
+        return path
+
+
+class ExecuteTriggerStagesGraph(ExecuteTriggerStages):
+    """Execute stages as soon as the stages they depend on succeeded.
+
+    Stages not depending on each other run simultaneously. When a stage does
+    not succeed, the stages depending on it are never started. The result of
+    the step is the worst result of the stages that were started, and the
+    critical path of the graph is reported in a log.
+
+    """
+
+    def __init__(self, build_orders, dependencies, *args, **kwargs):
+        kwargs['waitForFinish'] = True
+        super(ExecuteTriggerStagesGraph, self).__init__(
+            build_orders, *args, **kwargs)
+        self._graph = StageGraph(dependencies)
+
+    @defer.inlineCallbacks
+    def run(self):
+        graph = self._graph
+        scheds_and_props = yield self.getSchedulersAndProperties()
+        triggers = {}
+        for build_order, sched in zip(self._build_orders, scheds_and_props):
+            stage_name = build_order.properties['stage_name'][0]
+            triggers[stage_name] = (
+                self.getSchedulerByName(sched['sched_name']),
+                self.createTriggerProperties(sched['props_to_set']))
+        ss_for_trigger = self.prepareSourcestampListForTrigger()
+
+        self.running = True
+        self.triggeredNames = []
+        results = SUCCESS
+        rclist = []
+        all_done = defer.Deferred()
+        self.waitForFinishDeferred = all_done
+
+        def check_done():
+            if graph.is_complete() and not all_done.called:
+                all_done.callback(None)
+
+        def stage_finished(result, stage_name):
+            if isinstance(result, failure.Failure):
+                rclist.append((False, result))
+                stage_result = EXCEPTION
+            else:
+                rclist.append((True, result))
+                stage_result = result[0]
+            graph.finish(stage_name, stage_result,
+                         self.master.reactor.seconds())
+            d = defer.maybeDeferred(trigger_ready_stages)
+            d.addErrback(
+                lambda f: defer.maybeDeferred(
+                    self.addLogWithFailure, f).addCallback(
+                    lambda _: all_done.called or all_done.errback(f)))
+
+        @defer.inlineCallbacks
+        def trigger_ready_stages():
+            nonlocal results
+            while True:
+                if self.ended:
+                    graph.cancel_pending()
+                    break
+                ready = graph.ready()
+                if not ready:
+                    break
+                stage_name = ready[0]
+                sched, props = triggers[stage_name]
+                graph.start(stage_name, self.master.reactor.seconds())
+                self.triggeredNames.append(stage_name)
+                ids_deferred, results_deferred = sched.trigger(
+                    waited_for=True,
+                    sourcestamps=ss_for_trigger,
+                    set_props=props,
+                    parent_buildid=self.build.buildid,
+                    parent_relationship=self.parent_relationship)
+                results_deferred.addBoth(stage_finished, stage_name)
+
+                try:
+                    _, brids = yield ids_deferred
+                except Exception as e:
+                    # the stage never gets results: stop the graph here
+                    graph.finish(stage_name, FAILURE,
+                                 self.master.reactor.seconds())
+                    graph.cancel_pending()
+                    yield self.addLogWithException(e)
+                    results = EXCEPTION
+                    continue
+
+                for brid in brids.values():
+                    self.brids.append(brid)
+                    url = self.master.status.getURLForBuildrequest(brid)
+                    yield self.addURL('%s #%d' % (stage_name, brid), url)
+            self.updateSummary()
+            check_done()
+
+        yield trigger_ready_stages()
+        try:
+            yield all_done
+        except defer.CancelledError:
+            pass
+        self.running = False
+
+        if self.ended:
+            defer.returnValue(CANCELLED)
+
+        yield self.addBuildUrls(rclist)
+        for was_cb, result in rclist:
+            if not was_cb:
+                yield self.addLogWithFailure(result)
+        # stages cancelled by the graph do not account in the result, the
+        # failure of the stage they depend on does
+        for stage_result in graph.results.values():
+            results = worst_status(results, stage_result)
+        yield self.reportGraph()
+        defer.returnValue(results)
+
+    @defer.inlineCallbacks
+    def reportGraph(self):
+        graph = self._graph
+        path = graph.critical_path()
+        lines = []
+        if path:
+            total = graph.finished[path[-1]] - graph.started[path[0]]
+            lines.append('critical path (%ds):' % total)
+            for stage_name in path:
+                lines.append('  %s: %ds (%s)' % (
+                    stage_name,
+                    graph.finished[stage_name] - graph.started[stage_name],
+                    Results[graph.results[stage_name]]))
+        if graph.cancelled:
+            lines.append('cancelled stages: %s' % ', '.join(graph.cancelled))
+        if lines:
+            yield self.addCompleteLog('critical path',
+                                      '\n'.join(lines) + '\n')
+
+    def getCurrentSummary(self):
+        if not self.triggeredNames:
+            return {u'step': u'running'}
+        summary = u'triggered %s' % u', '.join(self.triggeredNames)
+        if self._graph.cancelled:
+            summary += u' (cancelled %s)' % u', '.join(self._graph.cancelled)
+        return {u'step': summary}
+
+
+class _BatchRenderer(object):
+    """Render a set of values with a single batch of concurrent renders.
+
+    Values are walked like `Build.render` would (lists, tuples and dicts are
+    rendered item by item). Renderables found are deduplicated, by equality
+    when they are hashable and by identity otherwise.
+
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._renderables = []
+        self._results = None
+
+    @staticmethod
+    def _key(renderable):
+        try:
+            hash(renderable)
+        except TypeError:
+            return ('id', id(renderable))
+        return ('value', renderable)
+
+    def collect(self, value):
+        """Register all the renderables found in value."""
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                self.collect(item)
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                self.collect(key)
+                self.collect(item)
+        elif hasattr(value, 'getRenderingFor'):
+            key = self._key(value)
+            if key not in self._keys:
+                self._keys[key] = len(self._renderables)
+                self._renderables.append(value)
+
+    @defer.inlineCallbacks
+    def render(self, build):
+        """Render all the collected renderables concurrently."""
+        self._results = yield defer.gatherResults(
+            [build.render(renderable) for renderable in self._renderables],
+            consumeErrors=True)
+
+    def rendered(self, value):
+        """Return the rendering of a collected value."""
+        if isinstance(value, list):
+            return [self.rendered(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.rendered(item) for item in value)
+        if isinstance(value, dict):
+            return {self.rendered(key): self.rendered(item)
+                    for key, item in value.items()}
+        if hasattr(value, 'getRenderingFor'):
+            return self._results[self._keys[self._key(value)]]
+        return value
@@ -19,12 +19,10 @@
 import re
 import time
 from collections import defaultdict
-from fnmatch import fnmatch
 from tempfile import mktemp
 
 import yaml
 from buildbot.plugins import steps, util
-from buildbot.process import logobserver
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.results import FAILURE, SKIPPED, SUCCESS
 from buildbot.steps.transfer import FileUpload
@@ -32,6 +30,8 @@ from packaging import version
 from twisted.internet import defer
 from twisted.logger import Logger
 
+from ..process.logobserver import FirstMatchObserver, replace_log_observer
+from ..util.branch_matcher import expand_branches, get_branch_matcher
 from .base import ConfigurableStepMixin
 from .property import EveProperty, EvePropertyFromCommand
 
@@ -119,11 +119,7 @@ class ReadConfFromYaml(FileUpload, ConfigurableStepMixin):
                                           'in %s' % self.yaml)
             defer.returnValue(FAILURE)
 
-        new_branches = {}
-        for branch_patterns, branch_conf in branches.items():
-            for branch_pattern in branch_patterns.split(','):
-                new_branches[branch_pattern.strip()] = branch_conf
-        conf['branches'] = new_branches
+        conf['branches'] = expand_branches(branches)
         self.setProperty('start_time', str(time.time()))
 
         # Use the given stage if any (forced build)
@@ -136,15 +132,15 @@ class ReadConfFromYaml(FileUpload, ConfigurableStepMixin):
                               stage=stage_name)
         else:
             # Else find the stage name from the branch name
-            for branch_pattern, branch_conf in conf['branches'].items():
-                self.logger.debug('Checking if <{branch}> matches <{pattern}>',
-                                  branch=branch, pattern=branch_pattern)
-                if fnmatch(branch, branch_pattern):
-                    stage_name = branch_conf['stage']
-                    self.logger.debug('<{branch}> matched <{branch_pattern}>',
-                                      branch=branch,
-                                      branch_pattern=branch_pattern)
-                    break
+            matcher = get_branch_matcher(self.eve_config_digest,
+                                         conf['branches'])
+            match = matcher.match(branch)
+            if match is not None:
+                branch_pattern, branch_conf = match
+                stage_name = branch_conf['stage']
+                self.logger.debug('<{branch}> matched <{branch_pattern}>',
+                                  branch=branch,
+                                  branch_pattern=branch_pattern)
             else:
                 self.logger.debug('No branch match. '
                                   'Using default branch config.')
@@ -250,9 +246,11 @@ class GetCommitShortVersion(EvePropertyFromCommand):
             haltOnFailure=True,
             logEnviron=False)
 
-        self.observer = logobserver.BufferLogObserver(wantStdout=True,
-                                                      wantStderr=True)
-        self.addLogObserver('stdio', self.observer)
+        # only keep the first revision from the output of git
+        observer = FirstMatchObserver({
+            'revision': re.compile('^([0-9a-f]{10})[0-9a-f]*$')})
+        replace_log_observer(self, 'stdio', self.observer, observer)
+        self.observer = observer
 
     def commandComplete(self, cmd):  # NOQA flake8 to ignore camelCase
         if cmd.didFail():
@@ -260,12 +258,9 @@ class GetCommitShortVersion(EvePropertyFromCommand):
             return
 
         commit_short_revision = ''
-        lines = self.observer.getStdout().splitlines()
-        for line in lines:
-            reg = re.search('^([0-9a-f]{10})[0-9a-f]*$', line)
-            if reg:
-                commit_short_revision = reg.group(1)
-                break
+        revision = self.observer.matches.get('revision')
+        if revision is not None:
+            commit_short_revision = revision.group(1)
 
         self.setProperty(self.property, str(commit_short_revision),
                          'GetCommitShortVersion')
@@ -0,0 +1,110 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Select the stage to run from the `branches` section of main.yml."""
+
+import re
+from fnmatch import translate
+
+from .cache import LRUCache
+
+WILDCARDS = re.compile(r'[*?[]')
+
+
+def expand_branches(branches):
+    """Split the comma separated patterns of a `branches` section.
+
+    Returns a dict mapping each pattern to its configuration, in the order
+    of the yaml file.
+
+    """
+    new_branches = {}
+    for branch_patterns, branch_conf in branches.items():
+        for branch_pattern in branch_patterns.split(','):
+            new_branches[branch_pattern.strip()] = branch_conf
+    return new_branches
+
+
+class BranchMatcher(object):
+    """All the branch patterns of a main.yml compiled in a single matcher.
+
+    A branch matches the first pattern that matches it in the order of the
+    yaml file, exactly like a linear lookup with :py:func:`fnmatch.fnmatch`
+    would. Patterns without wildcards are indexed in a dict, the others are
+    compiled once and indexed by their literal prefix (the part before the
+    first wildcard), so that only the patterns sharing a prefix with the
+    branch are tried.
+
+    Args:
+        branches (dict): expanded branch patterns (see `expand_branches`).
+
+    """
+
+    def __init__(self, branches):
+        self.patterns = list(branches.keys())
+        self.confs = list(branches.values())
+
+        self._literals = {}
+        self._prefixes = {}
+        self._regexes = {}
+        for index, pattern in enumerate(self.patterns):
+            wildcard = WILDCARDS.search(pattern)
+            if wildcard is None:
+                self._literals.setdefault(pattern, index)
+                continue
+            self._prefixes.setdefault(
+                pattern[:wildcard.start()], []).append(index)
+            self._regexes[index] = re.compile(translate(pattern))
+        self._prefix_lengths = sorted(
+            set(len(prefix) for prefix in self._prefixes))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def match_index(self, branch):
+        """Return the index of the first pattern matching branch or None."""
+        best = self._literals.get(branch)
+        candidates = []
+        for length in self._prefix_lengths:
+            if length > len(branch):
+                break
+            candidates.extend(self._prefixes.get(branch[:length], ()))
+        for index in sorted(candidates):
+            if best is not None and index > best:
+                break
+            if self._regexes[index].match(branch):
+                return index
+        return best
+
+    def match(self, branch):
+        """Return (pattern, conf) of the first pattern matching branch.
+
+        Returns `None` if no pattern matches.
+
+        """
+        index = self.match_index(branch)
+        if index is None:
+            return None
+        return self.patterns[index], self.confs[index]
+
+
+_MATCHERS = LRUCache(max_entries=32)
+
+
+def get_branch_matcher(config_digest, branches):
+    """Return the matcher for given branches, built once per config hash."""
+    return _MATCHERS.get(config_digest, lambda: BranchMatcher(branches))
@@ -0,0 +1,168 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Small in-memory caches shared by the master process."""
+
+import os
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+
+
+def content_hash(content):
+    """Return the hex sha256 digest of the given str or bytes."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return sha256(content).hexdigest()
+
+
+class LRUCache(object):
+    """A bounded mapping evicting the least recently used entries.
+
+    Values are computed on demand by :py:meth:`get`. When a ``copy``
+    callable is given, it is applied to every value handed out so callers
+    can freely modify what they get without corrupting the shared entry.
+
+    Args:
+        max_entries (int): number of entries kept before evicting.
+        copy (callable): optional function used to copy values on read.
+
+    """
+
+    def __init__(self, max_entries=64, copy=None):
+        assert max_entries > 0
+        self.max_entries = max_entries
+        self._copy = copy
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, compute):
+        """Return the value stored for key, computing it if needed.
+
+        Exceptions raised by ``compute`` are propagated and nothing is
+        stored in the cache.
+
+        """
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                found = False
+            else:
+                self.hits += 1
+                self._entries[key] = value
+                found = True
+
+        if not found:
+            value = compute()
+            with self._lock:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if self._copy is not None:
+            return self._copy(value)
+        return value
+
+    @property
+    def hit_rate(self):
+        """Return the ratio of reads served from the cache, or None."""
+        reads = self.hits + self.misses
+        if not reads:
+            return None
+        return float(self.hits) / reads
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return a dict describing the cache usage."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+        }
+
+
+class FileCache(object):
+    """Values loaded from files, reloaded when the files change.
+
+    Entries are keyed by path and validated with a ``stat`` of the file
+    on every read: the value is loaded again as soon as the modification
+    time, size or inode of the file differ from the ones it was loaded
+    from.
+
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, load):
+        """Return the value loaded from path with ``load(path)``.
+
+        Errors raised by ``os.stat`` or ``load`` are propagated and
+        nothing is stored in the cache.
+
+        """
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = load(path)
+        with self._lock:
+            self._entries[path] = (version, value)
+        return value
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return a dict describing the cache usage."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+        }
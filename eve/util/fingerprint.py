@@ -0,0 +1,170 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Fingerprint docker contexts without rehashing unchanged files."""
+
+import json
+import os
+import stat
+from hashlib import sha256
+from threading import Lock
+from time import monotonic, time_ns
+
+from buildbot.util.logger import Logger
+
+log = Logger()
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _encode(name):
+    return name.encode('utf-8', 'surrogateescape')
+
+
+class ContextFingerprinter(object):
+    """Compute the Merkle root of a set of files and directories.
+
+    Each file is hashed with sha256; each directory hashes the sorted list
+    of its entries (name, type and hash), and the root hashes the given
+    paths in order. Like the tar archive previously hashed, the result only
+    depends on the names, types and contents of the files, not on their
+    owner, mode or modification time.
+
+    The digest of every file is kept in an index along with its size,
+    modification time and inode, so that only the files that changed since
+    the previous fingerprint are read again. Files modified less than
+    ``racy_delay`` seconds before they were hashed are hashed again on the
+    next scan (they could have been modified again with the same
+    modification time). The index is saved to ``index_path`` as json.
+
+    Args:
+        index_path (str): where to store the index, or `None` to only keep
+            it in memory.
+        racy_delay (float): see above.
+
+    """
+
+    def __init__(self, index_path=None, racy_delay=2):
+        self.index_path = index_path
+        self.racy_delay_ns = int(racy_delay * 1e9)
+        self._index = None
+        self._lock = Lock()
+        self.totals = {
+            'fingerprints': 0,
+            'files': 0,
+            'hashed_files': 0,
+            'hashed_bytes': 0,
+            'duration': 0.0,
+        }
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as index_file:
+                self._index = json.load(index_file)
+        except (OSError, ValueError) as exc:
+            log.warn('ignoring fingerprint index {path}: {exc}',
+                     path=self.index_path, exc=exc)
+
+    def _save_index(self):
+        if not self.index_path:
+            return
+        tmp_path = '{0}.{1}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'w') as index_file:
+            json.dump(self._index, index_file, separators=(',', ':'))
+        os.replace(tmp_path, self.index_path)
+
+    def fingerprint(self, workdir, paths):
+        """Return the fingerprint of paths (relative to workdir).
+
+        Returns:
+            A ``(fingerprint, stats)`` tuple, where stats is a dict
+            counting the files seen, the files and bytes hashed, and the
+            duration of the computation in seconds.
+
+        """
+        start = monotonic()
+        stats = {'files': 0, 'hashed_files': 0, 'hashed_bytes': 0}
+        with self._lock:
+            self._load_index()
+        scan = {
+            'stats': stats,
+            'started_at': time_ns(),
+            'seen': {},
+        }
+
+        root = sha256(b'root\0')
+        for path in paths:
+            kind, digest = self._digest(os.path.join(workdir, path), scan)
+            root.update(b'%s %s %s\n' % (kind, _encode(path), digest))
+
+        with self._lock:
+            # drop the files removed from the scanned directories
+            prefixes = tuple(os.path.join(workdir, path, '')
+                             for path in paths)
+            for indexed_path in list(self._index):
+                if (indexed_path.startswith(prefixes)
+                        and indexed_path not in scan['seen']):
+                    del self._index[indexed_path]
+            self._index.update(scan['seen'])
+            self._save_index()
+
+        stats['duration'] = monotonic() - start
+        with self._lock:
+            self.totals['fingerprints'] += 1
+            for key, value in stats.items():
+                self.totals[key] += value
+        return root.hexdigest(), stats
+
+    def _digest(self, path, scan):
+        info = os.lstat(path)
+        if stat.S_ISDIR(info.st_mode):
+            tree = sha256(b'tree\0')
+            for name in sorted(os.listdir(path)):
+                kind, digest = self._digest(os.path.join(path, name), scan)
+                tree.update(b'%s %s %s\n' % (kind, _encode(name), digest))
+            return b'tree', tree.hexdigest().encode()
+        if stat.S_ISLNK(info.st_mode):
+            target = sha256(_encode(os.readlink(path)))
+            return b'link', target.hexdigest().encode()
+        if stat.S_ISREG(info.st_mode):
+            return b'blob', self._file_digest(path, info, scan).encode()
+        return b'special', b''
+
+    def _file_digest(self, path, info, scan):
+        stats = scan['stats']
+        stats['files'] += 1
+        key = [info.st_size, info.st_mtime_ns, info.st_ino]
+        with self._lock:
+            entry = self._index.get(path)
+        if (entry is not None and entry[:3] == key
+                and info.st_mtime_ns < entry[4] - self.racy_delay_ns):
+            scan['seen'][path] = entry
+            return entry[3]
+
+        digest = sha256()
+        with open(path, 'rb') as content:
+            for chunk in iter(lambda: content.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        stats['hashed_files'] += 1
+        stats['hashed_bytes'] += info.st_size
+        scan['seen'][path] = key + [digest.hexdigest(), scan['started_at']]
+        return digest.hexdigest()
@@ -0,0 +1,72 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Latency histograms of the calls made by the master."""
+
+from bisect import bisect_left
+from threading import Lock
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+
+
+class LatencyHistogram(object):
+    """Count durations in buckets of increasing upper bounds.
+
+    The last bucket counts the durations above the highest bound. Percentiles
+    are estimated with the upper bound of the bucket they fall in.
+
+    Args:
+        buckets (tuple): upper bounds of the buckets, in seconds.
+
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, duration):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, duration)] += 1
+            self.count += 1
+            self.sum += duration
+            self.max = max(self.max, duration)
+
+    def percentile(self, percent):
+        """Return the upper bound of the bucket of a percentile."""
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.buckets):
+                    return self.max
+                return self.buckets[index]
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return 'no call'
+        return 'count=%d mean=%.3fs p50<=%ss p95<=%ss max=%.3fs' % (
+            self.count, self.sum / self.count, self.percentile(50),
+            self.percentile(95), self.max)
@@ -0,0 +1,206 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Track the running builds of each builder without querying the DB."""
+
+from collections import defaultdict
+from weakref import WeakKeyDictionary
+
+from buildbot import config
+from buildbot.util import service
+from buildbot.util.logger import Logger
+from twisted.internet import defer, task
+
+log = Logger()
+
+
+class RunningBuilds(object):
+    """The ids of the builds running on each builder.
+
+    The builds are tracked with the `new` and `finished` build messages of
+    the master's message queue. The builds of a builder are loaded from the
+    database the first time they are needed, then again every
+    ``reconcile_interval`` seconds to correct any missed message (e.g. a
+    master of the cluster crashed before finishing its builds). The
+    `RunningBuildsReconciler` service loads the builds of all the builders
+    at once, when the master starts then periodically, so that builders
+    are rarely loaded on demand.
+
+    Args:
+        master: the buildbot master.
+        reconcile_interval (int): seconds between two loads from the
+            database of the builds of a builder.
+
+    """
+
+    def __init__(self, master, reconcile_interval=300):
+        self.master = master
+        self.reconcile_interval = reconcile_interval
+        self._builds = {}
+        self._synced_at = {}
+        self._syncing = {}
+        self._consumers = None
+
+    @defer.inlineCallbacks
+    def start(self):
+        """Start consuming the build messages."""
+        if self._consumers is not None:
+            return
+        self._consumers = []
+        for event in ('new', 'finished'):
+            consumer = yield self.master.mq.startConsuming(
+                self._on_build_message, ('builds', None, event))
+            self._consumers.append(consumer)
+
+    def stop(self):
+        for consumer in self._consumers or []:
+            consumer.stopConsuming()
+        self._consumers = None
+        self._builds.clear()
+        self._synced_at.clear()
+
+    def _on_build_message(self, key, build):
+        event = key[-1]
+        builderid = build['builderid']
+        for synced in (builderid, None):
+            for pending in self._syncing.get(synced, ()):
+                pending.append((builderid, event, build['buildid']))
+        if builderid in self._builds:
+            self._apply(self._builds[builderid], event, build['buildid'])
+
+    @staticmethod
+    def _apply(builds, event, buildid):
+        if event == 'new':
+            builds.add(buildid)
+        else:
+            builds.discard(buildid)
+
+    @defer.inlineCallbacks
+    def reconcile(self, builderid=None):
+        """Load the running builds of a builder, or of all, from the database.
+
+        Loading all of them takes a single query.
+
+        """
+        # messages received while the query runs are replayed on its result
+        pending = []
+        self._syncing.setdefault(builderid, []).append(pending)
+        try:
+            builds = yield self.master.db.builds.getBuilds(
+                builderid=builderid, complete=False)
+        finally:
+            self._syncing[builderid].remove(pending)
+            if not self._syncing[builderid]:
+                del self._syncing[builderid]
+        running = defaultdict(set)
+        # builders without running builds anymore
+        for known in (self._builds if builderid is None else [builderid]):
+            running[known] = set()
+        for build in builds:
+            running[build['builderid']].add(build['id'])
+        for synced, event, buildid in pending:
+            self._apply(running[synced], event, buildid)
+        now = self.master.reactor.seconds()
+        for synced, buildids in running.items():
+            if synced in self._builds and self._builds[synced] != buildids:
+                log.info('running builds of builder {builderid} were off: '
+                         '{expected} instead of {actual}',
+                         builderid=synced,
+                         expected=len(self._builds[synced]),
+                         actual=len(buildids))
+            self._builds[synced] = buildids
+            self._synced_at[synced] = now
+
+    @defer.inlineCallbacks
+    def count(self, builderid):
+        """Return the number of builds running on a builder."""
+        yield self.start()
+        synced_at = self._synced_at.get(builderid)
+        if (synced_at is None or self.master.reactor.seconds() - synced_at
+                >= self.reconcile_interval):
+            yield self.reconcile(builderid)
+        return len(self._builds[builderid])
+
+
+class RunningBuildsReconciler(service.BuildbotService):
+    """Load the running builds of the master's tracker from the database.
+
+    The builds of all the builders are loaded when the master starts, then
+    every ``interval`` seconds.
+
+    Args:
+        interval (int): seconds between two loads.
+
+    """
+
+    name = 'RunningBuildsReconciler'
+    _loop = None
+
+    def checkConfig(self, interval=300):
+        # pylint: disable=arguments-differ
+        if interval <= 0:
+            config.error('the interval of RunningBuildsReconciler must be '
+                         'positive')
+
+    def reconfigService(self, interval=300):
+        # pylint: disable=arguments-differ
+        self.interval = interval
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+            self._start_loop()
+
+    @defer.inlineCallbacks
+    def startService(self):
+        yield super(RunningBuildsReconciler, self).startService()
+        yield get_running_builds(self.master, self.interval).start()
+        self._start_loop()
+
+    def stopService(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        # the consumers are started again with the next service
+        get_running_builds(self.master, self.interval).stop()
+        return super(RunningBuildsReconciler, self).stopService()
+
+    def _start_loop(self):
+        running_builds = get_running_builds(self.master, self.interval)
+        running_builds.reconcile_interval = self.interval
+        self._loop = task.LoopingCall(self.reconcile)
+        self._loop.clock = self.master.reactor
+        self._loop.start(self.interval, now=True)
+
+    @defer.inlineCallbacks
+    def reconcile(self):
+        """Load the running builds of all the builders."""
+        try:
+            yield get_running_builds(self.master, self.interval).reconcile()
+        except Exception:
+            # keep the loop going, builders are loaded on demand meanwhile
+            log.failure('unable to load the running builds')
+
+
+_RUNNING_BUILDS = WeakKeyDictionary()
+
+
+def get_running_builds(master, reconcile_interval=300):
+    """Return the running builds tracker of a master."""
+    try:
+        return _RUNNING_BUILDS[master]
+    except KeyError:
+        running_builds = RunningBuilds(master, reconcile_interval)
+        _RUNNING_BUILDS[master] = running_builds
+        return running_builds
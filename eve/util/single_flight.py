@@ -0,0 +1,92 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Coalesce identical concurrent operations of the master."""
+
+from twisted.internet import defer
+from twisted.python import failure
+
+
+class SingleFlight(object):
+    """Run each operation once, whoever asks for it concurrently.
+
+    Operations are identified by a key: while an operation runs, the callers
+    asking for the same key wait for it and get its result instead of
+    running it again. Operations sharing a ``lock_key`` (e.g. all the
+    operations on a docker image) run one after the other, and at most
+    ``max_concurrent`` operations run at the same time.
+
+    Args:
+        max_concurrent (int): maximum number of operations running at once.
+
+    """
+
+    def __init__(self, max_concurrent=1):
+        self.max_concurrent = max_concurrent
+        self._semaphore = defer.DeferredSemaphore(max_concurrent)
+        self._in_flight = {}
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def run(self, key, func, lock_key=None):
+        """Run func, unless an operation with the same key is running.
+
+        Args:
+            key: identifier of the operation.
+            func (callable): returns the result of the operation, or a
+                deferred firing with it.
+            lock_key: operations with the same lock key never run
+                simultaneously.
+
+        Returns:
+            A deferred firing with a ``(result, shared)`` tuple, where
+            ``shared`` tells whether the result was obtained by another
+            caller.
+
+        """
+        if key in self._in_flight:
+            waiter = defer.Deferred()
+            self._in_flight[key].append(waiter)
+            return waiter
+        self._in_flight[key] = []
+        return self._run(key, func, lock_key)
+
+    @defer.inlineCallbacks
+    def _run(self, key, func, lock_key):
+        try:
+            lock = None
+            if lock_key is not None:
+                lock = self._locks.setdefault(lock_key, defer.DeferredLock())
+                yield lock.acquire()
+            try:
+                result = yield self._semaphore.run(func)
+            finally:
+                if lock is not None:
+                    lock.release()
+                    if not lock.locked and not lock.waiting:
+                        del self._locks[lock_key]
+        except Exception:
+            error = failure.Failure()
+            for waiter in self._in_flight.pop(key):
+                waiter.errback(error)
+            raise
+
+        for waiter in self._in_flight.pop(key):
+            waiter.callback((result, True))
+        defer.returnValue((result, False))
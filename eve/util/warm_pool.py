@@ -0,0 +1,128 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Keep latent workers up between builds, following the demand."""
+
+from collections import defaultdict, deque
+
+
+class WarmPool(object):
+    """Decide which latent workers stay up, idle, once their build is done.
+
+    A worker kept warm is still connected to the master with its instance
+    running, so that the next build requiring the same kind of instance
+    starts on it right away. The kind of instance is described by a
+    hashable key, chosen by the workers.
+
+    The number of idle workers kept for a key is the number of builds
+    started with this key during the last ``window`` seconds, capped to
+    ``max_idle_per_key``. Idle workers are stopped by their worker after
+    ``ttl`` seconds, or earlier when all the workers are idle with other
+    keys and a build has none to run on (see `evict`).
+
+    Args:
+        max_idle_per_key (int): maximum number of idle workers per key.
+        ttl (int): seconds an idle worker is kept.
+        window (int): seconds of demand taken into account.
+
+    """
+
+    def __init__(self, max_idle_per_key=2, ttl=600, window=1800):
+        self.max_idle_per_key = max_idle_per_key
+        self.ttl = ttl
+        self.window = window
+        self._starts = defaultdict(deque)
+        self._idle = defaultdict(dict)
+        self._idle_since = {}
+        self._evicted = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _prune(self, key, now):
+        starts = self._starts[key]
+        while starts and starts[0] <= now - self.window:
+            starts.popleft()
+        if not starts:
+            del self._starts[key]
+
+    def target(self, key, now):
+        """Return the number of idle workers to keep for key."""
+        self._prune(key, now)
+        return min(self.max_idle_per_key, len(self._starts.get(key, ())))
+
+    def idle(self, key):
+        """Return the names of the idle workers for key."""
+        return sorted(self._idle.get(key, ()))
+
+    def record_start(self, worker, key, now, warm):
+        """Record a build starting on a worker."""
+        self._starts[key].append(now)
+        if warm:
+            self.hits += 1
+            self.release(worker)
+        else:
+            self.misses += 1
+
+    def keep(self, worker, key, now):
+        """Return whether a worker that finished its build stays up."""
+        idle = self._idle[key]
+        if worker.name not in idle and len(idle) >= self.target(key, now):
+            if not idle:
+                del self._idle[key]
+            return False
+        idle[worker.name] = worker
+        self._idle_since[worker.name] = now
+        return True
+
+    def evict(self, workers):
+        """Return the idle worker to stop to make room for another key.
+
+        Args:
+            workers (list): the workers unable to run a build.
+
+        Returns:
+            The worker of workers idle for the longest time, forgotten by
+            the pool, or None if none is idle or if one is already being
+            stopped.
+
+        """
+        if any(worker.name in self._evicted for worker in workers):
+            return None
+        idle = [worker for worker in workers
+                if worker.name in self._idle_since]
+        if not idle:
+            return None
+        worker = min(idle, key=lambda worker: self._idle_since[worker.name])
+        self.release(worker)
+        self._evicted.add(worker.name)
+        return worker
+
+    def release(self, worker):
+        """Forget a worker that is not idle anymore."""
+        self._idle_since.pop(worker.name, None)
+        self._evicted.discard(worker.name)
+        for key in list(self._idle):
+            self._idle[key].pop(worker.name, None)
+            if not self._idle[key]:
+                del self._idle[key]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'idle': sum(len(idle) for idle in self._idle.values()),
+        }
@@ -26,6 +26,8 @@ from buildbot.worker.latent import AbstractLatentWorker
 from twisted.internet import defer, threads
 from twisted.logger import Logger
 
+from .engine_api import DockerEngineError
+
 
 class EveDockerLatentWorker(AbstractLatentWorker):
     """Eve version on the DockerLatentWorker.
@@ -33,6 +35,13 @@ class EveDockerLatentWorker(AbstractLatentWorker):
     Improved version of DockerLatentWorker using the docker command line client
     instead of docker-py which was the cause of multiple dead locks.
 
+    When given a `DockerEngineClient`, the worker talks to the docker daemon
+    through its API instead of spawning the command line client: starting a
+    container takes two requests and stopping it a single one.
+
+    When given a `DockerWarmPool`, the worker may stay up once its build is
+    done, and run the next build requiring the same container.
+
     """
 
     quarantine_timeout = quarantine_initial_timeout = 5 * 60
@@ -40,39 +49,131 @@ class EveDockerLatentWorker(AbstractLatentWorker):
 
     logger = Logger('eve.workers.EveDockerLatentWorker')
     instance = None
+    container_spec = None
 
     def __init__(self, name, password, image, master_fqdn, pb_port,
-                 max_memory, max_cpus, **kwargs):
+                 max_memory, max_cpus, engine=None, warm_pool=None,
+                 **kwargs):
         # pylint: disable=too-many-arguments
         self.image = image
+        self.engine = engine
+        self.warm_pool = warm_pool
+        self.builds_may_be_incompatible = warm_pool is not None
         self.master_fqdn = master_fqdn
         self.pb_port = pb_port
         self.max_memory = max_memory
         self.max_cpus = max_cpus
+        if warm_pool is not None:
+            kwargs.setdefault('build_wait_timeout', warm_pool.ttl)
         kwargs.setdefault('build_wait_timeout', 0)
         kwargs.setdefault('keepalive_interval', None)
         AbstractLatentWorker.__init__(self, name, password, **kwargs)
 
+    @defer.inlineCallbacks
+    def render_container_spec(self, props):
+        """Return what a build requires from the container of the worker.
+
+        Args:
+            props: the build, or the properties of a build request.
+
+        """
+        image = yield props.render(self.image)
+        defer.returnValue((
+            image,
+            props.getProperty('docker_memory'),
+            tuple(props.getProperty('docker_volumes') or ()),
+            props.getProperty('docker_hook', None),
+        ))
+
+    @defer.inlineCallbacks
+    def isCompatibleWithBuild(self, build_props):
+        if self.container_spec is None:
+            defer.returnValue(True)
+        spec = yield self.render_container_spec(build_props)
+        defer.returnValue(spec == self.container_spec)
+
+    def set_worker_uuid(self, build):
+        repository = build.getProperty('repository')
+        uuid = util.create_hash(repository, self.name)
+        build.setProperty("worker_uuid", uuid, "Build")
+
+    def substantiate(self, wfb, build):
+        if self.substantiated and self.warm_pool is not None:
+            # the container of the previous build is reused
+            self.logger.info('Reusing container %s for %s' % (
+                self.instance, wfb))
+            self.set_worker_uuid(build)
+            self.retire(self.warm_pool.record_start(
+                self, self.container_spec[0],
+                self.master.reactor.seconds(), warm=True))
+        return super(EveDockerLatentWorker, self).substantiate(wfb, build)
+
+    def buildFinished(self, wfb):
+        super(EveDockerLatentWorker, self).buildFinished(wfb)
+        if (self.warm_pool is None or self.building
+                or self.container_spec is None):
+            return
+        if not self.warm_pool.keep(self, self.container_spec[0],
+                                   self.master.reactor.seconds()):
+            self._clearBuildWaitTimer()
+            self.master.reactor.callLater(0, self._soft_disconnect)
+
+    def retire(self, workers):
+        """Stop idle workers of the warm pool."""
+        for worker in workers:
+            self.logger.info('Retiring idle worker %s' % worker.name)
+            worker._clearBuildWaitTimer()
+            worker.master.reactor.callLater(0, worker._soft_disconnect)
+
+    def make_room(self, workers):
+        """Stop the idle worker unused for the longest time among workers.
+
+        Returns:
+            bool: whether the warm pool decides which worker is stopped.
+
+        """
+        if self.warm_pool is None:
+            return False
+        worker = self.warm_pool.evict(workers)
+        if worker is not None:
+            self.retire([worker])
+        return True
+
     @defer.inlineCallbacks
     def start_instance(self, build):
         if self.instance is not None:
             raise ValueError('instance active')
         self.instance = util.compute_instance_name(build)
-        repository = build.getProperty('repository')
-        uuid = util.create_hash(repository, self.name)
-        build.setProperty("worker_uuid", uuid, "Build")
-        image = yield build.render(self.image)
-        memory = build.getProperty('docker_memory')
-        volumes = build.getProperty('docker_volumes')
-        docker_hook_version = build.getProperty('docker_hook', None)
+        self.set_worker_uuid(build)
+        spec = yield self.render_container_spec(build)
+        image, memory, volumes, docker_hook_version = spec
         buildnumber = yield build.render(Property('bootstrap'))
         res = yield threads.deferToThread(self._thd_start_instance, image,
-                                          memory, volumes, buildnumber,
+                                          memory, list(volumes), buildnumber,
                                           docker_hook_version)
+        self.container_spec = spec
+        if self.warm_pool is not None:
+            self.retire(self.warm_pool.record_start(
+                self, image, self.master.reactor.seconds(), warm=False))
         defer.returnValue(res)
 
     def _thd_start_instance(self, image, memory, volumes, buildnumber,
                             docker_hook_version):
+        if memory:
+            if (util.convert_to_bytes(memory)
+                    > util.convert_to_bytes(self.max_memory)):
+                self.logger.error('Can not request %s RAM (max allowed %s).' %
+                                  (memory, self.max_memory))
+                raise LatentWorkerCannotSubstantiate(
+                    'Can not request %s RAM (max allowed is %s).' %
+                    (memory, self.max_memory)
+                )
+        else:
+            memory = self.max_memory
+
+        if self.engine is not None:
+            return self._thd_start_container(image, memory, volumes,
+                                             buildnumber, docker_hook_version)
 
         self.logger.info('Checking if %r docker image exist.' % image)
         if not self.docker('images', '--format', '{{.Repository}}', image):
@@ -91,22 +192,10 @@ class EveDockerLatentWorker(AbstractLatentWorker):
             '--env', 'WORKERPASS=%s' % self.password,
             '--label', 'buildnumber=%s' % buildnumber,
             '--detach',
-            '--cpus=%s' % self.max_cpus
+            '--cpus=%s' % self.max_cpus,
+            '--memory=%s' % memory,
         ]
 
-        if memory:
-            if (util.convert_to_bytes(memory)
-                    > util.convert_to_bytes(self.max_memory)):
-                self.logger.error('Can not request %s RAM (max allowed %s).' %
-                                  (memory, self.max_memory))
-                raise LatentWorkerCannotSubstantiate(
-                    'Can not request %s RAM (max allowed is %s).' %
-                    (memory, self.max_memory)
-                )
-            cmd.append('--memory=%s' % memory)
-        else:
-            cmd.append('--memory=%s' % self.max_memory)
-
         cmd.extend(['--volume=%s' % volume for volume in volumes])
 
         if docker_hook_version:
@@ -123,16 +212,55 @@ class EveDockerLatentWorker(AbstractLatentWorker):
         self.logger.debug('Container created, Id: %s...' % self.instance)
         return [self.instance, image]
 
+    def _thd_start_container(self, image, memory, volumes, buildnumber,
+                             docker_hook_version):
+        """Start the worker container with the docker engine API."""
+        labels = {'buildnumber': str(buildnumber)}
+        if docker_hook_version:
+            labels['docker_hook'] = docker_hook_version
+        try:
+            container_id = self.engine.run_container(
+                name=self.instance,
+                image=image,
+                env={
+                    'BUILDMASTER': self.master_fqdn,
+                    'BUILDMASTER_PORT': self.pb_port,
+                    'WORKERNAME': self.name,
+                    'WORKERPASS': self.password,
+                },
+                labels=labels,
+                memory=util.convert_to_bytes(memory),
+                cpus=self.max_cpus,
+                binds=volumes,
+                privileged=True)
+        except DockerEngineError as exc:
+            if exc.status == 404:
+                self.logger.error('%r image not found.' % image)
+                raise LatentWorkerCannotSubstantiate(
+                    'Image %s not found on docker host' % image)
+            self.logger.error('Docker run failed: %s' % exc)
+            raise LatentWorkerCannotSubstantiate(
+                'Docker run: %s' % exc.message)
+        self.logger.debug('Container created, Id: %s...' % container_id)
+        return [self.instance, image]
+
     def stop_instance(self, fast=False):
         assert not fast  # unused parameter, we cannot remove it (PEP8)
         if self.instance is None:
             return defer.succeed(None)
         instance = self.instance
         self.instance = None
+        self.container_spec = None
+        if self.warm_pool is not None:
+            self.warm_pool.release(self)
         return threads.deferToThread(self._thd_stop_instance, instance)
 
     def _thd_stop_instance(self, instance):
         self.logger.debug('Stopping container %s...' % instance)
+        if self.engine is not None:
+            self.engine.remove_container(instance)
+            self.logger.debug('Container %s stopped successfully.' % instance)
+            return
         self.docker('kill', instance)
         self.docker('wait', instance)
         self.docker('rm', '--volumes', instance)
@@ -0,0 +1,231 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Minimal client of the Docker Engine API over the docker unix socket."""
+
+import json
+import socket
+from http.client import HTTPConnection, HTTPException
+from queue import Empty, Full, LifoQueue
+from urllib.parse import quote, urlencode
+
+from twisted.logger import Logger
+
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+
+IDEMPOTENT_METHODS = frozenset(['DELETE', 'GET', 'HEAD', 'PUT'])
+
+
+def socket_path_from_docker_host(docker_host):
+    """Return the socket path of a DOCKER_HOST url.
+
+    Returns the default socket path when DOCKER_HOST is empty, and `None`
+    when it does not point to a unix socket.
+
+    """
+    if not docker_host:
+        return DEFAULT_SOCKET_PATH
+    if docker_host.startswith('unix://'):
+        return docker_host[len('unix://'):]
+    return None
+
+
+class DockerEngineError(Exception):
+    """The docker daemon answered with an error."""
+
+    def __init__(self, status, message):
+        super(DockerEngineError, self).__init__(
+            '{0}: {1}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """An HTTP connection to a unix socket."""
+
+    def __init__(self, socket_path, timeout=60):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerEngineClient(object):
+    """Talk to the docker daemon through a pool of keep-alive connections.
+
+    The client is blocking and thread safe: it is meant to be called from
+    the reactor thread pool, like the docker command line client it
+    replaces.
+
+    Args:
+        socket_path (str): path to the docker socket.
+        api_version (str): version of the API to use (e.g. ``1.40``), or
+            `None` for the version of the daemon.
+        pool_size (int): number of idle connections kept open.
+        timeout (int): timeout of the socket operations, in seconds.
+
+    """
+
+    logger = Logger('eve.workers.DockerEngineClient')
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, api_version=None,
+                 pool_size=8, timeout=60):
+        self.socket_path = socket_path
+        self.api_version = api_version
+        self.timeout = timeout
+        self._pool = LifoQueue(maxsize=pool_size)
+        self.connections_opened = 0
+
+    def _get_connection(self):
+        try:
+            return self._pool.get_nowait(), True
+        except Empty:
+            self.connections_opened += 1
+            return UnixHTTPConnection(self.socket_path, self.timeout), False
+
+    def _release_connection(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def close(self):
+        """Close all the idle connections."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except Empty:
+                return
+
+    def request(self, method, path, params=None, body=None):
+        """Send a request and return the (status, decoded json body) tuple.
+
+        A request which could not be sent on an idle connection, closed by
+        the daemon in the meantime, is sent again on a new connection. So
+        is an idempotent request left unanswered; the others, such as the
+        creation of a container, may have been handled by the daemon.
+
+        """
+        url = path
+        if self.api_version:
+            url = '/v{0}{1}'.format(self.api_version, path)
+        if params:
+            url += '?' + urlencode(params)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        while True:
+            connection, reused = self._get_connection()
+            sent = False
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                sent = True
+                response = connection.getresponse()
+                data = response.read()
+            except (HTTPException, OSError):
+                connection.close()
+                if reused and (not sent or method in IDEMPOTENT_METHODS):
+                    continue
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+
+        try:
+            decoded = json.loads(data.decode('utf-8')) if data else None
+        except ValueError:
+            decoded = data.decode('utf-8', 'replace')
+        return response.status, decoded
+
+    def _check(self, status, body, expected):
+        if status in expected:
+            return body
+        message = body.get('message') if isinstance(body, dict) else body
+        raise DockerEngineError(status, message)
+
+    def image_exists(self, image):
+        status, body = self.request(
+            'GET', '/images/{0}/json'.format(quote(image, safe='/:@')))
+        if status == 404:
+            return False
+        self._check(status, body, (200,))
+        return True
+
+    def run_container(self, name, image, env=None, labels=None,
+                      memory=None, cpus=None, binds=None, privileged=False):
+        """Create and start a detached container, like ``docker run -d``.
+
+        Raises:
+            DockerEngineError: the container could not be created or
+                started; status 404 means the image does not exist.
+
+        Returns:
+            str: the id of the container.
+
+        """
+        host_config = {
+            'Privileged': privileged,
+            'Binds': list(binds or []),
+        }
+        if memory is not None:
+            host_config['Memory'] = memory
+        if cpus is not None:
+            host_config['NanoCpus'] = int(float(cpus) * 1e9)
+        config = {
+            'Image': image,
+            'Env': ['{0}={1}'.format(key, value)
+                    for key, value in (env or {}).items()],
+            'Labels': dict(labels or {}),
+            'HostConfig': host_config,
+        }
+        status, body = self.request('POST', '/containers/create',
+                                    params={'name': name}, body=config)
+        container_id = self._check(status, body, (201,))['Id']
+        status, body = self.request(
+            'POST', '/containers/{0}/start'.format(container_id))
+        try:
+            self._check(status, body, (204, 304))
+        except DockerEngineError:
+            self.remove_container(container_id)
+            raise
+        return container_id
+
+    def remove_container(self, container):
+        """Kill and remove a container and its volumes, in a single call.
+
+        Returns:
+            bool: whether the container existed.
+
+        """
+        status, body = self.request(
+            'DELETE', '/containers/{0}'.format(container),
+            params={'force': 'true', 'v': 'true'})
+        if status == 404:
+            self.logger.info('container {container} was already removed',
+                             container=container)
+            return False
+        self._check(status, body, (204,))
+        return True
@@ -0,0 +1,78 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Keep docker workers of frequently used images running between builds."""
+
+from twisted.logger import Logger
+
+from ...util.warm_pool import WarmPool
+
+
+def image_repository(image):
+    """Return the image name without its tag."""
+    name, _, tag = image.rpartition(':')
+    if not name or '/' in tag:
+        return image
+    return name
+
+
+class DockerWarmPool(WarmPool):
+    """Decide which docker workers stay up, idle, once their build is done.
+
+    A worker kept warm is still connected to the master, with its container
+    running: the next build requiring the same image, memory, volumes and
+    docker hook starts on it without waiting for a new container (see
+    `EveDockerLatentWorker.isCompatibleWithBuild`).
+
+    The number of idle workers kept for an image is the number of builds
+    started with this image during the last ``window`` seconds, capped to
+    ``max_idle_per_image``. Idle workers are stopped after ``ttl`` seconds,
+    and as soon as a build requires another tag of their image (i.e. the
+    fingerprint of the image changed).
+
+    Args:
+        max_idle_per_image (int): maximum number of idle workers per image.
+        ttl (int): seconds an idle worker is kept.
+        window (int): seconds of demand taken into account.
+
+    """
+
+    logger = Logger('eve.workers.DockerWarmPool')
+
+    def __init__(self, max_idle_per_image=2, ttl=600, window=1800):
+        super(DockerWarmPool, self).__init__(
+            max_idle_per_key=max_idle_per_image, ttl=ttl, window=window)
+
+    @property
+    def max_idle_per_image(self):
+        return self.max_idle_per_key
+
+    def record_start(self, worker, image, now, warm):
+        """Record a build starting on a worker.
+
+        Returns the idle workers that should be retired because they run
+        another tag of the same image.
+
+        """
+        super(DockerWarmPool, self).record_start(worker, image, now, warm)
+        superseded = []
+        repository = image_repository(image)
+        for other_image in list(self._idle):
+            if (other_image != image
+                    and image_repository(other_image) == repository):
+                superseded.extend(self._idle.pop(other_image).values())
+        return superseded
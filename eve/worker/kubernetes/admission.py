@@ -0,0 +1,202 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Start kube pod builds only when the namespace has room for them."""
+
+from time import monotonic
+
+from buildbot.plugins import util
+from twisted.logger import Logger
+
+from ...util.histogram import LatencyHistogram
+
+FINISHED_PHASES = ('Succeeded', 'Failed')
+
+WAIT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def pod_requests(pod):
+    """Return the cpus and bytes of memory requested by a pod.
+
+    Args:
+        pod (dict or V1Pod): the pod description, or its state.
+
+    """
+    if isinstance(pod, dict):
+        containers = [(container.get('resources') or {}).get('requests')
+                      for container in pod['spec']['containers']]
+    else:
+        containers = [container.resources.requests
+                      if container.resources is not None else None
+                      for container in pod.spec.containers]
+    cpu = memory = 0
+    for requests in containers:
+        requests = requests or {}
+        if 'cpu' in requests:
+            cpu += util.convert_to_cpus(requests['cpu'])
+        if 'memory' in requests:
+            memory += util.convert_to_bytes(requests['memory'])
+    return cpu, memory
+
+
+class AdmissionController(object):
+    """Keep the pods of the kube workers within a budget of resources.
+
+    The resources in use are the requests of the eve pods alive in the
+    namespace, as seen by the pod informer, and the reservations of the
+    builds admitted whose pod is not created yet. A build request whose
+    pod does not fit in the budget is left in the queue of the master; it
+    is checked again when a worker releases its reservation.
+
+    A build is always admitted when nothing is in use, so that a pod
+    bigger than the budget does not wait forever.
+
+    Args:
+        cpu_budget (float): cpus the pods may request, unlimited if None.
+        memory_budget (int): bytes of memory the pods may request,
+            unlimited if None.
+        reservation_ttl (int): seconds after which a reservation whose
+            pod was never started is dropped.
+        held_ttl (int): seconds after which a held request not checked
+            again is considered gone.
+
+    """
+
+    logger = Logger('eve.workers.AdmissionController')
+
+    def __init__(self, cpu_budget=None, memory_budget=None,
+                 reservation_ttl=120, held_ttl=3600):
+        self.cpu_budget = cpu_budget
+        self.memory_budget = memory_budget
+        self.reservation_ttl = reservation_ttl
+        self.held_ttl = held_ttl
+        self.reservations = {}
+        self.held = {}
+        self.admitted = 0
+        self.wait_times = LatencyHistogram(WAIT_BUCKETS)
+
+    def usage(self, pods=()):
+        """Return the cpus and memory in use.
+
+        Args:
+            pods (iterable): the known eve pods (`V1Pod`).
+
+        """
+        now = monotonic()
+        for worker, (_, _, reserved_at, started) in list(
+                self.reservations.items()):
+            if not started and now - reserved_at > self.reservation_ttl:
+                del self.reservations[worker]
+
+        cpu = sum(cpu for cpu, _, _, _ in self.reservations.values())
+        memory = sum(memory for _, memory, _, _ in self.reservations.values())
+        for pod in pods:
+            if pod.status is not None and pod.status.phase in FINISHED_PHASES:
+                continue
+            labels = pod.metadata.labels or {}
+            if labels.get('workername') in self.reservations:
+                # already counted
+                continue
+            try:
+                pod_cpu, pod_memory = pod_requests(pod)
+            except ValueError:
+                # not created by eve
+                continue
+            cpu += pod_cpu
+            memory += pod_memory
+        return cpu, memory
+
+    def fits(self, cpu, memory, pods=()):
+        used_cpu, used_memory = self.usage(pods)
+        if not used_cpu and not used_memory:
+            return True
+        if (self.cpu_budget is not None
+                and used_cpu + cpu > self.cpu_budget):
+            return False
+        if (self.memory_budget is not None
+                and used_memory + memory > self.memory_budget):
+            return False
+        return True
+
+    def admit(self, request_id, worker, cpu, memory, pods=()):
+        """Reserve the resources of a build request, if they are available.
+
+        Args:
+            request_id (int): id of the build request.
+            worker (str): name of the worker which would run the build.
+            cpu (float): cpus requested by the pod of the build.
+            memory (int): bytes of memory requested by the pod of the build.
+            pods (iterable): the known eve pods (`V1Pod`).
+
+        Returns:
+            True if the build may start.
+
+        """
+        now = monotonic()
+        if not self.fits(cpu, memory, pods):
+            if request_id not in self.held:
+                self.logger.info(
+                    'holding build request {request} until the namespace '
+                    'has room for {cpu} cpus and {memory} bytes',
+                    request=request_id, cpu=cpu, memory=memory)
+                self.held[request_id] = [now, now]
+            else:
+                self.held[request_id][1] = now
+            return False
+
+        self.reservations[worker] = (cpu, memory, now, False)
+        self.admitted += 1
+        held = self.held.pop(request_id, None)
+        if held is not None:
+            self.wait_times.observe(now - held[0])
+            self.logger.info(
+                'admitted build request {request} after {wait:.1f}s',
+                request=request_id, wait=now - held[0])
+        return True
+
+    def started(self, worker):
+        """Mark the reservation of a worker as used by a started pod."""
+        reservation = self.reservations.get(worker)
+        if reservation is not None:
+            self.reservations[worker] = reservation[:3] + (True,)
+
+    def release(self, worker):
+        """Release the reservation of a worker."""
+        return self.reservations.pop(worker, None) is not None
+
+    @property
+    def queue_depth(self):
+        """Return the number of build requests held."""
+        now = monotonic()
+        for request_id, (_, checked_at) in list(self.held.items()):
+            if now - checked_at > self.held_ttl:
+                del self.held[request_id]
+        return len(self.held)
+
+    def stats(self, pods=()):
+        """Return a dict describing the usage of the budget."""
+        cpu, memory = self.usage(pods)
+        return {
+            'cpu': cpu,
+            'cpu_budget': self.cpu_budget,
+            'memory': memory,
+            'memory_budget': self.memory_budget,
+            'reservations': len(self.reservations),
+            'queue_depth': self.queue_depth,
+            'admitted': self.admitted,
+            'wait': self.wait_times.summary(),
+        }
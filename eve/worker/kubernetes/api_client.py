@@ -0,0 +1,163 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Kubernetes API client shared by the kube pod workers."""
+
+from threading import Lock
+from time import monotonic
+
+from twisted.logger import Logger
+
+from ...util.histogram import LatencyHistogram
+
+try:
+    from kubernetes import client
+    from kubernetes import config as kube_config
+    from kubernetes.client.rest import ApiException
+except ImportError:
+    client = None
+
+HTTP_UNAUTHORIZED = 401
+
+
+def default_configuration():
+    """Return a copy of the default kubernetes client configuration."""
+    # the constructor of older clients already returns a copy of it
+    if hasattr(client.Configuration, 'get_default_copy'):
+        # pylint: disable=no-member
+        return client.Configuration.get_default_copy()
+    return client.Configuration()
+
+
+def load_configuration():
+    """Load the credentials of the master and return the configuration."""
+    try:
+        kube_config.load_incluster_config()
+    except Exception:
+        kube_config.load_kube_config()
+    return default_configuration()
+
+
+class KubeClient(object):
+    """Call the kubernetes API through a single pool of connections.
+
+    The configuration is loaded on first use and loaded again every
+    ``refresh_interval`` seconds, or when the API server rejects the
+    credentials, to pick up rotated service account tokens. The duration of
+    the calls made with `call` is recorded in `latencies`, per method.
+
+    The client is blocking and thread safe: it is meant to be called from
+    the reactor thread pool.
+
+    Args:
+        overrides (dict): attributes of the configuration to override.
+        pool_size (int): maximum number of connections kept open.
+        refresh_interval (int): seconds between two loads of the
+            credentials.
+        loader (callable): returns the configuration to use.
+
+    """
+
+    logger = Logger('eve.workers.KubeClient')
+
+    def __init__(self, overrides=None, pool_size=32, refresh_interval=600,
+                 loader=None):
+        self.overrides = dict(overrides or {})
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.loader = loader or load_configuration
+        self.latencies = {}
+        self.config_loads = 0
+        self._api = None
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def _load(self):
+        configuration = self.loader()
+        for key, value in self.overrides.items():
+            setattr(configuration, key, value)
+        configuration.connection_pool_maxsize = self.pool_size
+        previous = self._api
+        self._api = client.CoreV1Api(client.ApiClient(configuration))
+        self._loaded_at = monotonic()
+        self.config_loads += 1
+        if previous is not None and hasattr(previous.api_client, 'close'):
+            previous.api_client.close()
+
+    def core_api(self):
+        """Return the `CoreV1Api`, with up to date credentials."""
+        with self._lock:
+            if (self._api is None
+                    or monotonic() - self._loaded_at > self.refresh_interval):
+                if self._api is not None:
+                    self.logger.info('kube api calls: {summary}',
+                                     summary=self.summary())
+                self._load()
+            return self._api
+
+    def refresh(self):
+        """Load the credentials again."""
+        with self._lock:
+            self._load()
+
+    def call(self, method, *args, **kwargs):
+        """Call a method of the `CoreV1Api` and time it.
+
+        A call rejected with 401 Unauthorized is made again once, after
+        loading the credentials again.
+
+        """
+        for attempt in (1, 2):
+            api = self.core_api()
+            start = monotonic()
+            try:
+                return getattr(api, method)(*args, **kwargs)
+            except ApiException as ex:
+                if ex.status != HTTP_UNAUTHORIZED or attempt == 2:
+                    raise
+                self.logger.info('kube credentials rejected, reloading them')
+                self.refresh()
+            finally:
+                self._histogram(method).observe(monotonic() - start)
+
+    def _histogram(self, method):
+        histogram = self.latencies.get(method)
+        if histogram is None:
+            histogram = self.latencies.setdefault(method, LatencyHistogram())
+        return histogram
+
+    def summary(self):
+        return ', '.join('%s: %s' % (method, histogram.summary())
+                         for method, histogram
+                         in sorted(self.latencies.items()))
+
+
+_KUBE_CLIENTS = {}
+
+
+def get_kube_client(overrides=None):
+    """Return the kubernetes API client shared by the workers.
+
+    Args:
+        overrides (dict): attributes of the configuration to override.
+
+    """
+    key = tuple(sorted((overrides or {}).items()))
+    kube_client = _KUBE_CLIENTS.get(key)
+    if kube_client is None:
+        kube_client = _KUBE_CLIENTS[key] = KubeClient(overrides)
+    return kube_client
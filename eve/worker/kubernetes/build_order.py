@@ -17,6 +17,9 @@
 # Boston, MA  02110-1301, USA.
 
 from buildbot.plugins import util
+from buildbot.process.properties import Property
+
+from .pre_pull import KubePrePullImages
 
 
 class KubernetesPodBuildOrder(util.BaseDockerBuildOrder):
@@ -66,8 +69,30 @@ class KubernetesPodBuildOrder(util.BaseDockerBuildOrder):
 
         self.properties['worker_images'] = (image_vars,
                                             'KubernetesPodBuildOrder')
+        self.setup_prepull(image_vars)
         self.properties['worker_vars'] = (self._worker.get('vars', {}),
                                           'KubernetesPodBuildOrder')
 
         self.properties['worker_service'] = (self._worker.get('service', None),
                                              'KubernetesPodBuildOrder')
+
+    def setup_prepull(self, image_vars):
+        """Pull the images on the cluster once they are in the registry.
+
+        Images built without registry are not available to the cluster.
+
+        """
+        if not (image_vars and util.env.KUBE_POD_PREPULL
+                and util.env.DOCKER_REGISTRY_URL):
+            return
+
+        self.preliminary_steps.append(KubePrePullImages(
+            stage_name=self._stage_name,
+            images=image_vars,
+            namespace=util.env.KUBE_POD_NAMESPACE,
+            node_affinity=util.env.KUBE_POD_NODE_AFFINITY,
+            deadline=util.env.KUBE_POD_PREPULL_DEADLINE,
+        ))
+        self.properties['worker_prepull_pod'] = (
+            Property(KubePrePullImages.property_name(self._stage_name)),
+            'KubernetesPodBuildOrder')
@@ -17,8 +17,9 @@
 # Boston, MA  02110-1301, USA.
 """Allow eve to use kubernetes pods as workers."""
 
+import json
 import socket
-from time import sleep
+from copy import deepcopy
 
 import yaml
 from buildbot import config
@@ -30,9 +31,13 @@ from jinja2 import StrictUndefined, Template
 from twisted.internet import defer, threads
 from twisted.logger import Logger
 
+from ...util.cache import LRUCache, content_hash
+from .admission import pod_requests
+from .api_client import get_kube_client
+from .pod_informer import get_pod_informer
+
 try:
     from kubernetes import client
-    from kubernetes import config as kube_config
     from kubernetes.client.rest import ApiException
 except ImportError:
     client = None
@@ -80,6 +85,14 @@ spec:
       args: [ "init" ]
 """
 
+# Compiled pod templates, indexed by the sha256 of their source.
+TEMPLATE_CACHE = LRUCache(max_entries=64)
+
+# Validated pods, indexed by the sha256 of their template and the variables
+# it was rendered with. Entries are deep copied on read, the workers are
+# free to modify what they get.
+POD_CACHE = LRUCache(max_entries=256, copy=deepcopy)
+
 
 class KubePodWorkerCannotSubstantiate(LatentWorkerCannotSubstantiate):
     """Fatal kubernetes pod substantiation error.
@@ -92,7 +105,7 @@ class KubePodWorkerCannotSubstantiate(LatentWorkerCannotSubstantiate):
 
     """
 
-    def __init__(self, fmt, instance):
+    def __init__(self, fmt, instance, kube_client=None):
         self.pod = instance.metadata.name
         self.status = instance.status
         self.message = '%s: %%s' % (fmt % {
@@ -126,7 +139,8 @@ class KubePodWorkerCannotSubstantiate(LatentWorkerCannotSubstantiate):
 
                     if container.state.terminated.reason == 'Error':
                         try:
-                            log = client.CoreV1Api().read_namespaced_pod_log(
+                            log = (kube_client or get_kube_client()).call(
+                                'read_namespaced_pod_log',
                                 self.pod,
                                 instance.metadata.namespace,
                                 container=container.name,
@@ -144,22 +158,19 @@ class EveKubeLatentWorker(AbstractLatentWorker):
 
     logger = Logger('eve.workers.EveKubeLatentWorker')
     instance = None
-    _poll_resolution = 2
+    _delete_timeout = 240
+    admission = None
+    kube_client = None
+    pod_informer = None
+    prepull_pod = None
     service_pod = None
-
-    def load_config(self):
-        try:
-            kube_config.load_incluster_config()
-        except Exception:
-            kube_config.load_kube_config()
-        if self.kubeConfig:
-            for config_key, value in self.kubeConfig.items():
-                setattr(client.configuration, config_key, value)
+    service_ready = None
 
     def checkConfig(self, name, password, master_fqdn, pb_port,
                     namespace, node_affinity, max_memory, max_cpus,
                     gitconfig, active_deadline, kube_config,
-                    service, service_data, **kwargs):
+                    service, service_data, kube_client=None,
+                    admission=None, **kwargs):
         """Ensure we have the kubernetes client available."""
         # Set build_wait_timeout to 0 if not explicitly set: Starting a
         # container is almost immediate, we can afford doing so for each build.
@@ -172,7 +183,8 @@ class EveKubeLatentWorker(AbstractLatentWorker):
     def reconfigService(self, name, password, master_fqdn, pb_port,
                         namespace, node_affinity, max_memory, max_cpus,
                         gitconfig, active_deadline, kube_config,
-                        service, service_data, **kwargs):
+                        service, service_data, kube_client=None,
+                        admission=None, **kwargs):
         # Set build_wait_timeout to 0 if not explicitly set: Starting a
         # container is almost immediate, we can afford doing so for each build.
         kwargs.setdefault('build_wait_timeout', 0)
@@ -181,6 +193,7 @@ class EveKubeLatentWorker(AbstractLatentWorker):
         self.namespace = namespace or 'default'
         self.node_affinity = node_affinity
         self.kubeConfig = kube_config
+        self.kube_client = kube_client or get_kube_client(kube_config)
         self.pb_port = pb_port
         self.max_memory = max_memory
         self.max_cpus = max_cpus
@@ -188,13 +201,67 @@ class EveKubeLatentWorker(AbstractLatentWorker):
         self.gitconfig = gitconfig
         self.service = service
         self.service_data = service_data
+        self.admission = admission
         return AbstractLatentWorker.reconfigService(self, name, password,
                                                     **kwargs)
 
-    def get_pod_config(self, name, source, variables):
-        """Render and load valid pod template."""
+    def admit(self, request):
+        """Tell whether the namespace has room for the pod of a request.
+
+        The resources of the pod are reserved in the admission controller
+        until the instance is stopped.
+
+        """
+        if self.admission is None:
+            return True
+
+        props = request.properties
+        try:
+            pod = self.get_pod_config(
+                props.getProperty('worker_path'),
+                props.getProperty('worker_template'),
+                variables={
+                    'images': props.getProperty('worker_images'),
+                    'vars': props.getProperty('worker_vars'),
+                }
+            )
+            cpu, memory = pod_requests(pod)
+        except Exception:
+            # start_instance reports the error to the build
+            cpu = memory = 0
+        return self.admission.admit(request.id, self.name, cpu, memory,
+                                    self.get_pod_informer().pods.values())
+
+    def get_pod_config(self, name, source, variables, reuse=True):
+        """Render and load valid pod template.
+
+        Templates are compiled once per source. Unless ``reuse`` is False,
+        the pod loaded from a template rendered with the same variables is
+        kept as well, and a copy of it is returned.
+
+        """
+        try:
+            digest = content_hash(source)
+            template = TEMPLATE_CACHE.get(
+                digest, lambda: Template(source, undefined=StrictUndefined))
+        except Exception as ex:
+            raise LatentWorkerCannotSubstantiate(
+                'Unable to render %s (%s)' % (name, ex))
+
+        key = None
+        if reuse:
+            try:
+                key = (digest, json.dumps(variables, sort_keys=True))
+            except (TypeError, ValueError):
+                pass
+        if key is None:
+            return self._load_pod(name, template, variables)
+        return POD_CACHE.get(
+            key, lambda: self._load_pod(name, template, variables))
+
+    @staticmethod
+    def _load_pod(name, template, variables):
         try:
-            template = Template(source, undefined=StrictUndefined)
             rendered_body = template.render(variables)
         except Exception as ex:
             raise LatentWorkerCannotSubstantiate(
@@ -246,6 +313,28 @@ class EveKubeLatentWorker(AbstractLatentWorker):
                                 'operator': 'In',
                                 'values': [self.node_affinity.value]}]}]}}}
 
+    def prefer_prepull_node(self, pod, build):
+        """Prefer the node that pulled the images of the pod in advance."""
+        prepull = build.getProperty('worker_prepull_pod')
+        if not prepull:
+            return
+
+        state = self.get_pod_informer().pods.get(prepull)
+        node = state.spec.node_name if state is not None else None
+        if not node:
+            return
+
+        node_affinity = pod['spec'].setdefault(
+            'affinity', {}).setdefault('nodeAffinity', {})
+        node_affinity.setdefault(
+            'preferredDuringSchedulingIgnoredDuringExecution', []).append({
+                'weight': 100,
+                'preference': {
+                    'matchExpressions': [{
+                        'key': 'kubernetes.io/hostname',
+                        'operator': 'In',
+                        'values': [node]}]}})
+
     def enforce_gitconfig(self, pod):
         """Implicitly set the git config in every containers."""
         if not self.gitconfig:
@@ -416,7 +505,9 @@ class EveKubeLatentWorker(AbstractLatentWorker):
                 'service_requests': worker_service.get('requests', {}),
                 'uuid': uuid,
                 'worker_pod_name': util.compute_instance_name(build),
-            }
+            },
+            # the variables are unique to each build
+            reuse=False,
         )
         self.enforce_affinity_policy(self.service_pod)
         self.add_common_worker_env_vars(self.service_pod, build)
@@ -441,8 +532,21 @@ class EveKubeLatentWorker(AbstractLatentWorker):
                 'subPath': 'kubeconfig'
             })
 
-    @defer.inlineCallbacks
     def start_instance(self, build):
+        self.prepull_pod = build.getProperty('worker_prepull_pod')
+        started = defer.maybeDeferred(self._start_instance, build)
+        started.addBoth(self._release_prepull_pod)
+        return started
+
+    def _release_prepull_pod(self, result=None):
+        """Delete the pod that pulled the images of the worker pod."""
+        name, self.prepull_pod = self.prepull_pod, None
+        if name:
+            self._deferwaiter.add(self.delete_pod(name))
+        return result
+
+    @defer.inlineCallbacks
+    def _start_instance(self, build):
         if self.instance is not None:
             raise ValueError('instance active')
         if self.registration is not None:
@@ -464,6 +568,7 @@ class EveKubeLatentWorker(AbstractLatentWorker):
             build.setProperty("worker_uuid", uuid, "Build")
             self.enforce_restart_policy(pod)
             self.enforce_affinity_policy(pod)
+            self.prefer_prepull_node(pod, build)
             self.enforce_gitconfig(pod)
             self.add_common_worker_env_vars(pod, build)
             self.add_common_worker_metadata(pod, build)
@@ -478,61 +583,115 @@ class EveKubeLatentWorker(AbstractLatentWorker):
                 'Unable to validate pod config %s (%s)' % (self.template_path,
                                                            ex))
 
-        res = yield threads.deferToThread(
-            self._thd_start_instance,
-            pod
-        )
-        defer.returnValue(res)
+        # The worker pod is created while the service is initialized; it
+        # only gets its credentials once the init is done, and its worker
+        # is not attached before (see `attached`).
+        self.service_ready = defer.Deferred()
+        init = self.service_init()
+        init.addBoth(self._service_init_done)
+        created = threads.deferToThread(self._thd_create_pod, pod)
+        try:
+            yield init
+        except Exception:
+            try:
+                instance = yield created
+            except Exception:
+                pass
+            else:
+                yield self.delete_pod(instance.metadata.name)
+            raise
 
-    def _thd_start_pod(self, pod, wait_for_completion=False):
-        """Start the pod resource provided as a dictionnary.
+        instance = yield created
+        if self.admission is not None:
+            self.admission.started(self.name)
+        self.instance = yield self.wait_for_pod(instance)
+        defer.returnValue(self.instance)
 
-        This method will block until the pod has reached one
-        of the stable condition RUNNING/COMPLETE/FAILED.
+    def _service_init_done(self, result):
+        ready, self.service_ready = self.service_ready, None
+        ready.callback(None)
+        return result
 
-        """
+    @defer.inlineCallbacks
+    def attached(self, bot):
+        """Hold the worker until its service is initialized."""
+        if self.service_ready is not None:
+            self.logger.debug('Waiting for service init of %s...' %
+                              self.name)
+            yield self.service_ready
+        res = yield super(EveKubeLatentWorker, self).attached(bot)
+        defer.returnValue(res)
+
+    def get_pod_informer(self):
+        """Return the informer following the pods of the namespace."""
+        if self.pod_informer is None:
+            self.pod_informer = get_pod_informer(
+                self.namespace, self.master.reactor, self.kube_client)
+        return self.pod_informer
+
+    def _thd_create_pod(self, pod):
         pod_name = pod.get('metadata', {}).get('name', 'no_name')
         self.logger.debug('Starting pod %r with config:\n%s' % (
                           pod_name,
                           yaml.safe_dump(pod, default_flow_style=False)))
         try:
-            instance = client.CoreV1Api().create_namespaced_pod(
-                self.namespace, pod)
+            return self.kube_client.call('create_namespaced_pod',
+                                         self.namespace, pod)
         except ApiException as ex:
             raise LatentWorkerCannotSubstantiate(
                 'Failed to create pod %s: %s' % (pod_name, ex.reason))
 
+    @defer.inlineCallbacks
+    def start_pod(self, pod, wait_for_completion=False):
+        """Start the pod resource provided as a dictionnary.
+
+        The returned deferred fires once the pod has reached one
+        of the stable condition RUNNING/COMPLETE/FAILED.
+
+        """
+        instance = yield threads.deferToThread(self._thd_create_pod, pod)
+        name = yield self.wait_for_pod(instance, wait_for_completion)
+        defer.returnValue(name)
+
+    @defer.inlineCallbacks
+    def wait_for_pod(self, instance, wait_for_completion=False):
+        """Wait for a created pod to be running, or completed."""
+        informer = self.get_pod_informer()
+        name = instance.metadata.name
+
         pending = [None, 'Pending', 'Unknown']
         if wait_for_completion:
             pending.append('Running')
-        duration = 0
-        while instance.status.phase in pending:
-            sleep(self._poll_resolution)
-            duration += self._poll_resolution
-            try:
-                instance = client.CoreV1Api().read_namespaced_pod_status(
-                    instance.metadata.name, self.namespace)
-            except ApiException as ex:
-                if wait_for_completion:
-                    # pod may have completed
-                    break
+        last_seen = [instance]
+
+        def settled(state):
+            if state is None:
+                return True
+            last_seen[0] = state
+            return state.status.phase not in pending
 
+        state = yield informer.wait(name, settled)
+        if state is None:
+            if not wait_for_completion:
                 raise LatentWorkerFailedToSubstantiate(
-                    'Pod %s went missing: %s' % (instance.metadata.name,
-                                                 ex.reason))
+                    'Pod %s went missing' % name)
+            # pod may have completed
+            state = last_seen[0]
+        instance = state
 
         # Ensure the pod is running or has run successfully
         if instance.status.phase in [None, 'Pending', 'Failed', 'Unknown']:
-            try:
-                raise KubePodWorkerCannotSubstantiate(
-                    'Creating Pod %(pod)s failed (%(phase)s)', instance)
-            finally:
-                self.delete_pod(instance.metadata.name)
+            error = yield threads.deferToThread(
+                KubePodWorkerCannotSubstantiate,
+                'Creating Pod %(pod)s failed (%(phase)s)', instance,
+                self.kube_client)
+            yield self.delete_pod(name)
+            raise error
 
         if wait_for_completion:
-            self.delete_pod(instance.metadata.name)
+            yield self.delete_pod(name)
 
-        return instance.metadata.name
+        defer.returnValue(name)
 
     def service_run(self, stage):
         if self.service_pod:
@@ -541,75 +700,77 @@ class EveKubeLatentWorker(AbstractLatentWorker):
                 self.service_pod['metadata']['labels']['worker_pod_name'],
                 stage
             )
-            self._thd_start_pod(self.service_pod, wait_for_completion=True)
+            return self.start_pod(self.service_pod, wait_for_completion=True)
+        return defer.succeed(None)
 
     def service_init(self):
         self.logger.debug('Run kube service init (%s)...' % self.service)
-        self.service_run('init')
+        return self.service_run('init')
 
+    @defer.inlineCallbacks
     def service_teardown(self):
         self.logger.debug('Run kube service teardown (%s)...' % self.service)
         try:
-            self.service_run('teardown')
+            yield self.service_run('teardown')
         except Exception:
             # fail silently on teardown to prevent
             # hiding previous potential exceptions
             pass
 
+    def _thd_delete_pod(self, name, **options):
+        self.kube_client.call(
+            'delete_namespaced_pod', name, self.namespace,
+            body=client.V1DeleteOptions(**options))
+
+    @defer.inlineCallbacks
     def delete_pod(self, name):
         self.logger.debug('deleting kube pod %s...' % name)
-        max_wait_time = 240
-        duration = 0
+        informer = self.get_pod_informer()
         try:
-            # pylint: disable=too-many-function-args
-            client.CoreV1Api().delete_namespaced_pod(name,
-                                                     self.namespace,
-                                                     client.V1DeleteOptions())
+            yield threads.deferToThread(self._thd_delete_pod, name)
             # Ensure that deleted pods are actually gone and not
             # on terminating phase. This allow us to avoid attaching undesired
             # buildbot-workers on new builds.
-            while duration < max_wait_time:
-                instance = client.CoreV1Api().read_namespaced_pod_status(
-                    name,
-                    self.namespace)
-                self.logger.info('kube pod %s still in phase %s' %
-                                 (name, instance.status.phase))
-                sleep(self._poll_resolution)
-                duration += self._poll_resolution
-
-            self.logger.info('max wait time reached forcing'
-                             ' deletion of pod %s' % name)
-            # pylint: disable=too-many-function-args
-            client.CoreV1Api().delete_namespaced_pod(
-                name,
-                self.namespace,
-                client.V1DeleteOptions(grace_period_seconds=0))
+            try:
+                yield informer.wait(name, lambda state: state is None,
+                                    timeout=self._delete_timeout)
+            except defer.TimeoutError:
+                self.logger.info('max wait time reached forcing'
+                                 ' deletion of pod %s' % name)
+                yield threads.deferToThread(self._thd_delete_pod, name,
+                                            grace_period_seconds=0)
+            else:
+                self.logger.info('kube pod %s was successfully deleted' %
+                                 name)
         except ApiException as ex:
             if ex.status == 404:
                 self.logger.info('kube pod %s was successfully deleted' % name)
             else:
                 self.logger.debug('unable to delete kube pod %s...' % name)
-            pass
-
-    def _thd_start_instance(self, pod):
-        self.load_config()
 
-        self.service_init()
-        self.instance = self._thd_start_pod(pod)
-
-        return self.instance
+    def release_resources(self):
+        """Let the builds held by the admission controller start."""
+        if self.admission is None:
+            return
+        self.admission.release(self.name)
+        if self.admission.queue_depth:
+            self.logger.info('kube pod admission: {stats}',
+                             stats=self.admission.stats(
+                                 self.get_pod_informer().pods.values()))
+            self.botmaster.maybeStartBuildsForWorker(self.name)
 
+    @defer.inlineCallbacks
     def stop_instance(self, fast=False):
         assert not fast
         instance = self.instance
         self.instance = None
-        return threads.deferToThread(self._thd_stop_instance, instance, fast)
-
-    def _thd_stop_instance(self, instance, fast):
         self.logger.debug('Deleting worker %s...' % instance)
-        self.load_config()
         try:
             if instance:
-                self.delete_pod(instance)
+                yield self.delete_pod(instance)
         finally:
-            self.service_teardown()
+            # the build may stop before its pod is running
+            self._release_prepull_pod()
+            self.release_resources()
+            # the worker is free for the next build during the teardown
+            self._deferwaiter.add(self.service_teardown())
@@ -0,0 +1,261 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Follow the lifecycle of the pods of eve with a single watch."""
+
+import threading
+from collections import OrderedDict, defaultdict
+
+from twisted.internet import defer
+from twisted.logger import Logger
+
+try:
+    from kubernetes import client, watch
+    from kubernetes.client.rest import ApiException
+except ImportError:
+    client = None
+
+HTTP_GONE = 410
+
+
+class PodInformer(object):
+    """Keep an up to date view of the pods matching a label selector.
+
+    A single thread lists the pods, then watches them from the resource
+    version of the list, and hands every event over to the reactor thread.
+    The watch is restarted from its last resource version when the API
+    server closes it, and from a new list when this version has expired or
+    the watch failed.
+
+    Callers wait for a pod to reach a given state with `wait`, instead of
+    polling its status.
+
+    Args:
+        namespace (str): namespace of the pods.
+        label_selector (str): selector of the pods.
+        reactor: the reactor to notify.
+        api_factory (callable): returns the `CoreV1Api` to use.
+        timeout (int): duration of each watch request, in seconds.
+        retry_delay (int): delay before watching again after an error.
+        deleted_history (int): number of deleted pod names remembered.
+
+    """
+
+    logger = Logger('eve.workers.PodInformer')
+
+    def __init__(self, namespace, label_selector='app=eve', reactor=None,
+                 api_factory=None, timeout=300, retry_delay=5,
+                 deleted_history=1000):
+        # pylint: disable=too-many-arguments
+        if reactor is None:
+            from twisted.internet import reactor
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.reactor = reactor
+        self.api_factory = api_factory
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.deleted_history = deleted_history
+        self.pods = {}
+        self.deleted = OrderedDict()
+        self.resource_version = None
+        self.events = 0
+        self.lists = 0
+        self._waiters = defaultdict(list)
+        self._stopping = threading.Event()
+        self._watch = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='pod-informer-%s' % self.namespace)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._watch is not None:
+            self._watch.stop()
+        for waiters in list(self._waiters.values()):
+            for _, deferred in list(waiters):
+                deferred.cancel()
+
+    def wait(self, name, predicate, timeout=None):
+        """Wait for a pod to satisfy a predicate.
+
+        Args:
+            name (str): name of the pod.
+            predicate (callable): called with the last known state of the pod
+                (a `V1Pod`), or `None` once the pod is deleted.
+            timeout (int): seconds after which the deferred fails with
+                `defer.TimeoutError`.
+
+        Returns:
+            A deferred firing with the first state of the pod satisfying the
+            predicate.
+
+        """
+        current = self._current(name)
+        if current is not False and predicate(current):
+            return defer.succeed(current)
+
+        waiter = []
+
+        def cancel(_):
+            self._remove_waiter(name, waiter)
+
+        deferred = defer.Deferred(cancel)
+        waiter.extend((predicate, deferred))
+        self._waiters[name].append(waiter)
+        if timeout is not None:
+            deferred.addTimeout(timeout, self.reactor)
+        return deferred
+
+    def _current(self, name):
+        if name in self.deleted:
+            return None
+        return self.pods.get(name, False)
+
+    def _remove_waiter(self, name, waiter):
+        waiters = self._waiters.get(name)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[name]
+
+    def _api(self):
+        if self.api_factory is not None:
+            return self.api_factory()
+        return client.CoreV1Api()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                # the credentials of the api may have been refreshed
+                api = self._api()
+                if self.resource_version is None:
+                    self._list(api)
+                self._watch_pods(api)
+            except ApiException as ex:
+                if ex.status == HTTP_GONE:
+                    self.logger.info('pod watch expired, listing pods again')
+                    self.resource_version = None
+                    continue
+                self.logger.error('pod watch failed: {reason}',
+                                  reason=ex.reason)
+            except Exception as ex:
+                # kubernetes<9 fails to deserialize the ERROR events of the
+                # watch, such as the one of an expired resource version, as
+                # pods: the version may have expired
+                self.logger.error('pod watch failed: {ex!r}', ex=ex)
+            else:
+                continue
+            # list again, rather than watching from the same version forever
+            self.resource_version = None
+            self._stopping.wait(self.retry_delay)
+
+    def _list(self, api):
+        pods = api.list_namespaced_pod(
+            self.namespace, label_selector=self.label_selector)
+        self.lists += 1
+        self.resource_version = pods.metadata.resource_version
+        self.reactor.callFromThread(self._sync, pods.items)
+
+    def _watch_pods(self, api):
+        self._watch = watch.Watch()
+        stream = self._watch.stream(
+            api.list_namespaced_pod, self.namespace,
+            label_selector=self.label_selector,
+            resource_version=self.resource_version,
+            timeout_seconds=self.timeout)
+        for event in stream:
+            if event['type'] == 'ERROR':
+                status = event['raw_object']
+                raise ApiException(status=status.get('code'),
+                                   reason=status.get('message'))
+            pod = event['object']
+            self.resource_version = pod.metadata.resource_version
+            self.reactor.callFromThread(self._update, event['type'], pod)
+            if self._stopping.is_set():
+                break
+
+    def _sync(self, pods):
+        """Replace the known pods with the result of a list."""
+        names = set()
+        for pod in pods:
+            names.add(pod.metadata.name)
+            self._update('ADDED', pod)
+        for name in list(self.pods):
+            if name not in names:
+                self._update('DELETED', self.pods[name])
+
+    def _update(self, event_type, pod):
+        self.events += 1
+        name = pod.metadata.name
+        if event_type == 'DELETED':
+            self.pods.pop(name, None)
+            self.deleted[name] = True
+            while len(self.deleted) > self.deleted_history:
+                self.deleted.popitem(last=False)
+            state = None
+        else:
+            self.deleted.pop(name, None)
+            self.pods[name] = pod
+            state = pod
+
+        for waiter in list(self._waiters.get(name, ())):
+            predicate, deferred = waiter
+            try:
+                satisfied = predicate(state)
+            except Exception:
+                self._remove_waiter(name, waiter)
+                deferred.errback()
+                continue
+            if satisfied:
+                self._remove_waiter(name, waiter)
+                deferred.callback(state)
+
+
+_INFORMERS = {}
+
+
+def get_pod_informer(namespace, reactor=None, kube_client=None):
+    """Return the started informer of the eve pods of a namespace.
+
+    Args:
+        namespace (str): namespace of the pods.
+        reactor: the reactor to notify.
+        kube_client (KubeClient): the client whose connections and
+            credentials the informer uses.
+
+    """
+    informer = _INFORMERS.get(namespace)
+    if informer is None:
+        informer = _INFORMERS[namespace] = PodInformer(
+            namespace, reactor=reactor,
+            api_factory=kube_client.core_api if kube_client else None)
+        informer.reactor.addSystemEventTrigger('before', 'shutdown',
+                                               informer.stop)
+    informer.start()
+    return informer
@@ -0,0 +1,186 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Delete the pods left behind by the kube workers of the master."""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from buildbot import config
+from buildbot.util import service
+from twisted.internet import defer, task, threads
+from twisted.logger import Logger
+
+from .api_client import get_kube_client
+
+
+def stale_pods(pods, live_builds, now, min_age):
+    """Return the builds of the pods which do not run any build anymore.
+
+    Args:
+        pods (list): states of the pods (`V1Pod`).
+        live_builds (set): ``(worker name, build number)`` of the builds
+            which are not complete.
+        now (datetime): the current time.
+        min_age (int): seconds during which a new pod is never stale.
+
+    Returns:
+        The sorted build numbers of the stale pods, indexed by worker name.
+
+    """
+    stale = defaultdict(set)
+    for pod in pods:
+        labels = pod.metadata.labels or {}
+        workername = labels.get('workername')
+        buildid = labels.get('buildid')
+        if not workername or not buildid:
+            continue
+        if (workername, buildid) in live_builds:
+            continue
+        created = pod.metadata.creation_timestamp
+        if created is not None and (now - created).total_seconds() < min_age:
+            continue
+        stale[workername].add(buildid)
+    return {workername: sorted(buildids)
+            for workername, buildids in stale.items()}
+
+
+class KubePodReaper(service.BuildbotService):
+    """Periodically delete the pods of the workers that no build uses.
+
+    The pods of a master's workers are found with the labels the workers
+    set on them (`app`, `workername` and `buildid`). A pod is stale once
+    the build its labels refer to is not running anymore, which happens
+    when a master dies without deleting its pods. Stale pods are deleted
+    with one `delete_collection` call per worker, when the master starts
+    then every ``interval`` seconds.
+
+    Args:
+        namespace (str): namespace of the worker pods.
+        workernames (list): names of the kube workers of the master.
+        interval (int): seconds between two collections.
+        min_age (int): seconds during which a new pod is left alone; it
+            covers the service teardown pods, created after their build.
+        kube_client (KubeClient): the client to call the API with.
+
+    """
+
+    name = 'KubePodReaper'
+    logger = Logger('eve.workers.KubePodReaper')
+    reaped_builds = 0
+    _loop = None
+    _reaping = None
+
+    def checkConfig(self, namespace, workernames, interval=600, min_age=600,
+                    kube_client=None):
+        # pylint: disable=arguments-differ,too-many-arguments
+        if interval <= 0:
+            config.error('the interval of KubePodReaper must be positive')
+
+    def reconfigService(self, namespace, workernames, interval=600,
+                        min_age=600, kube_client=None):
+        # pylint: disable=arguments-differ,too-many-arguments
+        self.namespace = namespace
+        self.workernames = list(workernames)
+        self.interval = interval
+        self.min_age = min_age
+        self.kube_client = kube_client or get_kube_client()
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+            self._start_loop()
+
+    @defer.inlineCallbacks
+    def startService(self):
+        yield super(KubePodReaper, self).startService()
+        self._start_loop()
+
+    def stopService(self):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        return super(KubePodReaper, self).stopService()
+
+    def _start_loop(self):
+        self._loop = task.LoopingCall(self.reap)
+        self._loop.clock = self.master.reactor
+        self._loop.start(self.interval, now=True)
+
+    @property
+    def label_selector(self):
+        return 'app=eve,workername in (%s)' % ','.join(
+            sorted(self.workernames))
+
+    @defer.inlineCallbacks
+    def live_builds(self):
+        """Return ``(worker name, build number)`` of the running builds."""
+        builds = yield self.master.db.builds.getBuilds(complete=False)
+        workers = yield self.master.db.workers.getWorkers()
+        names = {worker['id']: worker['name'] for worker in workers}
+        defer.returnValue(set((names.get(build['workerid']),
+                               str(build['number'])) for build in builds))
+
+    def _thd_list_pods(self):
+        return self.kube_client.call(
+            'list_namespaced_pod', self.namespace,
+            label_selector=self.label_selector).items
+
+    def _thd_delete_pods(self, workername, buildids):
+        self.kube_client.call(
+            'delete_collection_namespaced_pod', self.namespace,
+            label_selector='app=eve,workername=%s,buildid in (%s)' % (
+                workername, ','.join(buildids)))
+
+    def reap(self):
+        """Delete the stale pods of the workers.
+
+        A collection asked for while another one runs waits for it
+        instead of starting again.
+
+        """
+        reaping = self._reaping
+        if reaping is None:
+            reaping = self._reaping = defer.Deferred()
+            defer.maybeDeferred(self._reap).addBoth(self._reaped, reaping)
+        d = defer.Deferred()
+        reaping.addBoth(lambda result: d.callback(None) or result)
+        return d
+
+    def _reaped(self, result, reaping):
+        self._reaping = None
+        reaping.callback(None)
+
+    @defer.inlineCallbacks
+    def _reap(self):
+        if not self.workernames:
+            return
+        try:
+            # list the builds first: a build starting meanwhile is not
+            # mistaken for a stale one, thanks to min_age
+            live_builds = yield self.live_builds()
+            pods = yield threads.deferToThread(self._thd_list_pods)
+            stale = stale_pods(pods, live_builds,
+                               datetime.now(timezone.utc), self.min_age)
+            for workername, buildids in sorted(stale.items()):
+                self.logger.info(
+                    'deleting the stale pods of {workername} for builds '
+                    '{buildids}', workername=workername,
+                    buildids=', '.join(buildids))
+                yield threads.deferToThread(self._thd_delete_pods,
+                                            workername, buildids)
+                self.reaped_builds += len(buildids)
+        except Exception as ex:
+            # try again at the next interval
+            self.logger.error('unable to reap stale kube pods: {ex!r}', ex=ex)
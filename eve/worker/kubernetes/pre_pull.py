@@ -0,0 +1,176 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Pull the images of a kube worker pod before its build starts."""
+
+from hashlib import sha1
+
+from buildbot.process.buildstep import BuildStep
+from buildbot.process.results import SUCCESS, WARNINGS
+from twisted.internet import defer, threads
+from twisted.logger import Logger
+
+from ...util.step import hideStepIfSuccess
+from .api_client import get_kube_client
+
+try:
+    from kubernetes import client
+    from kubernetes.client.rest import ApiException
+except ImportError:
+    client = None
+
+PREPULL_RESOURCES = {'cpu': '10m', 'memory': '16Mi'}
+
+
+def prepull_pod(name, images, node_affinity=None, deadline=600):
+    """Return a pod pulling images on a node eligible for the workers.
+
+    Its containers exit right away; the images stay in the cache of the
+    node.
+
+    Args:
+        name (str): name of the pod.
+        images (list): references of the images to pull.
+        node_affinity (str): ``key:value`` label of the worker nodes.
+        deadline (int): seconds after which the pod is stopped.
+
+    """
+    pod = {
+        'apiVersion': 'v1',
+        'kind': 'Pod',
+        'metadata': {
+            'name': name,
+            'labels': {'app': 'eve', 'service': 'prepull'},
+        },
+        'spec': {
+            'restartPolicy': 'Never',
+            'activeDeadlineSeconds': deadline,
+            'terminationGracePeriodSeconds': 0,
+            'containers': [{
+                'name': 'prepull-%d' % index,
+                'image': image,
+                'imagePullPolicy': 'IfNotPresent',
+                'command': ['true'],
+                'resources': {
+                    'requests': dict(PREPULL_RESOURCES),
+                    'limits': dict(PREPULL_RESOURCES),
+                },
+            } for index, image in enumerate(images)],
+        },
+    }
+    if node_affinity:
+        key, value = node_affinity.split(':')
+        pod['spec']['affinity'] = {
+            'nodeAffinity': {
+                'requiredDuringSchedulingIgnoredDuringExecution': {
+                    'nodeSelectorTerms': [{
+                        'matchExpressions': [{
+                            'key': key,
+                            'operator': 'In',
+                            'values': [value]}]}]}}}
+    return pod
+
+
+class KubePrePullImages(BuildStep):
+    """Start pulling the images of a kube pod stage on the cluster.
+
+    The step creates a placeholder pod pulling the images of the stage as
+    soon as they are in the registry, so a node pulls them while the stage
+    is triggered and its worker pod prepared. The name of the placeholder
+    is stored in the ``prepull_pod_<stage>`` property; the kube worker
+    prefers the node of the placeholder and deletes it once its own pod is
+    started, or its instance stopped. Placeholders of stages that never
+    start are deleted after ``deadline`` seconds.
+
+    Failing to create the placeholder does not fail the build.
+
+    Args:
+        stage_name (str): name of the triggered stage.
+        images (dict): images of the worker pod, indexed by name.
+        namespace (str): namespace of the worker pods.
+        node_affinity (str): ``key:value`` label of the worker nodes.
+        deadline (int): lifetime of the placeholder, in seconds.
+        kube_client (KubeClient): the client to create the pod with.
+
+    """
+
+    logger = Logger('eve.workers.KubePrePullImages')
+    renderables = ['images']
+
+    def __init__(self, stage_name, images, namespace, node_affinity=None,
+                 deadline=600, kube_client=None, **kwargs):
+        # pylint: disable=too-many-arguments
+        kwargs.setdefault('name',
+                          '[{0}] pre-pull images'.format(stage_name)[0:49])
+        kwargs.setdefault('hideStepIf', hideStepIfSuccess)
+        super(KubePrePullImages, self).__init__(**kwargs)
+        self.stage_name = stage_name
+        self.images = images
+        self.namespace = namespace
+        self.node_affinity = node_affinity
+        self.deadline = deadline
+        self.kube_client = kube_client
+
+    @staticmethod
+    def property_name(stage_name):
+        """Return the property set to the name of the placeholder."""
+        return 'prepull_pod_%s' % stage_name
+
+    def pod_name(self):
+        return 'prepull-%d-%s' % (
+            self.build.buildid,
+            sha1(self.stage_name.encode('utf-8')).hexdigest()[:8])
+
+    @defer.inlineCallbacks
+    def run(self):
+        if self.kube_client is None:
+            self.kube_client = get_kube_client()
+        name = self.pod_name()
+        images = sorted(set(image for image in self.images.values() if image))
+        pod = prepull_pod(name, images, self.node_affinity, self.deadline)
+        try:
+            yield threads.deferToThread(self.kube_client.call,
+                                        'create_namespaced_pod',
+                                        self.namespace, pod)
+        except ApiException as ex:
+            yield self.addCompleteLog(
+                'prepull',
+                'unable to create pod %s: %s\n' % (name, ex.reason))
+            defer.returnValue(WARNINGS)
+
+        self.setProperty(self.property_name(self.stage_name), name,
+                         'KubePrePullImages')
+        self.master.reactor.callLater(self.deadline, self.delete_pod, name)
+        defer.returnValue(SUCCESS)
+
+    def _thd_delete_pod(self, name):
+        try:
+            self.kube_client.call('delete_namespaced_pod', name,
+                                  self.namespace,
+                                  body=client.V1DeleteOptions())
+        except ApiException as ex:
+            if ex.status != 404:
+                raise
+
+    def delete_pod(self, name):
+        """Delete a placeholder, if it still exists."""
+        deferred = threads.deferToThread(self._thd_delete_pod, name)
+        deferred.addErrback(
+            lambda failure: self.logger.error(
+                'unable to delete kube pod {name}: {failure}',
+                name=name, failure=failure))
+        return deferred
@@ -17,7 +17,7 @@
 # Boston, MA  02110-1301, USA.
 """Allow eve to use openstack heat stacks as workers."""
 
-import time
+from time import monotonic
 
 import heatclient
 import heatclient.client
@@ -30,8 +30,54 @@ from keystoneauth1.identity import v3
 from twisted.internet import defer, threads
 from twisted.logger import Logger
 
+from ...util.histogram import LatencyHistogram
+from .stack_pool import stack_spec
+from .stack_tracker import StackTracker
+
 MISSING_TIMEOUT = 15 * 60
-POLLING_FREQ = 10
+
+# renders of the stack parameters slower than this are logged, in seconds
+SLOW_RENDER = 1
+
+# render times of the stack parameters, by parameter
+RENDER_LATENCIES = {}
+
+
+def heat_client(os_auth_url, os_username, os_password, os_project_domain_id,
+                os_project_name, os_region_name, os_identity_api_version):
+    """Return a heat client authenticated with the given credentials."""
+    # pylint: disable=too-many-arguments
+    if os_identity_api_version == '3':
+        password = v3.PasswordMethod(
+            username=os_username,
+            password=os_password,
+            user_domain_id=os_project_domain_id)
+        auth = v3.Auth(auth_url=os_auth_url, auth_methods=[password])
+    else:
+        loader = loading.get_plugin_loader('password')
+        auth = loader.load_from_options(
+            auth_url=os_auth_url,
+            username=os_username,
+            password=os_password,
+            project_name=os_project_name)
+
+    sess = session.Session(auth=auth)
+    return heatclient.client.Client(
+        '1', session=sess, region_name=os_region_name)
+
+
+def render_summary():
+    """Describe the render times of the stack parameters."""
+    return ', '.join('%s: %s' % (key, histogram.summary())
+                     for key, histogram in sorted(RENDER_LATENCIES.items()))
+
+
+def creation_finished(stack):
+    return stack is None or stack.stack_status != 'CREATE_IN_PROGRESS'
+
+
+def deletion_finished(stack):
+    return stack is None or stack.stack_status != 'DELETE_IN_PROGRESS'
 
 
 class HeatLatentWorker(AbstractLatentWorker):
@@ -45,31 +91,30 @@ class HeatLatentWorker(AbstractLatentWorker):
     def __init__(self, name, password, heat_template, heat_params,
                  os_auth_url, os_username, os_password, os_project_domain_id,
                  os_project_name, os_region_name, os_identity_api_version,
+                 stack_tracker=None, stack_pool=None,
                  **kwargs):  # flake8: noqa
 
+        if stack_pool is not None:
+            kwargs.setdefault('build_wait_timeout', stack_pool.ttl)
+        kwargs.setdefault('build_wait_timeout', 0)
         super(HeatLatentWorker, self).__init__(name, password, **kwargs)
 
         self.heat_template = heat_template
         self.heat_params = heat_params or {}
         self.stack_id = None
+        self.stack_spec = None
+        self.stack_pool = stack_pool
+        self.builds_may_be_incompatible = stack_pool is not None
+        self._reusable = False
+        self._deleting = None
 
-        if os_identity_api_version == '3':
-            password = v3.PasswordMethod(
-                username=os_username,
-                password=os_password,
-                user_domain_id=os_project_domain_id)
-            auth = v3.Auth(auth_url=os_auth_url, auth_methods=[password])
-        else:
-            loader = loading.get_plugin_loader('password')
-            auth = loader.load_from_options(
-                auth_url=os_auth_url,
-                username=os_username,
-                password=os_password,
-                project_name=os_project_name)
-
-        sess = session.Session(auth=auth)
-        self.heat_client = heatclient.client.Client(
-            '1', session=sess, region_name=os_region_name)
+        # the workers of a master share a tracker, and its client
+        if stack_tracker is None:
+            stack_tracker = StackTracker(heat_client(
+                os_auth_url, os_username, os_password, os_project_domain_id,
+                os_project_name, os_region_name, os_identity_api_version))
+        self.stack_tracker = stack_tracker
+        self.heat_client = stack_tracker.heat_client
 
     def reconfigService(self, name, password, **kwargs):
         kwargs.setdefault('missing_timeout', MISSING_TIMEOUT)
@@ -78,26 +123,147 @@ class HeatLatentWorker(AbstractLatentWorker):
         super(HeatLatentWorker, self).reconfigService(name, password, **kwargs)
 
     @defer.inlineCallbacks
-    def start_instance(self, build):
+    def render_stack(self, props, record=True):
+        """Return the template and parameters of the stack of a build.
+
+        Args:
+            props: the build, or the properties of a build request.
+            record (bool): record the render times in `RENDER_LATENCIES`
+                and log the slow renders.
+
+        """
+        keys = sorted(self.heat_params)
+        durations = {}
+
+        def timed(key, value):
+            start = monotonic()
+
+            def done(result):
+                durations[key] = monotonic() - start
+                return result
+            return props.render(value).addBoth(done)
+
+        # the parameters render concurrently, the slow ones read files
+        start = monotonic()
+        rendered = yield defer.gatherResults(
+            [props.render(self.heat_template)]
+            + [timed(key, self.heat_params[key]) for key in keys],
+            consumeErrors=True).addErrback(lambda f: f.value.subFailure)
+        total = monotonic() - start
+        result = rendered[0], dict(zip(keys, rendered[1:]))
+        if not record:
+            defer.returnValue(result)
+
+        for key, duration in durations.items():
+            histogram = RENDER_LATENCIES.get(key)
+            if histogram is None:
+                histogram = RENDER_LATENCIES.setdefault(
+                    key, LatencyHistogram())
+            histogram.observe(duration)
+        if total >= SLOW_RENDER:
+            self.logger.info(
+                'rendered the stack parameters of {worker} in {total:.3f}s '
+                '({durations})', worker=self.name, total=total,
+                durations=', '.join(
+                    '%s: %.3fs' % (key, duration) for key, duration in sorted(
+                        durations.items(), key=lambda item: -item[1])))
+        defer.returnValue(result)
+
+    @defer.inlineCallbacks
+    def isCompatibleWithBuild(self, build_props):
+        if self.stack_spec is None:
+            defer.returnValue(True)
+        # checked for every pending request: only the start is measured
+        heat_template, heat_params = yield self.render_stack(
+            build_props, record=False)
+        defer.returnValue(
+            stack_spec(heat_template, heat_params) == self.stack_spec)
+
+    def prepare_build(self, build):
         repository = build.getProperty('repository')
         uuid = util.create_hash(repository, self.name)
         build.setProperty("worker_uuid", uuid, "Build")
         build.addStepsAfterLastStep([steps.UnregisterRedhat(
-            doStepIf=util.isRedhat,
+            doStepIf=self.unregister_redhat,
             hideStepIf=util.hideStepIfSkipped
         )])
-        heat_template = yield build.render(self.heat_template)
-        tmp_heat_template_parameters = {}
-        for key, value in self.heat_params.items():
-            tmp_heat_template_parameters[key] = yield build.render(value)
-
-        res = yield threads.deferToThread(self._start_instance,
-                                          self.name,
-                                          heat_template,
-                                          tmp_heat_template_parameters)
-        defer.returnValue(res)
-
-    def _start_instance(self, stack_name, heat_template, heat_params):
+        self._reusable = True
+
+    @defer.inlineCallbacks
+    def unregister_redhat(self, step):
+        redhat = yield util.isRedhat(step)
+        if redhat:
+            # the system is not subscribed anymore: do not reuse the stack
+            self._reusable = False
+        defer.returnValue(redhat)
+
+    def substantiate(self, wfb, build):
+        if self.substantiated and self.stack_pool is not None:
+            # the stack of the previous build is reused
+            self.logger.info('Reusing stack %s for %s' % (
+                self.stack_id, wfb))
+            self.prepare_build(build)
+            self.stack_pool.record_start(self, self.stack_spec[:2],
+                                         self.master.reactor.seconds(),
+                                         warm=True)
+        return super(HeatLatentWorker, self).substantiate(wfb, build)
+
+    def buildFinished(self, wfb):
+        super(HeatLatentWorker, self).buildFinished(wfb)
+        if (self.stack_pool is None or self.building
+                or self.stack_spec is None):
+            return
+        if not (self._reusable and self.stack_pool.keep(
+                self, self.stack_spec[:2], self.master.reactor.seconds())):
+            self._clearBuildWaitTimer()
+            self.master.reactor.callLater(0, self._soft_disconnect)
+
+    def make_room(self, workers):
+        """Delete the idle stack unused for the longest time among workers.
+
+        Returns:
+            bool: whether the stack pool decides which stack is deleted.
+
+        """
+        if self.stack_pool is None:
+            return False
+        worker = self.stack_pool.evict(workers)
+        if worker is not None:
+            self.logger.info('Retiring idle worker %s' % worker.name)
+            worker._clearBuildWaitTimer()
+            worker.master.reactor.callLater(0, worker._soft_disconnect)
+        return True
+
+    @defer.inlineCallbacks
+    def start_instance(self, build):
+        self.prepare_build(build)
+        heat_template, tmp_heat_template_parameters = \
+            yield self.render_stack(build)
+
+        if self._deleting is not None:
+            # the name of the stack is only free once it is deleted
+            yield self._deleting
+
+        stack_id = yield threads.deferToThread(self._thd_create_stack,
+                                               self.name,
+                                               heat_template,
+                                               tmp_heat_template_parameters)
+        self.stack_id = stack_id
+        stack = yield self.stack_tracker.wait(stack_id, creation_finished)
+        if stack is None:
+            raise Exception('stack %s vanished during its creation'
+                            % stack_id)
+        if stack.stack_status != 'CREATE_COMPLETE':
+            raise Exception(stack.stack_status)
+        self.stack_spec = stack_spec(heat_template,
+                                     tmp_heat_template_parameters)
+        if self.stack_pool is not None:
+            self.stack_pool.record_start(self, self.stack_spec[:2],
+                                         self.master.reactor.seconds(),
+                                         warm=False)
+        defer.returnValue(stack)
+
+    def _thd_create_stack(self, stack_name, heat_template, heat_params):
         try:
             result = self.heat_client.stacks.create(
                 stack_name=stack_name,
@@ -107,19 +273,15 @@ class HeatLatentWorker(AbstractLatentWorker):
         except HTTPBadRequest as ex:
             raise LatentWorkerCannotSubstantiate(
                 ex.error['error'].get('message'))
+        return result['stack']['id']
 
-        self.stack_id = result['stack']['id']
-        stack = self.heat_client.stacks.get(stack_id=self.stack_id)
-
-        while stack.stack_status == 'CREATE_IN_PROGRESS':
-            time.sleep(POLLING_FREQ)
-            stack = self.heat_client.stacks.get(stack_id=self.stack_id)
+    def stop_instance(self, fast=False):
+        """Delete the stack of the worker.
 
-        if stack.stack_status != 'CREATE_COMPLETE':
-            raise Exception(stack.stack_status)
-        return stack
+        The deletion goes on in the background: the worker waits for it
+        only before creating its next stack, which uses the same name.
 
-    def stop_instance(self, fast=False):
+        """
         if self.stack_id is None:
             # Comment copy/pasted from the ec2 worker code :
             # be gentle.  Something may just be trying to alert us that an
@@ -127,27 +289,34 @@ class HeatLatentWorker(AbstractLatentWorker):
             # started.
             return defer.succeed(None)
 
-        # this allows to call the stack deletion in a thread so we can wait
-        # until we are sure they are deleted.
-        return threads.deferToThread(self._stop_instance, self.stack_id, fast)
-
-    def _stop_instance(self, stack_id, fast):
-        stack = self.heat_client.stacks.get(stack_id=stack_id)
+        stack_id, self.stack_id = self.stack_id, None
+        self.stack_spec = None
+        if self.stack_pool is not None:
+            self.stack_pool.release(self)
+        self._deleting = self._delete_stack(stack_id)
+        self._deferwaiter.add(self._deleting)
+        return defer.succeed(None)
 
-        while 'DELETE' not in stack.stack_status:
-            # sometimes, the 'DELETE_IN_PROGRESS' status is not set
-            # instantaneously after stack.delete() is called. This loop makes
-            # sure deletion is in progress or finished before going further.
-            stack.delete()
-            time.sleep(POLLING_FREQ)
-            stack = self.heat_client.stacks.get(stack_id=stack_id)
+    def _thd_delete_stack(self, stack_id):
+        self.heat_client.stacks.delete(stack_id)
 
-        if fast:
-            return
-
-        while stack.stack_status == 'DELETE_IN_PROGRESS':
-            time.sleep(POLLING_FREQ)
-            stack = self.heat_client.stacks.get(stack_id=stack_id)
-
-        if stack.stack_status != 'DELETE_COMPLETE':
-            raise Exception(stack.stack_status)
+    @defer.inlineCallbacks
+    def _delete_stack(self, stack_id):
+        try:
+            while True:
+                yield threads.deferToThread(self._thd_delete_stack, stack_id)
+                stack = yield self.stack_tracker.wait(stack_id,
+                                                      deletion_finished)
+                # sometimes, the 'DELETE_IN_PROGRESS' status is not set
+                # instantaneously after the deletion is requested: ask
+                # again until the deletion is in progress or finished.
+                if stack is None or 'DELETE' in stack.stack_status:
+                    break
+            if stack is not None and stack.stack_status != 'DELETE_COMPLETE':
+                self.logger.error('unable to delete stack {stack}: {status}',
+                                  stack=stack_id, status=stack.stack_status)
+        except Exception as ex:
+            self.logger.error('unable to delete stack {stack}: {ex!r}',
+                              stack=stack_id, ex=ex)
+        finally:
+            self._deleting = None
@@ -0,0 +1,75 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Keep the heat stacks of frequently used images between builds."""
+
+import json
+
+from twisted.logger import Logger
+
+from ...util.cache import content_hash
+from ...util.warm_pool import WarmPool
+
+# parameters of the stacks which identify their worker, not their content
+WORKER_PARAMS = ('worker_name', 'worker_password')
+
+
+def stack_spec(heat_template, heat_params):
+    """Return what a build requires from the stack of a worker.
+
+    Args:
+        heat_template (str): the rendered template of the stack.
+        heat_params (dict): the rendered parameters of the stack.
+
+    Returns:
+        The image and flavor of the stack, and a digest of the template
+        and of the other parameters.
+
+    """
+    shared = {key: value for key, value in heat_params.items()
+              if key not in WORKER_PARAMS}
+    digest = content_hash(json.dumps([heat_template, shared],
+                                     sort_keys=True, default=str))
+    return heat_params.get('image'), heat_params.get('flavor'), digest
+
+
+class HeatStackPool(WarmPool):
+    """Decide which heat workers keep their stack once their build is done.
+
+    A worker whose stack is kept stays connected to the master: the next
+    build rendering the same template and parameters starts on it without
+    waiting for a new stack to boot and install its requirements (see
+    `HeatLatentWorker.isCompatibleWithBuild`).
+
+    The number of stacks kept idle for an ``(image, flavor)`` pair is the
+    number of builds started with it during the last ``window`` seconds,
+    capped to ``max_idle_per_flavor``. Idle stacks are deleted after
+    ``ttl`` seconds, or as soon as a build finds no worker able to run it.
+
+    Args:
+        max_idle_per_flavor (int): maximum number of idle stacks per image
+            and flavor.
+        ttl (int): seconds an idle stack is kept.
+        window (int): seconds of demand taken into account.
+
+    """
+
+    logger = Logger('eve.workers.HeatStackPool')
+
+    def __init__(self, max_idle_per_flavor=1, ttl=900, window=3600):
+        super(HeatStackPool, self).__init__(
+            max_idle_per_key=max_idle_per_flavor, ttl=ttl, window=window)
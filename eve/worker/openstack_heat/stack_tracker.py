@@ -0,0 +1,170 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Follow the status of the heat stacks of eve with batched polls."""
+
+from collections import defaultdict
+
+from twisted.internet import defer, threads
+from twisted.logger import Logger
+
+
+class StackTracker(object):
+    """Keep track of the status of the stacks waited for by the workers.
+
+    The stacks being waited for are polled together, with a single list
+    call filtered on their ids. The poll interval starts at
+    ``min_interval`` when a stack is added or changes status, and grows by
+    ``backoff`` up to ``max_interval`` while nothing changes, so that long
+    creations do not flood the API and short ones are seen quickly.
+
+    Callers wait for a stack to reach a given state with `wait`, instead of
+    polling its status.
+
+    Args:
+        heat_client: the heat client used to list the stacks.
+        reactor: the reactor to schedule the polls with.
+        min_interval (float): seconds between polls after a change.
+        max_interval (float): maximum seconds between two polls.
+        backoff (float): growth factor of the interval between polls.
+
+    """
+
+    logger = Logger('eve.workers.StackTracker')
+
+    def __init__(self, heat_client, reactor=None, min_interval=2,
+                 max_interval=30, backoff=1.5):
+        # pylint: disable=too-many-arguments
+        if reactor is None:
+            from twisted.internet import reactor
+        self.heat_client = heat_client
+        self.reactor = reactor
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.statuses = {}
+        self.polls = 0
+        self._waiters = defaultdict(list)
+        self._call = None
+        self._polling = False
+
+    def wait(self, stack_id, predicate):
+        """Wait for a stack to satisfy a predicate.
+
+        Args:
+            stack_id (str): id of the stack.
+            predicate (callable): called with the last known state of the
+                stack (a heat `Stack`), or `None` once it is not listed
+                anymore.
+
+        Returns:
+            A deferred firing with the first state of the stack satisfying
+            the predicate.
+
+        """
+        waiter = []
+
+        def cancel(_):
+            self._remove_waiter(stack_id, waiter)
+
+        deferred = defer.Deferred(cancel)
+        waiter.extend((predicate, deferred))
+        self._waiters[stack_id].append(waiter)
+        self.interval = self.min_interval
+        self._schedule(self.min_interval)
+        return deferred
+
+    def stop(self):
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        for waiters in list(self._waiters.values()):
+            for _, deferred in list(waiters):
+                deferred.cancel()
+
+    def _remove_waiter(self, stack_id, waiter):
+        waiters = self._waiters.get(stack_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._waiters[stack_id]
+                self.statuses.pop(stack_id, None)
+
+    def _schedule(self, delay):
+        """Poll in ``delay`` seconds, unless a poll is due before."""
+        if self._polling:
+            return
+        if self._call is not None and self._call.active():
+            if self._call.getTime() <= self.reactor.seconds() + delay:
+                return
+            self._call.cancel()
+        self._call = self.reactor.callLater(delay, self._poll)
+
+    def _thd_list(self, stack_ids):
+        return list(self.heat_client.stacks.list(
+            filters={'id': stack_ids}, show_deleted=True))
+
+    @defer.inlineCallbacks
+    def _poll(self):
+        self._call = None
+        stack_ids = sorted(self._waiters)
+        if not stack_ids:
+            return
+        self._polling = True
+        try:
+            stacks = yield threads.deferToThread(self._thd_list, stack_ids)
+        except Exception as ex:
+            self.logger.error('unable to list the heat stacks: {ex!r}',
+                              ex=ex)
+            self.interval = min(self.interval * self.backoff,
+                                self.max_interval)
+        else:
+            self.polls += 1
+            found = {stack.id: stack for stack in stacks}
+            changed = False
+            for stack_id in stack_ids:
+                stack = found.get(stack_id)
+                status = stack.stack_status if stack is not None else None
+                if self.statuses.get(stack_id, False) != status:
+                    changed = True
+                    self.statuses[stack_id] = status
+                self._update(stack_id, stack)
+            if changed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff,
+                                    self.max_interval)
+        finally:
+            self._polling = False
+        if set(self._waiters) - set(stack_ids):
+            # stacks added during the poll
+            self.interval = self.min_interval
+        if self._waiters:
+            self._schedule(self.interval)
+
+    def _update(self, stack_id, stack):
+        for waiter in list(self._waiters.get(stack_id, ())):
+            predicate, deferred = waiter
+            try:
+                satisfied = predicate(stack)
+            except Exception:
+                self._remove_waiter(stack_id, waiter)
+                deferred.errback()
+                continue
+            if satisfied:
+                self._remove_waiter(stack_id, waiter)
+                deferred.callback(stack)
@@ -0,0 +1,7 @@
+"""Micro-benchmarks package.
+
+Benchmarks are not collected by the test runners, run them explicitly, e.g.::
+
+    python -m tests.benchmark.bench_branch_matcher
+
+"""
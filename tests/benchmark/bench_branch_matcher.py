@@ -0,0 +1,74 @@
+"""Micro-benchmark of `eve.util.branch_matcher` with 10k patterns.
+
+Compares the compiled matcher with the linear fnmatch lookup it replaced.
+
+"""
+
+import argparse
+import timeit
+from fnmatch import fnmatch
+
+from eve.util.branch_matcher import BranchMatcher
+
+
+def make_branches(count):
+    """Return `count` patterns, a third of them being literals."""
+    branches = {}
+    for i in range(count):
+        if i % 3 == 0:
+            pattern = 'development/%d.%d' % (i, i % 10)
+        elif i % 3 == 1:
+            pattern = 'feature/TEAM%d-*' % i
+        else:
+            pattern = 'q/*/%d.?/*' % i
+        branches[pattern] = {'stage': 'stage%d' % i}
+    branches['default'] = {'stage': 'post-merge'}
+    return branches
+
+
+def linear_match(branches, branch):
+    for pattern, conf in branches.items():
+        if fnmatch(branch, pattern):
+            return pattern, conf
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--patterns', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=100)
+    args = parser.parse_args()
+
+    branches = make_branches(args.patterns)
+    candidates = [
+        'development/%d.%d' % (args.patterns - 3, (args.patterns - 3) % 10),
+        'feature/TEAM%d-foo' % (args.patterns - 2),
+        'q/1/%d.0/development/x' % (args.patterns - 1),
+        'user/nomatch',
+    ]
+
+    start = timeit.default_timer()
+    matcher = BranchMatcher(branches)
+    build_time = timeit.default_timer() - start
+
+    for branch in candidates:
+        assert matcher.match(branch) == linear_match(branches, branch)
+
+    def run(func):
+        total = timeit.timeit(
+            lambda: [func(branch) for branch in candidates],
+            number=args.lookups)
+        return total / (args.lookups * len(candidates))
+
+    linear = run(lambda branch: linear_match(branches, branch))
+    compiled = run(matcher.match)
+
+    print('patterns:          %d' % len(matcher))
+    print('matcher build:     %.1f ms' % (build_time * 1000))
+    print('linear fnmatch:    %.3f ms/lookup' % (linear * 1000))
+    print('compiled matcher:  %.3f ms/lookup' % (compiled * 1000))
+    print('speedup:           x%.1f' % (linear / compiled))
+
+
+if __name__ == '__main__':
+    main()
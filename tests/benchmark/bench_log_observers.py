@@ -0,0 +1,88 @@
+"""Memory benchmark of the log observers of the artifacts steps.
+
+Feeds a synthetic log of ``--lines`` lines, as output by the former upload
+pipeline (one ``xargs -t`` curl command line per file on stderr, then the
+blocks listing the files of the links on stdout), to the buffering
+observer the steps used and to the streaming observers they use now, and
+reports the memory each keeps once the log is complete.
+
+"""
+
+import argparse
+import re
+import time
+import tracemalloc
+
+from buildbot.process.logobserver import BufferLogObserver
+
+from eve.process.logobserver import BlockObserver, FirstMatchObserver
+
+CURL = ('sh -c curl --silent --fail --show-error --max-time 3600 '
+        '-T "dir{dir}/file{index}.o" "http://artifacts/upload/githost:owner:'
+        'repo:staging-1.0.0.r210101000000.0123456789.post-merge.00001234/"'
+        '$(echo "dir{dir}/file{index}.o" | sed -e "s: :%20:g")\n')
+
+
+def make_log(lines, links=5, matches=20):
+    """Return the (stream, data) chunks of a synthetic upload log."""
+    chunks = []
+    chunk = []
+    for index in range(lines - links * (matches + 3)):
+        chunk.append(CURL.format(dir=index % 100, index=index))
+        if len(chunk) == 64:
+            chunks.append(('e', ''.join(chunk)))
+            chunk = []
+    if chunk:
+        chunks.append(('e', ''.join(chunk)))
+    for link in range(links):
+        files = '\n'.join('./dir{0}/file{1}.o'.format(link, 100 * i + link)
+                          for i in range(matches))
+        chunks.append(('o', '\nfind files matching dir{0}/*.o:\n{1}\n\n'
+                       .format(link, files)))
+    return chunks
+
+
+def measure(observer, chunks):
+    tracemalloc.start()
+    start = time.time()
+    for stream, data in chunks:
+        # as the data of a real log, each chunk is a new string
+        data = (data + ' ')[:-1]
+        if stream == 'o':
+            observer.outReceived(data)
+        else:
+            observer.errReceived(data)
+    observer.finishReceived()
+    elapsed = time.time() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=100000)
+    args = parser.parse_args()
+
+    chunks = make_log(args.lines)
+    size = sum(len(data) for _, data in chunks)
+    headers = ['find files matching dir{0}/*.o:'.format(link)
+               for link in range(5)]
+    observers = [
+        ('BufferLogObserver', BufferLogObserver(wantStdout=True,
+                                                wantStderr=True)),
+        ('BlockObserver', BlockObserver(headers=headers)),
+        ('FirstMatchObserver', FirstMatchObserver(
+            {'location': re.compile('^Location: .*/download/([^/]+)/$')},
+            streams='oe')),
+    ]
+
+    print('log:                 %d lines, %.1f MB' % (args.lines, size / 1e6))
+    for name, observer in observers:
+        retained, peak, elapsed = measure(observer, chunks)
+        print('%-20s %8.1f kB retained, %8.1f kB peak, %.3f s' % (
+            name + ':', retained / 1e3, peak / 1e3, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Micro-benchmark of the preparation of kube worker pod specs.
+
+Compares `EveKubeLatentWorker.get_pod_config` with its template and pod
+caches to compiling and loading the template on every build.
+
+"""
+
+import argparse
+import timeit
+
+import yaml
+from jinja2 import StrictUndefined, Template
+
+from eve.worker.kubernetes.kubernetes_worker import (POD_CACHE, TEMPLATE_CACHE,
+                                                     EveKubeLatentWorker)
+
+CONTAINER = """
+    - name: container{index}
+      image: "{{{{ images.container{index} }}}}"
+      resources:
+        requests: {{cpu: "500m", memory: 1Gi}}
+        limits: {{cpu: "500m", memory: 1Gi}}
+      env:
+        - name: FOO
+          value: "{{{{ vars.foo }}}}"
+      volumeMounts:
+        - name: workspace
+          mountPath: /home/eve/workspace
+"""
+
+
+def make_template(containers):
+    """Return a pod template running `containers` containers."""
+    return '\n'.join([
+        'apiVersion: v1',
+        'kind: Pod',
+        'metadata:',
+        '  name: worker',
+        'spec:',
+        '  volumes:',
+        '    - name: workspace',
+        '      emptyDir: {}',
+        '  containers:',
+    ] + [CONTAINER.format(index=i) for i in range(containers)])
+
+
+def uncached(source, variables):
+    pod = yaml.load(
+        Template(source, undefined=StrictUndefined).render(variables))
+    assert pod['kind'] == 'Pod'
+    assert pod['spec']['containers']
+    return pod
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--containers', type=int, default=5)
+    parser.add_argument('--builds', type=int, default=200)
+    args = parser.parse_args()
+
+    source = make_template(args.containers)
+    variables = {
+        'images': {'container%d' % i: 'registry/image%d:1.0' % i
+                   for i in range(args.containers)},
+        'vars': {'foo': 'bar'},
+    }
+    worker = EveKubeLatentWorker.__new__(EveKubeLatentWorker)
+    assert worker.get_pod_config('pod.yaml', source, variables) == \
+        uncached(source, variables)
+
+    def run(func):
+        return timeit.timeit(func, number=args.builds) / args.builds
+
+    baseline = run(lambda: uncached(source, variables))
+    compiled = run(lambda: worker.get_pod_config(
+        'pod.yaml', source, variables, reuse=False))
+    reused = run(lambda: worker.get_pod_config('pod.yaml', source, variables))
+
+    print('containers:          %d' % args.containers)
+    print('compile and load:    %.3f ms/build' % (baseline * 1000))
+    print('compiled template:   %.3f ms/build' % (compiled * 1000))
+    print('reused pod:          %.3f ms/build' % (reused * 1000))
+    print('speedup:             x%.1f (x%.1f)' % (baseline / reused,
+                                                  baseline / compiled))
+    print('template cache:      %s' % TEMPLATE_CACHE.stats())
+    print('pod cache:           %s' % POD_CACHE.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark of the upload of many small artifacts.
+
+Compares `eve_upload.py`, which streams the files over a pool of keep-alive
+connections, to the ``find | xargs | curl`` pipeline spawning a shell and a
+curl process, with a new connection, for every file. Both upload to a
+`FakeArtifactsServer` on localhost.
+
+The upload of the same tree is then repeated with ``--dedup``, as the next
+build of a stage would, after changing a tenth of the files.
+
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from eve.steps.artifacts import UPLOADER
+from tests.util.fake_artifacts_server import FakeArtifactsServer
+
+LEGACY = (
+    'find -L -type f -print0 | '
+    'sed -e "s:\\(^\\|\\x0\\)\\./:\\1:g" | '
+    'xargs -0 -P {jobs} '
+    '-I @ sh -c \'curl --silent --fail --show-error '
+    '-T "@" "{url}/"$(echo "@" | sed -e "s: :%20:g")\'')
+
+
+def make_tree(root, files, size):
+    """Create `files` files of `size` bytes, 100 per directory."""
+    data = os.urandom(size)
+    for index in range(files):
+        directory = os.path.join(root, 'dir%d' % (index // 100))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'file%d' % index), 'wb') as file_:
+            file_.write(data)
+
+
+def run(server, container, command, cwd):
+    connections = server.connections
+    start = time.time()
+    subprocess.check_call(command, cwd=cwd, shell=isinstance(command, str))
+    elapsed = time.time() - start
+    return (elapsed, len(server.container(container)),
+            server.connections - connections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--jobs', type=int, default=16)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    server = FakeArtifactsServer().start()
+    try:
+        tree = os.path.join(root, 'tree')
+        make_tree(tree, args.files, args.size)
+        url = server.url + '/upload/'
+
+        print('files:               %d x %d bytes' % (args.files, args.size))
+        results = [('eve_upload.py', run(server, 'native', [
+            sys.executable, UPLOADER, '--jobs', str(args.jobs),
+            '--manifest', os.path.join(root, 'manifest.json'),
+            url + 'native'], tree))]
+        for index in range(0, args.files, 10):
+            with open(os.path.join(tree, 'dir%d' % (index // 100),
+                                   'file%d' % index), 'ab') as file_:
+                file_.write(b'changed')
+        results.append(('eve_upload.py dedup', run(server, 'dedup', [
+            sys.executable, UPLOADER, '--jobs', str(args.jobs), '--dedup',
+            '--manifest', os.path.join(root, 'manifest.json'),
+            url + 'dedup'], tree)))
+        if shutil.which('curl'):
+            results.append(('find|xargs|curl', run(
+                server, 'legacy',
+                LEGACY.format(jobs=args.jobs, url=url + 'legacy'), tree)))
+
+        for name, (elapsed, files, connections) in results:
+            print('%-21s%.2f s, %.0f files/s, %d files, %d connections' % (
+                name + ':', elapsed, files / elapsed, files, connections))
+        if len(results) == 3:
+            print('speedup:             x%.1f' % (
+                results[2][1][0] / results[0][1][0]))
+    finally:
+        server.stop()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Micro-benchmark of the discovery of the links of an upload.
+
+Compares `LinkMatcher`, which evaluates all the url patterns of an upload
+in one pass over the files of its manifest, to matching every pattern
+against every file, as the former ``find`` per pattern did (without the
+cost of walking the tree again for every pattern).
+
+"""
+
+import argparse
+import fnmatch
+import re
+import timeit
+
+from eve.steps.artifacts import LinkMatcher
+
+
+def per_pattern(patterns, paths):
+    regexps = [re.compile(fnmatch.translate('./' + pattern))
+               for pattern in patterns]
+    return [[path for path in paths if regexp.match(path)]
+            for regexp in regexps]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--patterns', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    paths = ['./dir%d/sub%d/file%d.%s' % (i % 97, i % 13, i,
+                                          ('o', 'c', 'h', 'log')[i % 4])
+             for i in range(args.files)]
+    patterns = ['dir%d/*.log' % i for i in range(args.patterns - 1)]
+    patterns.append('*/sub1/file1?.h')
+    assert LinkMatcher(patterns).matches(paths) == \
+        per_pattern(patterns, paths)
+
+    def run(func):
+        return min(timeit.repeat(func, number=1, repeat=args.repeat))
+
+    baseline = run(lambda: per_pattern(patterns, paths))
+    matcher = run(lambda: LinkMatcher(patterns).matches(paths))
+
+    print('files x patterns:    %d x %d' % (args.files, args.patterns))
+    print('one pass / pattern:  %.3f s' % baseline)
+    print('LinkMatcher:         %.3f s' % matcher)
+    print('speedup:             x%.1f' % (baseline / matcher))
+
+
+if __name__ == '__main__':
+    main()
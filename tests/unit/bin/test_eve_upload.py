@@ -0,0 +1,216 @@
+"""Unit tests of `eve/bin/eve_upload.py`."""
+
+import json
+import os
+import shutil
+import tempfile
+from importlib.util import module_from_spec, spec_from_file_location
+from unittest import TestCase
+
+from eve.steps.artifacts import UPLOADER
+from tests.util.fake_artifacts_server import FakeArtifactsServer
+
+spec = spec_from_file_location('eve_upload', UPLOADER)
+eve_upload = module_from_spec(spec)
+spec.loader.exec_module(eve_upload)
+
+
+class TestEveUpload(TestCase):
+    def setUp(self):
+        self.server = FakeArtifactsServer().start()
+        self.addCleanup(self.server.stop)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.write('a.txt', b'a')
+        self.write('dir/b c.txt', b'bc')
+        self.write('dir/sub/d', b'd' * 10000)
+        os.symlink(os.path.join(self.root, 'dir', 'sub'),
+                   os.path.join(self.root, 'link'))
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, self.cwd)
+
+    def write(self, path, data):
+        path = os.path.join(self.root, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as file_:
+            file_.write(data)
+
+    def test_walk(self):
+        self.assertEqual(
+            list(eve_upload.walk('.', exclude=['dir/sub/d'])),
+            ['a.txt', 'dir/b c.txt'])
+        self.assertEqual(list(eve_upload.walk('.')),
+                         ['a.txt', 'dir/b c.txt', 'dir/sub/d', 'link/d'])
+
+    def test_walk_loop(self):
+        # like find -L, links to a parent directory are not followed
+        os.symlink(os.path.join(self.root, 'dir'),
+                   os.path.join(self.root, 'dir', 'sub', 'loop'))
+        os.symlink(self.root, os.path.join(self.root, 'root'))
+        self.assertEqual(list(eve_upload.walk('.')),
+                         ['a.txt', 'dir/b c.txt', 'dir/sub/d', 'link/d',
+                          'link/loop/b c.txt'])
+
+    def test_upload(self):
+        manifest_path = os.path.join(self.root, '.eve', 'manifest.json')
+        status = eve_upload.main([
+            '--manifest', manifest_path, '--jobs', '2',
+            self.server.url + '/upload/container/'])
+        self.assertEqual(status, 0)
+        self.assertEqual(self.server.container('container'), {
+            'a.txt': b'a',
+            'dir/b c.txt': b'bc',
+            'dir/sub/d': b'd' * 10000,
+            'link/d': b'd' * 10000,
+        })
+        # at most one connection per job, whatever the number of files (a
+        # job finding no file left never connects)
+        self.assertLessEqual(self.server.connections, 2)
+
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(
+            [(result['path'], result['size'], result['status'])
+             for result in manifest['files']],
+            [('a.txt', 1, 'uploaded'), ('dir/b c.txt', 2, 'uploaded'),
+             ('dir/sub/d', 10000, 'uploaded'),
+             ('link/d', 10000, 'uploaded')])
+        self.assertEqual((manifest['uploaded'], manifest['failed'],
+                          manifest['bytes']), (4, 0, 20003))
+
+    def test_failures(self):
+        self.server.failures.add('dir/b c.txt')
+        manifest_path = os.path.join(self.root, 'manifest.json')
+        status = eve_upload.main([
+            '--manifest', manifest_path, '--jobs', '1',
+            self.server.url + '/upload/container'])
+        self.assertEqual(status, 1)
+        self.assertEqual(sorted(self.server.container('container')),
+                         ['a.txt', 'dir/sub/d', 'link/d'])
+
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        failed = [result for result in manifest['files']
+                  if result['status'] == 'failed']
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0]['path'], 'dir/b c.txt')
+        self.assertIn('500', failed[0]['error'])
+        self.assertEqual(manifest['failed'], 1)
+
+    def upload(self, container, *args):
+        manifest_path = os.path.join(self.root, 'manifest.json')
+        status = eve_upload.main([
+            '--manifest', manifest_path, '--jobs', '2'] + list(args)
+            + [self.server.url + '/upload/' + container])
+        with open(manifest_path) as manifest_file:
+            return status, json.load(manifest_file)
+
+    def test_dedup(self):
+        self.upload('build1')
+        self.write('a.txt', b'changed')
+        self.server.requests = []
+        status, manifest = self.upload('build2', '--dedup')
+        self.assertEqual(status, 0)
+        self.assertEqual(self.server.container('build2'), {
+            'a.txt': b'changed',
+            'dir/b c.txt': b'bc',
+            'dir/sub/d': b'd' * 10000,
+            'link/d': b'd' * 10000,
+        })
+        # only the changed file is sent
+        self.assertEqual(
+            [request for request in self.server.requests
+             if request[1].startswith('/upload/')],
+            [('PUT', '/upload/build2/a.txt')])
+        self.assertIn(('PUT', '/link/build2/dir/b c.txt'),
+                      self.server.requests)
+        self.assertEqual(
+            {result['path']: result['status'] for result in manifest['files']},
+            {'a.txt': 'uploaded', 'dir/b c.txt': 'linked',
+             'dir/sub/d': 'linked', 'link/d': 'linked'})
+        self.assertTrue(manifest['dedup'])
+        self.assertEqual((manifest['uploaded'], manifest['bytes'],
+                          manifest['linked'], manifest['linked_bytes']),
+                         (1, 7, 3, 20002))
+
+    def test_dedup_lost_blob(self):
+        self.upload('build1')
+        self.server.blobs.pop(eve_upload.sha256sum('a.txt'))
+        real_lookup = eve_upload.Uploader.lookup
+
+        def lookup(uploader, digests):
+            # the blob disappears between the lookup and the link
+            present = real_lookup(uploader, digests)
+            present.add(eve_upload.sha256sum('a.txt'))
+            return present
+
+        eve_upload.Uploader.lookup = lookup
+        self.addCleanup(setattr, eve_upload.Uploader, 'lookup', real_lookup)
+        status, manifest = self.upload('build2', '--dedup')
+        self.assertEqual(status, 0)
+        self.assertEqual(manifest['files'][0]['status'], 'uploaded')
+        self.assertEqual(self.server.container('build2')['a.txt'], b'a')
+
+    def test_dedup_unsupported(self):
+        self.upload('build1')
+        self.server.dedup = False
+        status, manifest = self.upload('build2', '--dedup')
+        self.assertEqual(status, 0)
+        self.assertFalse(manifest['dedup'])
+        self.assertEqual(manifest['uploaded'], 4)
+        self.assertEqual(len(self.server.container('build2')), 4)
+
+    def test_resume(self):
+        self.server.failures.add('dir/b c.txt')
+        status, _ = self.upload('build1')
+        self.assertEqual(status, 1)
+
+        self.server.failures.clear()
+        self.server.requests = []
+        status, manifest = self.upload('build1', '--resume')
+        self.assertEqual(status, 0)
+        self.assertEqual(self.server.requests,
+                         [('PUT', '/upload/build1/dir/b c.txt')])
+        self.assertEqual(
+            [(result['path'], result['status'], result.get('resumed', False))
+             for result in manifest['files']],
+            [('a.txt', 'uploaded', True), ('dir/b c.txt', 'uploaded', False),
+             ('dir/sub/d', 'uploaded', True), ('link/d', 'uploaded', True)])
+        self.assertEqual((manifest['resumed'], manifest['resumed_bytes'],
+                          manifest['uploaded'], manifest['failed']),
+                         (3, 20001, 1, 0))
+
+        # not for another container
+        self.server.requests = []
+        status, manifest = self.upload('build2', '--resume')
+        self.assertEqual((manifest['resumed'], manifest['uploaded']), (0, 4))
+
+    def test_resume_interrupted(self):
+        # an upload killed after sending a.txt only left its journal
+        with open(os.path.join(self.root, 'manifest.json.journal'),
+                  'w') as journal:
+            journal.write(json.dumps(
+                {'url': self.server.url + '/upload/build1'}) + '\n')
+            journal.write(json.dumps(
+                {'path': 'a.txt', 'size': 1, 'status': 'uploaded'}) + '\n')
+            journal.write('{"path": "dir/b')
+        status, manifest = self.upload('build1', '--resume')
+        self.assertEqual(status, 0)
+        self.assertEqual((manifest['resumed'], manifest['uploaded']), (1, 3))
+        self.assertNotIn(('PUT', '/upload/build1/a.txt'),
+                         self.server.requests)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, 'manifest.json.journal')))
+
+    def test_resume_deleted_file(self):
+        uploader = eve_upload.Uploader(self.server.url + '/upload/build1')
+        previous = {'gone.txt': {'path': 'gone.txt', 'size': 1,
+                                 'status': 'uploaded'}}
+        manifest = uploader.upload('.', ['a.txt', 'gone.txt'], previous)
+        self.assertEqual(
+            [(result['path'], result['status'])
+             for result in manifest['files']],
+            [('a.txt', 'uploaded'), ('gone.txt', 'failed')])
+        self.assertEqual((manifest['resumed'], manifest['failed']), (0, 1))
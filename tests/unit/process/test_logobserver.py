@@ -0,0 +1,108 @@
+"""Unit tests of `eve.process.logobserver`."""
+
+import re
+
+from buildbot.plugins import util
+from buildbot.process.logobserver import BufferLogObserver
+from buildbot.process.results import FAILURE, SUCCESS
+from buildbot.test.fake.remotecommand import ExpectShell
+from buildbot.test.util import steps
+from buildbot.test.util.misc import TestReactorMixin
+from twisted.trial import unittest
+
+from eve.process.logobserver import (BlockObserver, FirstMatchObserver,
+                                     StreamingLineObserver)
+from eve.steps.yaml_parser import GetCommitShortVersion
+
+
+class LinesObserver(StreamingLineObserver):
+    def __init__(self, **kwargs):
+        super(LinesObserver, self).__init__(**kwargs)
+        self.lines = []
+
+    def lineReceived(self, stream, line):
+        self.lines.append((stream, line))
+
+
+class TestStreamingLineObserver(unittest.TestCase):
+    def test_lines(self):
+        observer = LinesObserver(streams='oe', max_line_length=5)
+        observer.outReceived('a\n\nb')
+        observer.errReceived('err\n')
+        observer.outReceived('c\nlong line\nd')
+        observer.finishReceived()
+        self.assertEqual(observer.lines, [
+            ('o', 'a'), ('o', ''), ('e', 'err'), ('o', 'bc'),
+            ('o', 'long '), ('o', 'd')])
+
+    def test_streams(self):
+        observer = LinesObserver()
+        observer.outReceived('out\n')
+        observer.errReceived('err\n')
+        self.assertEqual(observer.lines, [('o', 'out')])
+
+
+class TestFirstMatchObserver(unittest.TestCase):
+    def test_first_match(self):
+        observer = FirstMatchObserver({
+            'number': re.compile(r'^(\d+)$'),
+            'word': re.compile(r'^([a-z]+)$'),
+        })
+        observer.outReceived('1\n2\nabc\n3\n')
+        observer.errReceived('4\n')
+        self.assertEqual(observer.matches['number'].group(1), '1')
+        self.assertEqual(observer.matches['word'].group(1), 'abc')
+
+
+class TestBlockObserver(unittest.TestCase):
+    def test_blocks(self):
+        observer = BlockObserver(headers={'A:', 'B:', 'C:'})
+        observer.outReceived('noise\nA:\n./a\n./b\n\nB:\n\nA:\n./c\n\n')
+        self.assertEqual(observer.blocks, {'A:': ['./a', './b'], 'B:': []})
+
+
+class ShortVersion(GetCommitShortVersion):
+    def __init__(self, branch):
+        super(ShortVersion, self).__init__(branch)
+        # step names must be identifiers in the tests
+        self.name = 'GetCommitShortVersion'
+
+
+class TestGetCommitShortVersion(steps.BuildStepMixin, TestReactorMixin,
+                                unittest.TestCase):
+    def setUp(self):
+        util.env = util.load_env([('HIDE_INTERNAL_STEPS', '1', int)])
+        self.setUpTestReactor()
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        return self.tearDownBuildStep()
+
+    def test_observers(self):
+        self.setupStep(ShortVersion('master'))
+        self.assertFalse([
+            observer for _, observer in self.step._pendingLogObservers
+            if isinstance(observer, BufferLogObserver)])
+
+    def test_short_revision(self):
+        self.setupStep(ShortVersion('master'))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', logEnviron=False, command=[
+                'git', 'rev-parse', '--verify', '--short=10', 'master'])
+            + ExpectShell.log('stdio', stdout='warning\n0123456789ab\n',
+                              stderr='abcdef0123\n')
+            + 0)
+        self.expectOutcome(result=SUCCESS)
+        self.expectProperty('commit_short_revision', '0123456789',
+                            'GetCommitShortVersion')
+        return self.runStep()
+
+    def test_failure(self):
+        self.setupStep(ShortVersion('master'))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', logEnviron=False, command=[
+                'git', 'rev-parse', '--verify', '--short=10', 'master'])
+            + 128)
+        self.expectOutcome(result=FAILURE)
+        self.expectNoProperty('commit_short_revision')
+        return self.runStep()
@@ -10,6 +10,11 @@ import collections
 import unittest
 
 from buildbot.plugins import util
+from buildbot.process.properties import Properties
+from buildbot.test.fake import fakemaster
+from buildbot.test.util.misc import TestReactorMixin
+from twisted.internet import defer
+from twisted.trial import unittest as trial_unittest
 
 import eve.setup.builders
 
@@ -29,3 +34,73 @@ class TestSetupBuilders(unittest.TestCase):
             'foo', [DumbWorker(name='bar')])
         self.assertEqual(builder_conf.name, 'foo')
         self.assertEqual(builder_conf.workernames, ['bar'])
+
+
+class FakeBuilder(object):
+    def __init__(self, master):
+        self.name = 'foo'
+        self.master = master
+
+    def getBuilderIdForName(self, name):
+        return defer.succeed({'foo': 1, 'virtual': 2}[name])
+
+
+class FakeRequest(object):
+    def __init__(self, **properties):
+        self.properties = Properties(**properties)
+
+
+class TestCanStartBuild(TestReactorMixin, trial_unittest.TestCase):
+    def setUp(self):
+        util.env = util.load_env([
+            ('RUNNING_BUILDS_RECONCILE_INTERVAL', '300', int),
+        ])
+        self.setUpTestReactor()
+        self.master = fakemaster.make_master(self, wantDb=True, wantMq=True)
+        self.master.mq.verifyMessages = False
+        self.builder = FakeBuilder(self.master)
+        self.running = {1: [], 2: []}
+
+        def getBuilds(builderid, complete):
+            return defer.succeed([{'id': buildid, 'builderid': builderid}
+                                  for buildid in self.running[builderid]])
+        self.master.db.builds.getBuilds = getBuilds
+
+    def can_start(self, wfb=None, **properties):
+        return eve.setup.builders.canStartBuild(
+            self.builder, wfb, FakeRequest(**properties))
+
+    @defer.inlineCallbacks
+    def test_no_limit(self):
+        self.running[1] = [1, 2, 3]
+        self.assertTrue((yield self.can_start()))
+
+    @defer.inlineCallbacks
+    def test_simultaneous_builds(self):
+        self.running[2] = [1]
+        self.assertTrue((yield self.can_start(
+            simultaneous_builds='2', virtual_builder_name='virtual')))
+        self.master.mq.callConsumer(('builds', '2', 'new'),
+                                    {'builderid': 2, 'buildid': 2})
+        self.assertFalse((yield self.can_start(
+            simultaneous_builds='2', virtual_builder_name='virtual')))
+        self.assertTrue((yield self.can_start(simultaneous_builds='2')))
+
+    @defer.inlineCallbacks
+    def test_admission(self):
+        admitted = []
+
+        class Worker(object):
+            def admit(self, request):
+                admitted.append(request)
+                return defer.succeed(len(admitted) == 1)
+
+        wfb = collections.namedtuple('WFB', 'worker')(Worker())
+        self.assertTrue((yield self.can_start(wfb)))
+        self.assertFalse((yield self.can_start(wfb)))
+
+        # the limit of simultaneous builds is checked first
+        self.running[2] = [1]
+        self.assertFalse((yield self.can_start(
+            wfb, simultaneous_builds='1', virtual_builder_name='virtual')))
+        self.assertEqual(len(admitted), 2)
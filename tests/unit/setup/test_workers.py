@@ -1,15 +1,25 @@
 """Unit tests of `eve.setup.workers`."""
 
+import os
+import shutil
 import unittest
-from io import StringIO
+from tempfile import mkdtemp
 
 from buildbot.plugins import util
+from buildbot.process.properties import Properties, Property
 from mock import patch
+from twisted.internet import defer
 
 import eve.setup.workers
 
 
 class TestSetupWorkers(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        eve.setup.workers.OPENSTACK_MAPPINGS.clear()
+        eve.setup.workers.WORKER_SCRIPTS.clear()
+
     mapping_data = u"""
 provider:
   - field:
@@ -44,19 +54,69 @@ provider_there:
             ('MASTER_FQDN', 'foo'),
             ('MAX_DOCKER_WORKERS', 3),
             ('SUFFIX', '_foo'),
+            ('DOCKER_WARM_POOL_SIZE', 0),
+            ('DOCKER_WORKER_BACKEND', 'cli'),
         ])
         workers = eve.setup.workers.docker_workers()
         self.assertEqual(len(workers), 3)
+        self.assertIsNone(workers[0].engine)
+        self.assertIsNone(workers[0].warm_pool)
+        self.assertEqual(
+            workers[0]._config_kwargs['build_wait_timeout'], 0)
+
+    def test_docker_workers_warm_pool(self):
+        util.env = util.load_env([
+            ('DOCKER_CONTAINER_MAX_CPU', '4'),
+            ('DOCKER_CONTAINER_MAX_MEMORY', '4G'),
+            ('DOCKER_WARM_POOL_SIZE', 2),
+            ('DOCKER_WARM_POOL_TTL', 300),
+            ('DOCKER_WARM_POOL_WINDOW', 900),
+            ('DOCKER_WORKER_BACKEND', 'cli'),
+            ('EXTERNAL_PB_PORT', '12345'),
+            ('MASTER_FQDN', 'foo'),
+            ('MAX_DOCKER_WORKERS', 2),
+            ('SUFFIX', '_foo'),
+        ])
+        workers = eve.setup.workers.docker_workers()
+        self.assertIs(workers[0].warm_pool, workers[1].warm_pool)
+        self.assertEqual(workers[0].warm_pool.max_idle_per_image, 2)
+        self.assertEqual(workers[0].warm_pool.window, 900)
+        self.assertEqual(
+            workers[0]._config_kwargs['build_wait_timeout'], 300)
+        self.assertTrue(workers[0].builds_may_be_incompatible)
+
+    def test_docker_workers_api_backend(self):
+        util.env = util.load_env([
+            ('DOCKER_API_VERSION', '1.40'),
+            ('DOCKER_CONTAINER_MAX_CPU', '4'),
+            ('DOCKER_CONTAINER_MAX_MEMORY', '4G'),
+            ('DOCKER_HOST', 'unix:///tmp/docker.sock'),
+            ('DOCKER_WARM_POOL_SIZE', 0),
+            ('DOCKER_WORKER_BACKEND', 'api'),
+            ('EXTERNAL_PB_PORT', '12345'),
+            ('MASTER_FQDN', 'foo'),
+            ('MAX_DOCKER_WORKERS', 2),
+            ('SUFFIX', '_foo'),
+        ])
+        workers = eve.setup.workers.docker_workers()
+        self.assertIs(workers[0].engine, workers[1].engine)
+        self.assertEqual(workers[0].engine.socket_path, '/tmp/docker.sock')
+        self.assertEqual(workers[0].engine.api_version, '1.40')
 
     def test_kube_pod_workers(self):
         util.env = util.load_env([
             ('EXTERNAL_PB_PORT', '12345'),
+            ('KUBE_CLIENT_REFRESH_INTERVAL', 600),
             ('KUBE_POD_ACTIVE_DEADLINE', '3600'),
+            ('KUBE_POD_CPU_BUDGET', '16'),
             ('KUBE_POD_GITCONFIG_CM', 'gitconfig'),
             ('KUBE_POD_MAX_CPU', '4'),
             ('KUBE_POD_MAX_MEMORY', '4G'),
+            ('KUBE_POD_MEMORY_BUDGET', ''),
             ('KUBE_POD_NAMESPACE', 'spameggbacon'),
             ('KUBE_POD_NODE_AFFINITY', 'pool:worker'),
+            ('KUBE_POD_REAPER_INTERVAL', 300),
+            ('KUBE_POD_REAPER_MIN_AGE', 900),
             ('KUBE_SERVICE', 'test-service'),
             ('KUBE_SERVICE_DATA', 'test-service-data'),
             ('KUBE_SERVICE_IN_USE', 1),
@@ -66,88 +126,149 @@ provider_there:
         ])
         workers = eve.setup.workers.kube_pod_workers()
         self.assertEqual(len(workers), 3)
+        kube_client = workers[0]._config_kwargs['kube_client']
+        self.assertIs(workers[2]._config_kwargs['kube_client'], kube_client)
+        self.assertEqual(kube_client.pool_size, 3)
+        admission = workers[0]._config_kwargs['admission']
+        self.assertIs(workers[2]._config_kwargs['admission'], admission)
+        self.assertEqual(admission.cpu_budget, 16)
+        self.assertIsNone(admission.memory_budget)
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_nofile(self, mock_open):
-        util.env = util.load_env([
-            ('OS_MAPPING_FILE_PATH', 'filepath'),
-        ])
+        reaper = eve.setup.workers.kube_pod_reaper(workers, kube_client)
+        config = reaper._config_kwargs
+        self.assertEqual(config['workernames'],
+                         ['kw000-_foo', 'kw001-_foo', 'kw002-_foo'])
+        self.assertEqual((config['interval'], config['min_age']), (300, 900))
+        self.assertIs(config['kube_client'], kube_client)
 
-        mock_open.side_effect = OSError
-        res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo')
-        self.assertEqual(res, 'foo')
+        util.env['KUBE_POD_REAPER_INTERVAL'] = 0
+        self.assertIsNone(eve.setup.workers.kube_pod_reaper(workers))
 
-        mock_open.side_effect = IOError
-        res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo')
-        self.assertEqual(res, 'foo')
+    def mapping_file(self, contents):
+        path = os.path.join(self.tmpdir, 'mapping.yml')
+        with open(path, 'w') as mapping_file:
+            mapping_file.write(contents)
+        util.env = util.load_env([
+            ('OS_MAPPING_FILE_PATH', path),
+        ])
+        return path
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_invalid_yaml(self, mock_open):
+    def test_openstack_mapping_nofile(self):
         util.env = util.load_env([
-            ('OS_MAPPING_FILE_PATH', 'filepath'),
+            ('OS_MAPPING_FILE_PATH', os.path.join(self.tmpdir, 'missing')),
         ])
+        res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo')
+        self.assertEqual(res, 'foo')
 
-        mock_open.return_value = StringIO(u"not: 'yaml")
+    def test_openstack_mapping_invalid_yaml(self):
+        self.mapping_file(u"not: 'yaml")
         res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo')
         self.assertEqual(res, 'foo')
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_no_provider(self, mock_open):
-        mock_open.return_value = StringIO(self.mapping_data)
+    def test_openstack_mapping_no_provider(self):
+        self.mapping_file(self.mapping_data)
         res = eve.setup.workers.openstack_mapping('nomatch', 'field', 'foo')
         self.assertEqual(res, 'foo')
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_no_field(self, mock_open):
-        mock_open.return_value = StringIO(self.mapping_data)
+    def test_openstack_mapping_no_field(self):
+        self.mapping_file(self.mapping_data)
         res = eve.setup.workers.openstack_mapping('provider', 'nomatch', 'foo')
         self.assertEqual(res, 'foo')
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_no_value(self, mock_open):
-        mock_open.return_value = StringIO(self.mapping_data)
+    def test_openstack_mapping_no_value(self):
+        self.mapping_file(self.mapping_data)
         res = eve.setup.workers.openstack_mapping('provider', 'field', 'baz')
         self.assertEqual(res, 'baz')
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_match(self, mock_open):
-        mock_open.return_value = StringIO(self.mapping_data)
+    def test_openstack_mapping_match(self):
+        self.mapping_file(self.mapping_data)
         res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo')
         self.assertEqual(res, 'bar')
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_mapping_v2(self, mock_open):
-        mock_open.return_value = StringIO(self.mapping_data)
+    def test_openstack_mapping_v2(self):
+        self.mapping_file(self.mapping_data)
         res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo',
                                                   region="there")
         self.assertEqual(res, 'bar')
-        mock_open.return_value = StringIO(self.mapping_v2_data)
+        path = self.mapping_file(self.mapping_v2_data)
+        os.utime(path, (1000, 1000))
         res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo',
                                                   region="there")
         self.assertEqual(res, 'bar')
 
+    def test_openstack_mapping_cached(self):
+        path = self.mapping_file(self.mapping_data)
+        for _ in range(3):
+            res = eve.setup.workers.openstack_mapping('provider', 'field',
+                                                      'foo')
+            self.assertEqual(res, 'bar')
+        self.assertEqual(eve.setup.workers.OPENSTACK_MAPPINGS.misses, 1)
+
+        # an update of the file is seen at the next render
+        self.mapping_file(self.mapping_data.replace('bar', 'qux'))
+        os.utime(path, (1000, 1000))
+        res = eve.setup.workers.openstack_mapping('provider', 'field', 'foo')
+        self.assertEqual(res, 'qux')
+
+    def test_index_openstack_mapping(self):
+        errors = []
+        index, providers = eve.setup.workers.index_openstack_mapping({
+            'a': [
+                {'flavor': {'original_value': 'x', 'new_value': 'y'}},
+                {'flavor': {'original_value': 'x', 'new_value': 'z'},
+                 'image': {'new_value': 'z'}},
+                {'image': {'original_value': 'i', 'new_value': 'j'}},
+                {'flavor': {'original_value': 'u', 'new_value': None}},
+            ],
+            'b': ['not a dict', {'flavor': {'original_value': 'x',
+                                            'new_value': 'y'}}],
+            'c': None,
+        }, errors.append)
+        self.assertEqual(index, {('a', 'flavor', 'x'): 'y'})
+        self.assertEqual(providers, {'a', 'b', 'c'})
+        self.assertEqual(len(errors), 2)
+
     def test_openstack_worker_script_with_user_script(self):
         res = eve.setup.workers.openstack_worker_script('path', 'user_data')
         self.assertEqual(res, 'user_data')
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_worker_script_missing_default_file(self, mock_open):
-        mock_open.side_effect = OSError
+    def test_openstack_worker_script_missing_default_file(self):
         with self.assertRaises(OSError):
-            eve.setup.workers.openstack_worker_script('/path', '')
+            eve.setup.workers.openstack_worker_script(
+                os.path.join(self.tmpdir, 'missing'), '')
 
     def test_openstack_worker_script_default_script(self):
         res = eve.setup.workers.openstack_worker_script(
             'os_script_init.sh', '')
         self.assertTrue(res.startswith('#!/bin/bash'))
 
-    @patch('eve.setup.workers.open')
-    def test_openstack_worker_script_custom_script(self, mock_open):
-        mock_open.return_value = StringIO(u"script contents")
-        res = eve.setup.workers.openstack_worker_script('/path', '')
-        self.assertEqual(res, 'script contents')
+    def test_openstack_worker_script_custom_script(self):
+        path = os.path.join(self.tmpdir, 'script.sh')
+        with open(path, 'w') as script:
+            script.write(u"script contents")
+        with patch('eve.setup.workers.open', side_effect=open) as mock_open:
+            for _ in range(2):
+                res = eve.setup.workers.openstack_worker_script(path, '')
+                self.assertEqual(res, 'script contents')
         mock_open.assert_called_once()
-        self.assertEqual(mock_open.call_args_list[0][0][0], '/path')
+        self.assertEqual(mock_open.call_args_list[0][0][0], path)
+
+    def test_threaded_transform(self):
+        calls = []
+
+        def deferToThread(function, *args, **kwargs):
+            calls.append(function)
+            return defer.succeed(function(*args, **kwargs))
+
+        props = Properties()
+        props.setProperty('value', 'foo', 'test')
+        transform = eve.setup.workers.ThreadedTransform(
+            lambda value, suffix: value + suffix, Property('value'),
+            suffix='bar')
+        with patch('eve.setup.workers.threads.deferToThread', deferToThread):
+            rendered = props.render(transform)
+        self.assertEqual(rendered.result, 'foobar')
+        self.assertEqual(len(calls), 1)
 
     def test_openstack_heat_workers(self):
         util.env = util.load_env([
@@ -171,6 +292,9 @@ provider_there:
             ('OS_SCRIPT_REQUIREMENTS_FILE_PATH', 'reqscript'),
             ('OS_SCRIPT_START_FILE_PATH', 'startscript'),
             ('OS_SSH_KEY', 'foo'),
+            ('OS_STACK_POOL_SIZE', 2),
+            ('OS_STACK_POOL_TTL', 300),
+            ('OS_STACK_POOL_WINDOW', 1800),
             ('OS_TENANT_NAME', 'foo'),
             ('OS_USERNAME', 'foo'),
             ('REDHAT_ACTIVATIONKEY', 'foo'),
@@ -182,3 +306,9 @@ provider_there:
         ])
         workers = eve.setup.workers.openstack_heat_workers()
         self.assertEqual(len(workers), 3)
+        self.assertIs(workers[0].stack_tracker, workers[2].stack_tracker)
+        self.assertIs(workers[0].heat_client, workers[2].heat_client)
+        self.assertIs(workers[0].stack_pool, workers[2].stack_pool)
+        self.assertEqual(workers[0].stack_pool.max_idle_per_key, 2)
+        self.assertEqual(workers[0]._config_kwargs['build_wait_timeout'],
+                         300)
@@ -19,15 +19,26 @@
 
 from __future__ import absolute_import
 
+import fnmatch
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
 from buildbot.plugins import util
+from buildbot.process import remotetransfer
 from buildbot.process.properties import Interpolate
-from buildbot.process.results import SKIPPED, SUCCESS
-from buildbot.test.fake.remotecommand import ExpectShell
+from buildbot.process.results import FAILURE, SKIPPED, SUCCESS
+from buildbot.test.fake.remotecommand import (Expect, ExpectRemoteRef,
+                                              ExpectShell)
 from buildbot.test.util import config, steps
 from buildbot.test.util.misc import TestReactorMixin
+from twisted.internet import defer
 from twisted.trial import unittest
 
-from eve.steps.artifacts import (GetArtifactsFromStage,
+from eve.steps.artifacts import (GetArtifactsFromStage, LinkMatcher,
                                  MalformedArtifactsNameProperty, Upload,
                                  Uploadv3)
 
@@ -36,6 +47,7 @@ class TestUpload(steps.BuildStepMixin, TestReactorMixin, unittest.TestCase,
                  config.ConfigErrorsMixin):
     def setUp(self):
         util.env = util.load_env([
+            ('ARTIFACTS_DEDUP', '0', int),
             ('ARTIFACTS_PREFIX', 'prefix-'),
             ('OPENSTACK_BUILDER_NAME', 'openstack'),
         ])
@@ -138,6 +150,267 @@ class TestUpload(steps.BuildStepMixin, TestReactorMixin, unittest.TestCase,
         return self.runStep()
 
 
+def upload_string(string):
+    def behavior(command):
+        writer = command.args['writer']
+        writer.remote_write(string)
+        writer.remote_close()
+    return behavior
+
+
+LEGACY_COMMAND = (
+    'find -L -type f -print0 | '
+    'sed -e "s:\\(^\\|\\x0\\)\\./:\\1:g" | '
+    'xargs -0 -n 1 -t -P 16 '
+    '-I @ sh -c \'curl --silent --fail --show-error '
+    '--max-time 3600 -T "@" '
+    '"http://artifacts/upload/githost:owner:repo:prefix-'
+    '0.0.0.0.r190101000000.1234567.pre-merge.12345678/"'
+    '$(echo "@" | sed -e "s: :%20:g")\'')
+
+
+class TestUploader(steps.BuildStepMixin, TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        util.env = util.load_env([
+            ('ARTIFACTS_DEDUP', '0', int),
+            ('ARTIFACTS_PREFIX', 'prefix-'),
+            ('ARTIFACTS_PUBLIC_URL', 'https://artifacts'),
+        ])
+        self.setUpTestReactor()
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        return self.tearDownBuildStep()
+
+    def setupStep(self, *args, **kwargs):
+        res = super(TestUploader, self).setupStep(*args, **kwargs)
+        self.properties.setProperty('eve_api_version', '0.2', 'setUp')
+        self.properties.setProperty('artifacts_name',
+                                    'githost:owner:repo:prefix-'
+                                    '0.0.0.0.r190101000000.1234567.'
+                                    'pre-merge.12345678', 'setUp')
+        self.properties.setProperty('builddir', '/wk/builder', 'Worker')
+        return res
+
+    def expect_upload(self, rc=0, manifest=None, stdout='', dedup=False,
+                      resume=False):
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                workerdest='/wk/builder/.eve/eve_upload.py',
+                workdir='/wk/builder', maxsize=None, mode=None,
+                reader=ExpectRemoteRef(remotetransfer.StringFileReader),
+                blocksize=32 * 1024))
+            + 0,
+            ExpectShell(
+                workdir='build/bar',
+                maxTime=3610,
+                command='if PYTHON=$(command -v python3 || command -v python)'
+                ' && "$PYTHON" -c "import argparse" 2>/dev/null;'
+                ' then "$PYTHON" /wk/builder/.eve/eve_upload.py '
+                '--manifest /wk/builder/.eve/upload-manifest.json '
+                '--jobs 16 --max-time 3600 '
+                + ('--dedup ' if dedup else '')
+                + ('--resume ' if resume else '')
+                + '"http://artifacts/upload/githost:owner:repo:prefix-'
+                '0.0.0.0.r190101000000.1234567.pre-merge.12345678/"; '
+                'else ' + LEGACY_COMMAND
+                + ''.join(
+                    ' && echo -e "\\nfind files matching {path}:\\n'
+                    '$(find -L . -type f -path \'./{path}\')\\n\\n"'.format(
+                        path=path) for path in self.paths)
+                + '; fi')
+            + ExpectShell.log('stdio', stdout=stdout)
+            + rc,
+            Expect('uploadFile', dict(
+                workersrc='/wk/builder/.eve/upload-manifest.json',
+                workdir='build/bar',
+                writer=ExpectRemoteRef(remotetransfer.StringFileWriter),
+                maxsize=None, blocksize=32 * 1024))
+            + Expect.behavior(upload_string(json.dumps(manifest)))
+            + (0 if manifest is not None else 1))
+
+    @defer.inlineCallbacks
+    def test_upload(self):
+        self.paths = ['*.txt']
+        self.setupStep(Upload(name='Upload', source='bar',
+                              urls=[('\\1', '*.txt')]))
+        manifest = {'files': [{'path': 'a.txt', 'size': 1,
+                               'status': 'uploaded'}],
+                    'uploaded': 1, 'failed': 0}
+        self.expect_upload(manifest=manifest, stdout=(
+            'uploaded 1 files (1 bytes) in 0.1s over 1 connections, '
+            '0 failed\n'))
+        self.expectOutcome(result=SUCCESS)
+        self.expectLogfile('manifest', json.dumps(manifest))
+        urls = []
+        self.step.addURL = lambda name, url: urls.append((name, url))
+        yield self.runStep()
+        self.assertEqual(self.step.manifest, manifest)
+        self.assertEqual(urls, [
+            ('a', 'https://artifacts/builds/githost:owner:repo:'
+             'prefix-0.0.0.0.r190101000000.1234567.pre-merge.12345678/'
+             './a.txt')])
+
+    @defer.inlineCallbacks
+    def test_upload_interpolated_urls(self):
+        self.paths = ['dir/*.txt']
+        self.setupStep(Upload(name='Upload', source='bar', urls=[
+            ('\\1', Interpolate('%(prop:subdir)s/*.txt'))]))
+        self.properties.setProperty('subdir', 'dir', 'setUp')
+        manifest = {'files': [{'path': 'dir/a.txt', 'size': 1,
+                               'status': 'uploaded'}],
+                    'uploaded': 1, 'failed': 0}
+        self.expect_upload(manifest=manifest)
+        self.expectOutcome(result=SUCCESS)
+        urls = []
+        self.step.addURL = lambda name, url: urls.append((name, url))
+        yield self.runStep()
+        self.assertEqual(urls, [
+            ('a', 'https://artifacts/builds/githost:owner:repo:'
+             'prefix-0.0.0.0.r190101000000.1234567.pre-merge.12345678/'
+             './dir/a.txt')])
+
+    def test_upload_dedup(self):
+        self.paths = []
+        self.setupStep(Upload(name='Upload', source='bar', dedup=True))
+        manifest = {'files': [{'path': 'a.txt', 'size': 1, 'digest': 'ca97',
+                               'status': 'linked'}],
+                    'uploaded': 0, 'linked': 1, 'failed': 0}
+        self.expect_upload(manifest=manifest, dedup=True)
+        self.expectOutcome(result=SUCCESS)
+        return self.runStep()
+
+    @defer.inlineCallbacks
+    def test_upload_failure(self):
+        self.paths = []
+        self.setupStep(Upload(name='Upload', source='bar', retry=(0, 0)))
+        self.expect_upload(rc=1, manifest=None)
+        self.expectOutcome(result=FAILURE)
+        yield self.runStep()
+        self.assertIsNone(self.step.manifest)
+
+    @defer.inlineCallbacks
+    def test_retry_resumes(self):
+        self.paths = []
+        self.setupStep(Upload(name='Upload', source='bar', retry=(0, 1)))
+        manifest = {'files': [], 'uploaded': 9, 'failed': 1}
+        self.expect_upload(rc=1, manifest=manifest)
+        retries = []
+        self.build.addStepsAfterCurrentStep = retries.extend
+        self.expectOutcome(result=SKIPPED)
+        yield self.runStep()
+        self.assertEqual(len(retries), 1)
+        self.assertTrue(retries[0].resume)
+        self.assertEqual(retries[0]._retry, (0, 0))
+
+    def test_resumed_upload(self):
+        self.paths = []
+        self.setupStep(Upload(name='Upload', source='bar', resume=True))
+        manifest = {'files': [], 'uploaded': 1, 'bytes': 10, 'linked': 0,
+                    'linked_bytes': 0, 'resumed': 9, 'resumed_bytes': 90,
+                    'failed': 0}
+        self.expect_upload(manifest=manifest, resume=True)
+        self.expectOutcome(result=SUCCESS)
+        self.expectLogfile('retry', (
+            'files already sent by the previous attempts: 9 '
+            '(90 bytes saved)\n'
+            'files sent by this attempt: 1 (10 bytes)\n'
+            'files copied by the artifacts: 0 (0 bytes)\n'
+            'files which failed: 0\n'))
+        return self.runStep()
+
+
+class TestPythonProbe(unittest.TestCase):
+    def setUp(self):
+        self.bindir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.bindir)
+
+    def probe(self):
+        return subprocess.check_output(
+            ['/bin/sh', '-c', Upload.PYTHON_PROBE + ' && echo "$PYTHON" '
+             '|| echo legacy'],
+            env={'PATH': self.bindir}).decode().strip()
+
+    def test_no_python(self):
+        self.assertEqual(self.probe(), 'legacy')
+
+    def test_python26(self):
+        # python 2.6 has no argparse, the uploader cannot run
+        python = os.path.join(self.bindir, 'python')
+        with open(python, 'w') as script:
+            script.write('#!/bin/sh\nexit 1\n')
+        os.chmod(python, 0o755)
+        self.assertEqual(self.probe(), 'legacy')
+
+    def test_python3(self):
+        python = os.path.join(self.bindir, 'python3')
+        os.symlink(sys.executable, python)
+        self.assertEqual(self.probe(), python)
+
+
+class TestLinks(unittest.TestCase):
+    FILES = [
+        'a.txt',
+        'dir/b.txt',
+        'dir/sub/c.txt',
+        'other/b.txt',
+        'pkg/foo-1.0.rpm',
+        'pkg/bar-2.1.rpm',
+        'report.html',
+    ]
+
+    URLS = [
+        'report.html',
+        ('Report', 'report.html'),
+        ('Text ', '*.txt'),
+        ('B', '*/b.txt'),
+        ('\\1 package (\\2)', 'pkg/*-*.rpm'),
+        ('Sub', 'dir/sub/?.txt'),
+        ('Missing', 'missing'),
+    ]
+
+    def test_matcher(self):
+        matcher = LinkMatcher(['*.txt', 'dir/?.txt', 'pkg/[fx]*', 'none'])
+        self.assertEqual(
+            matcher.matches('./' + path for path in self.FILES), [
+                ['./a.txt', './dir/b.txt', './dir/sub/c.txt',
+                 './other/b.txt'],
+                ['./dir/b.txt'],
+                ['./pkg/foo-1.0.rpm'],
+                [],
+            ])
+        self.assertEqual(LinkMatcher([]).matches(['./a']), [])
+
+    def test_manifest_links_match_find_links(self):
+        step = Upload(source='bar')
+        step.set_links(step.parse_urls(self.URLS))
+        step.observer.outReceived(''.join(
+            '\n{header}\n{matches}\n\n'.format(
+                header=link['header'],
+                matches='\n'.join(
+                    './' + path for path in self.FILES
+                    if fnmatch.fnmatchcase(path, link['path'])))
+            for link in step._links))
+        step.manifest = {'files': [{'path': path, 'status': 'uploaded'}
+                                   for path in self.FILES]}
+
+        links = step._get_links_from_manifest()
+        self.assertEqual(links, step._get_links_from_stdout())
+        self.assertEqual(links, [
+            ('Bb.txt', './dir/b.txt'),
+            ('Bb.txt', './other/b.txt'),
+            ('Report', './report.html'),
+            ('Subc.txt', './dir/sub/c.txt'),
+            ('Text a.txt', './a.txt'),
+            ('Text b.txt', './dir/b.txt'),
+            ('Text b.txt', './other/b.txt'),
+            ('Text c.txt', './dir/sub/c.txt'),
+            ('bar package (2.1)', './pkg/bar-2.1.rpm'),
+            ('foo package (1.0)', './pkg/foo-1.0.rpm'),
+            ('report.html', './report.html'),
+        ])
+
+
 class TestGetArtifactsFromStage(steps.BuildStepMixin, TestReactorMixin,
                                 unittest.TestCase):
     def setUp(self):
@@ -188,6 +461,25 @@ class TestGetArtifactsFromStage(steps.BuildStepMixin, TestReactorMixin,
             'artifacts', artifacts_name, 'GetArtifactsFromStage')
         return self.runStep()
 
+    @defer.inlineCallbacks
+    def testNotFound(self):
+        super(TestGetArtifactsFromStage, self).setupStep(
+            GetArtifactsFromStage('pre-merge', property='artifacts',
+                                  name='GetArtifactsFromStage'))
+        self.expectCommands(
+            ExpectShell(workdir='wkdir', command=[
+                'curl', '-L', '--fail', '--silent', '--show-error', '-I',
+                'http://artifacts/last_success/:::prefix.r..pre-merge'])
+            + ExpectShell.log('stdio', stderr=(
+                'curl: (22) The requested URL returned error: '
+                '404 Not Found\n'))
+            + 22)
+        self.expectOutcome(FAILURE)
+        self.expectNoProperty('artifacts')
+        yield self.runStep()
+        self.assertIn('No artifacts found for this git commit',
+                      self.step.logs['stdio'].stderr)
+
     def testSkipSetProperty(self):
         self.setupStep(expect_command=False)
         self.properties.setProperty('artifacts', 'spam', 'Force Build Form')
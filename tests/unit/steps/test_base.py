@@ -0,0 +1,65 @@
+"""Unit tests of `eve.steps.base`."""
+
+import os
+import tempfile
+import unittest
+
+from eve.steps.base import CONFIG_CACHE, ConfigurableStepMixin
+from tests.util.yaml_factory import PreMerge
+
+
+class FakeConfigurableStep(ConfigurableStepMixin):
+    def __init__(self, conf_path):
+        self.conf_path = conf_path
+
+    def getProperty(self, name):
+        assert name == 'conf_path'
+        return self.conf_path
+
+
+class TestGetEveConfig(unittest.TestCase):
+    def setUp(self):
+        CONFIG_CACHE.clear()
+        fd, self.conf_path = tempfile.mkstemp()
+        os.close(fd)
+        PreMerge([{'ShellCommand': {'command': 'exit 0'}}]).filedump(
+            self.conf_path)
+
+    def tearDown(self):
+        os.unlink(self.conf_path)
+
+    def test_implicit_stages(self):
+        conf = FakeConfigurableStep(self.conf_path).getEveConfig()
+        self.assertIn('pre-merge', conf['stages'])
+        self.assertIn('eve-promote', conf['stages'])
+        self.assertIn('eve-prolong', conf['stages'])
+
+    def test_parsed_once(self):
+        step = FakeConfigurableStep(self.conf_path)
+        step.getEveConfig()
+        step.getEveConfig()
+        FakeConfigurableStep(self.conf_path).getEveConfig()
+        self.assertEqual(CONFIG_CACHE.misses, 1)
+        self.assertEqual(CONFIG_CACHE.hits, 2)
+        self.assertIsNotNone(step.eve_config_digest)
+
+    def test_copy_on_read(self):
+        step = FakeConfigurableStep(self.conf_path)
+        conf = step.getEveConfig()
+        conf['stages']['pre-merge']['steps'].append('garbage')
+        del conf['stages']['eve-promote']
+        conf = step.getEveConfig()
+        self.assertEqual(len(conf['stages']['pre-merge']['steps']), 1)
+        self.assertIn('eve-promote', conf['stages'])
+
+    def test_content_change(self):
+        step = FakeConfigurableStep(self.conf_path)
+        step.getEveConfig()
+        digest = step.eve_config_digest
+        PreMerge([{'ShellCommand': {'command': 'exit 1'}}]).filedump(
+            self.conf_path)
+        conf = step.getEveConfig()
+        self.assertNotEqual(step.eve_config_digest, digest)
+        self.assertEqual(
+            conf['stages']['pre-merge']['steps'][0]['ShellCommand'],
+            {'command': 'exit 1'})
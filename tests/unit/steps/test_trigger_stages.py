@@ -1,14 +1,19 @@
 """Unit tests of `eve.steps.trigger_stages`."""
 
+from buildbot.interfaces import IRenderable
 from buildbot.plugins import util
-from buildbot.process.results import SUCCESS
+from buildbot.process.properties import Interpolate
+from buildbot.process.results import EXCEPTION, FAILURE, SUCCESS, WARNINGS
 from buildbot.test.unit.test_steps_trigger import FakeTriggerable
 from buildbot.test.util import steps
 from buildbot.test.util.misc import TestReactorMixin
 from twisted.internet import defer
 from twisted.trial import unittest
+from zope.interface import implementer
 
-from eve.steps.trigger_stages import ExecuteTriggerStages, TriggerStages
+from eve.steps.trigger_stages import (ExecuteTriggerStages,
+                                      ExecuteTriggerStagesGraph, StageGraph,
+                                      TriggerStages, get_stage_dependencies)
 
 
 class FakeBuildOrder(object):
@@ -18,8 +23,36 @@ class FakeBuildOrder(object):
 
 
 class FakeSchedulerManager(object):
-    def __init__(self, scheduler):
-        self.namedServices = {scheduler: FakeTriggerable(scheduler)}
+    def __init__(self, *schedulers):
+        self.namedServices = {scheduler: FakeTriggerable(scheduler)
+                              for scheduler in schedulers}
+
+
+class RecordingTriggerable(FakeTriggerable):
+    def __init__(self, name, triggered):
+        super(RecordingTriggerable, self).__init__(name)
+        self.triggered = triggered
+
+    def trigger(self, *args, **kwargs):
+        self.triggered.append(self.name)
+        return super(RecordingTriggerable, self).trigger(*args, **kwargs)
+
+
+class FailingTriggerable(RecordingTriggerable):
+    def trigger(self, *args, **kwargs):
+        self.triggered.append(self.name)
+        return defer.fail(RuntimeError('no buildset')), defer.Deferred()
+
+
+@implementer(IRenderable)
+class CountingRenderable(object):
+    def __init__(self, value):
+        self.value = value
+        self.count = 0
+
+    def getRenderingFor(self, build):
+        self.count += 1
+        return defer.succeed(self.value)
 
 
 class TestTriggerStages(unittest.TestCase):
@@ -36,6 +69,97 @@ class TestTriggerStages(unittest.TestCase):
         self.assertEqual(ctx.stage_names, 'stage_names')
 
 
+class TestStageDependencies(unittest.TestCase):
+    STAGES = {
+        'pre-merge': {'worker': {}},
+        'build': {'worker': {}},
+        'lint': {'worker': {}},
+        'test': {'worker': {}, 'depends_on': 'build'},
+        'deploy': {'worker': {}, 'depends_on': ['test', 'lint']},
+    }
+
+    def test_no_dependencies(self):
+        self.assertEqual(
+            get_stage_dependencies(self.STAGES, ['build', 'lint']),
+            {'build': [], 'lint': []})
+
+    def test_transitive_dependencies(self):
+        dependencies = get_stage_dependencies(self.STAGES, ['deploy'])
+        self.assertEqual(dependencies, {
+            'deploy': ['test', 'lint'],
+            'test': ['build'],
+            'lint': [],
+            'build': [],
+        })
+        self.assertEqual(list(dependencies)[0], 'deploy')
+
+    def test_unknown_dependency(self):
+        stages = {'test': {'worker': {}, 'depends_on': ['nope']}}
+        self.assertRaises(ValueError, get_stage_dependencies, stages, ['test'])
+
+
+class TestStageGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = StageGraph({
+            'build': [],
+            'lint': [],
+            'test': ['build'],
+            'package': ['build'],
+            'deploy': ['test', 'lint'],
+        })
+
+    def test_cycle(self):
+        with self.assertRaises(ValueError) as context:
+            StageGraph({'a': ['c'], 'b': ['a'], 'c': ['b'], 'd': []})
+        self.assertIn('a, b, c', str(context.exception))
+
+    def test_unknown_stage(self):
+        self.assertRaises(ValueError, StageGraph, {'a': ['b']})
+
+    def test_ready(self):
+        graph = self.graph
+        self.assertEqual(graph.ready(), ['build', 'lint'])
+        graph.start('build', 0)
+        graph.start('lint', 0)
+        self.assertEqual(graph.ready(), [])
+        graph.finish('build', WARNINGS, 10)
+        self.assertEqual(graph.ready(), ['test', 'package'])
+        graph.start('test', 10)
+        graph.start('package', 10)
+        graph.finish('test', SUCCESS, 30)
+        self.assertEqual(graph.ready(), [])
+        graph.finish('lint', SUCCESS, 40)
+        self.assertEqual(graph.ready(), ['deploy'])
+        graph.start('deploy', 40)
+        graph.finish('package', SUCCESS, 45)
+        self.assertFalse(graph.is_complete())
+        graph.finish('deploy', SUCCESS, 50)
+        self.assertTrue(graph.is_complete())
+        self.assertEqual(graph.cancelled, [])
+        self.assertEqual(graph.critical_path(), ['lint', 'deploy'])
+
+    def test_failure_cancels_dependents(self):
+        graph = self.graph
+        graph.start('build', 0)
+        graph.start('lint', 0)
+        self.assertEqual(graph.finish('build', FAILURE, 10),
+                         ['test', 'package', 'deploy'])
+        self.assertEqual(graph.ready(), [])
+        self.assertFalse(graph.is_complete())
+        self.assertEqual(graph.finish('lint', SUCCESS, 20), [])
+        self.assertTrue(graph.is_complete())
+        self.assertEqual(graph.critical_path(), ['lint'])
+
+    def test_cancel_pending(self):
+        graph = self.graph
+        graph.start('build', 0)
+        self.assertEqual(graph.cancel_pending(),
+                         ['lint', 'test', 'package', 'deploy'])
+        graph.finish('build', SUCCESS, 10)
+        self.assertEqual(graph.ready(), [])
+        self.assertTrue(graph.is_complete())
+
+
 class TestExecuteTriggerStages(steps.BuildStepMixin, TestReactorMixin,
                                unittest.TestCase):
     def setUp(self):
@@ -45,14 +169,15 @@ class TestExecuteTriggerStages(steps.BuildStepMixin, TestReactorMixin,
     def tearDown(self):
         return self.tearDownBuildStep()
 
-    def setupStep(self, scheduler='foo', properties=None):
+    def setupStep(self, scheduler='foo', properties=None, build_orders=None):
         properties = properties or {}
-        self.scheduler = scheduler
+        build_orders = build_orders or [FakeBuildOrder(scheduler, properties)]
         self.exp_trigger = {}
         super(TestExecuteTriggerStages, self).setupStep(
-            ExecuteTriggerStages([FakeBuildOrder(scheduler, properties)]))
+            ExecuteTriggerStages(build_orders))
 
-        self.master.scheduler_manager = FakeSchedulerManager(self.scheduler)
+        self.master.scheduler_manager = FakeSchedulerManager(
+            *[build_order.scheduler for build_order in build_orders])
 
     @defer.inlineCallbacks
     def runStep(self):
@@ -79,3 +204,107 @@ class TestExecuteTriggerStages(steps.BuildStepMixin, TestReactorMixin,
         self.expectTriggeredWith(properties={'stage_name': ('because', 'here'),
                                              'x': (1, 'there')})
         return self.runStep()
+
+    @defer.inlineCallbacks
+    def test_render_build_orders(self):
+        image = CountingRenderable('registry/image:1234')
+        self.setupStep(build_orders=[
+            FakeBuildOrder('foo', {
+                'stage_name': ('foo', 'here'),
+                'image': (image, 'there'),
+                'images': ({'worker': image}, 'there'),
+            }),
+            FakeBuildOrder('bar', {
+                'stage_name': ('bar', 'here'),
+                'images': ([image, 'literal'], 'there'),
+                'reason': (Interpolate('%(prop:reason)s!'), 'there'),
+            }),
+        ])
+        self.properties.setProperty('reason', 'because', 'test')
+        self.expectOutcome(result=SUCCESS,
+                           state_string='triggered foo, bar')
+        self.expectTriggeredWith(scheduler='foo', properties={
+            'stage_name': ('foo', 'here'),
+            'image': ('registry/image:1234', 'there'),
+            'images': ({'worker': 'registry/image:1234'}, 'there'),
+        })
+        self.expectTriggeredWith(scheduler='bar', properties={
+            'stage_name': ('bar', 'here'),
+            'images': (['registry/image:1234', 'literal'], 'there'),
+            'reason': ('because!', 'there'),
+        })
+        yield self.runStep()
+        self.assertEqual(image.count, 1)
+
+
+class TestExecuteTriggerStagesGraph(steps.BuildStepMixin, TestReactorMixin,
+                                    unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        return self.tearDownBuildStep()
+
+    def setupStep(self, dependencies, results=None, failing=()):
+        results = results or {}
+        self.triggered = []
+        build_orders = [FakeBuildOrder(stage, {'stage_name': (stage, 'here')})
+                        for stage in dependencies]
+        super(TestExecuteTriggerStagesGraph, self).setupStep(
+            ExecuteTriggerStagesGraph(build_orders, dependencies))
+
+        self.master.scheduler_manager = FakeSchedulerManager()
+        for stage in dependencies:
+            triggerable = (FailingTriggerable if stage in failing
+                           else RecordingTriggerable)
+            sched = triggerable(stage, self.triggered)
+            sched.result = results.get(stage, SUCCESS)
+            self.master.scheduler_manager.namedServices[stage] = sched
+
+    @defer.inlineCallbacks
+    def test_dependency_order(self):
+        self.setupStep({
+            'deploy': ['test', 'lint'],
+            'test': ['build'],
+            'lint': [],
+            'build': [],
+        })
+        self.expectOutcome(
+            result=SUCCESS,
+            state_string='triggered lint, build, test, deploy')
+        self.expectLogfile(
+            'critical path',
+            'critical path (0s):\n'
+            '  build: 0s (success)\n'
+            '  test: 0s (success)\n'
+            '  deploy: 0s (success)\n')
+        yield self.runStep()
+        self.assertEqual(self.triggered, ['lint', 'build', 'test', 'deploy'])
+
+    @defer.inlineCallbacks
+    def test_failure_cancels_downstream(self):
+        self.setupStep({
+            'deploy': ['test'],
+            'test': ['build'],
+            'build': [],
+            'lint': [],
+        }, results={'build': FAILURE, 'lint': WARNINGS})
+        self.expectOutcome(
+            result=FAILURE,
+            state_string='triggered build, lint (cancelled test, deploy)')
+        yield self.runStep()
+        self.assertEqual(self.triggered, ['build', 'lint'])
+
+    @defer.inlineCallbacks
+    def test_trigger_failure(self):
+        self.setupStep({
+            'deploy': ['test'],
+            'test': ['build'],
+            'build': [],
+        }, failing=('build',))
+        self.expectOutcome(
+            result=EXCEPTION,
+            state_string='triggered build (cancelled test, deploy)')
+        yield self.runStep()
+        self.assertEqual(self.triggered, ['build'])
@@ -0,0 +1,69 @@
+"""Unit test of `eve.util.branch_matcher`."""
+
+import unittest
+from fnmatch import fnmatch
+
+from eve.util.branch_matcher import (BranchMatcher, expand_branches,
+                                     get_branch_matcher)
+
+
+def linear_match(branches, branch):
+    for pattern, conf in branches.items():
+        if fnmatch(branch, pattern):
+            return pattern, conf
+    return None
+
+
+class TestExpandBranches(unittest.TestCase):
+    def test_expand(self):
+        branches = expand_branches({
+            'feature/*, bugfix/*': {'stage': 'pre-merge'},
+            'default': {'stage': 'post-merge'},
+        })
+        self.assertEqual(list(branches.keys()),
+                         ['feature/*', 'bugfix/*', 'default'])
+        self.assertEqual(branches['bugfix/*'], {'stage': 'pre-merge'})
+
+
+class TestBranchMatcher(unittest.TestCase):
+    branches = expand_branches({
+        'user/*': {'stage': 'user'},
+        'development/1.0': {'stage': 'dev-1.0'},
+        'development/*': {'stage': 'dev'},
+        'q/[0-9]*': {'stage': 'queue'},
+        'hotfix/?.?': {'stage': 'hotfix'},
+        'w/*, development/1.0': {'stage': 'never'},
+        'default': {'stage': 'post-merge'},
+    })
+
+    def test_first_match_wins(self):
+        matcher = BranchMatcher(self.branches)
+        for branch in ('user/foo', 'development/1.0', 'development/2.0',
+                       'q/1', 'q/x', 'hotfix/1.2', 'hotfix/1.20', 'w/foo',
+                       'default', 'nothing', ''):
+            self.assertEqual(matcher.match(branch),
+                             linear_match(self.branches, branch), branch)
+
+    def test_literal_after_wildcard(self):
+        matcher = BranchMatcher(expand_branches({
+            'feature/*': {'stage': 'wildcard'},
+            'feature/foo': {'stage': 'literal'},
+        }))
+        self.assertEqual(matcher.match('feature/foo')[1],
+                         {'stage': 'wildcard'})
+
+    def test_shared_prefixes(self):
+        branches = {'p%d/*' % i: {'stage': i} for i in range(20)}
+        branches['p1*'] = {'stage': 'short prefix'}
+        branches['p12/x'] = {'stage': 'literal'}
+        branches['*'] = {'stage': 'catch-all'}
+        matcher = BranchMatcher(branches)
+        for branch in ('p0/a', 'p7/a', 'p12/x', 'p19/', 'p1', 'p100/a',
+                       'other', ''):
+            self.assertEqual(matcher.match(branch),
+                             linear_match(branches, branch), branch)
+
+    def test_cached_per_digest(self):
+        first = get_branch_matcher('digest', self.branches)
+        self.assertIs(get_branch_matcher('digest', {}), first)
+        self.assertIsNot(get_branch_matcher('other', self.branches), first)
@@ -0,0 +1,98 @@
+"""Unit test of `eve.util.cache`."""
+
+import os
+import shutil
+import unittest
+from copy import deepcopy
+from tempfile import mkdtemp
+
+from eve.util.cache import FileCache, LRUCache, content_hash
+
+
+class TestContentHash(unittest.TestCase):
+    def test_str_and_bytes(self):
+        self.assertEqual(content_hash('foo'), content_hash(b'foo'))
+        self.assertNotEqual(content_hash('foo'), content_hash('bar'))
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = LRUCache(max_entries=2)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 1, 'size': 1, 'max_entries': 2})
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_eviction(self):
+        cache = LRUCache(max_entries=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)  # 'b' is now the least recently used
+        cache.get('c', lambda: 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_copy_on_read(self):
+        cache = LRUCache(copy=deepcopy)
+        value = cache.get('a', lambda: {'stages': {'foo': []}})
+        value['stages']['foo'].append('bar')
+        self.assertEqual(cache.get('a', lambda: None),
+                         {'stages': {'foo': []}})
+
+    def test_compute_error_is_not_cached(self):
+        cache = LRUCache()
+
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            cache.get('a', fail)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.get('a', lambda: 1)
+        cache.clear()
+        self.assertEqual(cache.stats(), {
+            'hits': 0, 'misses': 0, 'size': 0, 'max_entries': 64})
+        self.assertIsNone(cache.hit_rate)
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'file')
+        self.write('foo')
+        self.loads = []
+
+    def write(self, contents, mtime=1000):
+        with open(self.path, 'w') as file_:
+            file_.write(contents)
+        os.utime(self.path, (mtime, mtime))
+
+    def load(self, path):
+        self.loads.append(path)
+        with open(path) as file_:
+            return file_.read().upper()
+
+    def test_reload_on_change(self):
+        cache = FileCache()
+        self.assertEqual(cache.get(self.path, self.load), 'FOO')
+        self.assertEqual(cache.get(self.path, self.load), 'FOO')
+        self.assertEqual(len(self.loads), 1)
+
+        self.write('bar', mtime=1001)
+        self.assertEqual(cache.get(self.path, self.load), 'BAR')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'size': 1})
+
+    def test_missing_file(self):
+        cache = FileCache()
+        os.remove(self.path)
+        with self.assertRaises(OSError):
+            cache.get(self.path, self.load)
+        self.assertEqual((len(cache), self.loads), (0, []))
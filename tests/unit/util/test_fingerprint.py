@@ -0,0 +1,99 @@
+"""Unit tests of `eve.util.fingerprint`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from eve.util.fingerprint import ContextFingerprinter
+
+
+class TestContextFingerprinter(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.index_path = os.path.join(self.workdir, 'index.json')
+        self.write('context/Dockerfile', 'FROM ubuntu\n')
+        self.write('context/files/a', 'a' * 10)
+        self.write('context/files/b', 'b' * 20)
+        os.symlink('files/a', os.path.join(self.workdir, 'context/link'))
+        # make the files older than the racy delay
+        self.age('context/Dockerfile', 'context/files/a', 'context/files/b')
+
+    def write(self, path, content):
+        path = os.path.join(self.workdir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file_:
+            file_.write(content)
+
+    def age(self, *paths, when=1000):
+        for path in paths:
+            os.utime(os.path.join(self.workdir, path), (when, when))
+
+    def fingerprint(self, fingerprinter=None, paths=('context',)):
+        if fingerprinter is None:
+            fingerprinter = ContextFingerprinter(self.index_path)
+        return fingerprinter.fingerprint(self.workdir, list(paths))
+
+    def test_incremental(self):
+        fingerprinter = ContextFingerprinter(self.index_path)
+        first, stats = self.fingerprint(fingerprinter)
+        self.assertEqual(len(first), 64)
+        self.assertEqual(stats['files'], 3)
+        self.assertEqual(stats['hashed_files'], 3)
+        self.assertEqual(stats['hashed_bytes'], 42)
+
+        second, stats = self.fingerprint(fingerprinter)
+        self.assertEqual(second, first)
+        self.assertEqual(stats['hashed_files'], 0)
+
+        # the index is persistent
+        third, stats = self.fingerprint()
+        self.assertEqual(third, first)
+        self.assertEqual(stats['hashed_files'], 0)
+        self.assertEqual(fingerprinter.totals['fingerprints'], 2)
+        self.assertEqual(fingerprinter.totals['hashed_files'], 3)
+
+    def test_changes(self):
+        reference, _ = self.fingerprint()
+
+        self.write('context/files/a', 'A' * 10)
+        self.age('context/files/a', when=2000)
+        changed, stats = self.fingerprint()
+        self.assertNotEqual(changed, reference)
+        self.assertEqual(stats['hashed_files'], 1)
+
+        self.write('context/files/a', 'a' * 10)
+        self.age('context/files/a', when=3000)
+        restored, _ = self.fingerprint()
+        self.assertEqual(restored, reference)
+
+        os.rename(os.path.join(self.workdir, 'context/files/b'),
+                  os.path.join(self.workdir, 'context/files/c'))
+        renamed, _ = self.fingerprint()
+        self.assertNotEqual(renamed, reference)
+
+    def test_recently_modified_files(self):
+        self.write('context/new', 'new')
+        _, stats = self.fingerprint()
+        self.assertEqual(stats['hashed_files'], 4)
+        _, stats = self.fingerprint()
+        self.assertEqual(stats['hashed_files'], 1)
+
+    def test_mode_is_ignored(self):
+        reference, _ = self.fingerprint(ContextFingerprinter())
+        os.chmod(os.path.join(self.workdir, 'context/files/a'), 0o700)
+        self.assertEqual(
+            self.fingerprint(ContextFingerprinter())[0], reference)
+
+    def test_paths(self):
+        context, _ = self.fingerprint(paths=['context'])
+        both, _ = self.fingerprint(paths=['context', 'context/Dockerfile'])
+        self.assertNotEqual(context, both)
+        self.assertRaises(OSError, self.fingerprint, paths=['missing'])
+
+    def test_corrupted_index(self):
+        with open(self.index_path, 'w') as index_file:
+            index_file.write('{')
+        _, stats = self.fingerprint()
+        self.assertEqual(stats['hashed_files'], 3)
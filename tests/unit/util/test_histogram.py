@@ -0,0 +1,21 @@
+"""Unit tests of `eve.util.histogram`."""
+
+import unittest
+
+from eve.util.histogram import LatencyHistogram
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = LatencyHistogram(buckets=(0.1, 1, 10))
+        self.assertIsNone(histogram.percentile(50))
+        self.assertEqual(histogram.summary(), 'no call')
+        for duration in (0.05, 0.05, 0.5, 0.7, 20):
+            histogram.observe(duration)
+        self.assertEqual(histogram.counts, [2, 2, 0, 1])
+        self.assertEqual(histogram.percentile(40), 0.1)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(95), 20)
+        self.assertEqual(
+            histogram.summary(),
+            'count=5 mean=4.260s p50<=1s p95<=20s max=20.000s')
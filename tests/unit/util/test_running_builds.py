@@ -0,0 +1,152 @@
+"""Unit tests of `eve.util.running_builds`."""
+
+from buildbot.test.fake import fakemaster
+from buildbot.test.util.misc import TestReactorMixin
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.util.running_builds import (RunningBuilds, RunningBuildsReconciler,
+                                     get_running_builds)
+
+
+class FakeBuildsDB(object):
+    def __init__(self):
+        self.builds = []
+        self.queries = 0
+        self.pending = None
+
+    def getBuilds(self, builderid, complete):
+        assert complete is False
+        self.queries += 1
+        builds = [{'id': buildid, 'builderid': bid}
+                  for bid, buildid in self.builds
+                  if builderid is None or bid == builderid]
+        if self.pending is not None:
+            self.pending.addCallback(lambda _: builds)
+            return self.pending
+        return defer.succeed(builds)
+
+
+class TestRunningBuilds(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        self.master = fakemaster.make_master(self, wantMq=True)
+        self.master.mq.verifyMessages = False
+        self.master.db.builds = FakeBuildsDB()
+        self.running_builds = RunningBuilds(self.master,
+                                            reconcile_interval=60)
+
+    def send(self, event, builderid, buildid):
+        self.master.mq.callConsumer(
+            ('builds', str(buildid), event),
+            {'builderid': builderid, 'buildid': buildid})
+
+    @defer.inlineCallbacks
+    def test_count_follows_messages(self):
+        self.master.db.builds.builds = [(1, 10), (1, 11), (2, 20)]
+        count = yield self.running_builds.count(1)
+        self.assertEqual(count, 2)
+
+        self.send('new', 1, 12)
+        self.send('new', 2, 21)
+        self.send('finished', 1, 10)
+        count = yield self.running_builds.count(1)
+        self.assertEqual(count, 2)
+        self.assertEqual(self.master.db.builds.queries, 1)
+
+        count = yield self.running_builds.count(2)
+        self.assertEqual(count, 1)
+        self.assertEqual(self.master.db.builds.queries, 2)
+
+    @defer.inlineCallbacks
+    def test_reconcile_periodically(self):
+        self.master.db.builds.builds = [(1, 10)]
+        count = yield self.running_builds.count(1)
+        self.assertEqual(count, 1)
+
+        # a message was missed
+        self.master.db.builds.builds = [(1, 10), (1, 11)]
+        self.reactor.advance(59)
+        count = yield self.running_builds.count(1)
+        self.assertEqual(count, 1)
+        self.reactor.advance(1)
+        count = yield self.running_builds.count(1)
+        self.assertEqual(count, 2)
+        self.assertEqual(self.master.db.builds.queries, 2)
+
+    @defer.inlineCallbacks
+    def test_messages_during_reconcile(self):
+        yield self.running_builds.start()
+        self.master.db.builds.builds = [(1, 10), (1, 11)]
+        self.master.db.builds.pending = defer.Deferred()
+        d = self.running_builds.count(1)
+        self.send('finished', 1, 10)
+        self.send('new', 1, 12)
+        self.master.db.builds.pending.callback(None)
+        count = yield d
+        self.assertEqual(count, 2)
+
+    @defer.inlineCallbacks
+    def test_reconcile_all(self):
+        self.master.db.builds.builds = [(1, 10), (1, 11)]
+        self.assertEqual((yield self.running_builds.count(1)), 2)
+        self.assertEqual((yield self.running_builds.count(2)), 0)
+
+        self.master.db.builds.builds = [(1, 10), (2, 20), (3, 30)]
+        self.master.db.builds.pending = defer.Deferred()
+        d = self.running_builds.reconcile()
+        self.send('new', 2, 21)
+        self.master.db.builds.pending.callback(None)
+        yield d
+        self.assertEqual(self.master.db.builds.queries, 3)
+        self.assertEqual((yield self.running_builds.count(1)), 1)
+        self.assertEqual((yield self.running_builds.count(2)), 2)
+        self.assertEqual((yield self.running_builds.count(3)), 1)
+        self.assertEqual(self.master.db.builds.queries, 3)
+
+    @defer.inlineCallbacks
+    def test_reconciler(self):
+        self.master.db.builds.builds = [(1, 10), (2, 20)]
+        running_builds = get_running_builds(self.master)
+        reconciler = RunningBuildsReconciler(interval=60)
+        yield reconciler.setServiceParent(self.master)
+        yield reconciler.startService()
+        self.addCleanup(reconciler.stopService)
+        # all the builders are loaded when the master starts
+        self.assertEqual(self.master.db.builds.queries, 1)
+        self.assertEqual(running_builds.reconcile_interval, 60)
+        self.assertEqual((yield running_builds.count(1)), 1)
+        self.assertEqual((yield running_builds.count(2)), 1)
+
+        # then periodically
+        self.master.db.builds.builds = [(1, 10), (1, 11)]
+        self.reactor.advance(60)
+        self.assertEqual(self.master.db.builds.queries, 2)
+        self.assertEqual((yield running_builds.count(1)), 2)
+        self.assertEqual((yield running_builds.count(2)), 0)
+        self.assertEqual(self.master.db.builds.queries, 2)
+
+    @defer.inlineCallbacks
+    def test_reconciler_stop(self):
+        reconciler = RunningBuildsReconciler(interval=60)
+        yield reconciler.setServiceParent(self.master)
+        yield reconciler.startService()
+        self.assertEqual(len(self.master.mq.qrefs), 2)
+        yield reconciler.stopService()
+        self.assertEqual(self.master.mq.qrefs, [])
+
+        # a new service consumes the messages again
+        yield reconciler.startService()
+        self.addCleanup(reconciler.stopService)
+        self.assertEqual(len(self.master.mq.qrefs), 2)
+
+    @defer.inlineCallbacks
+    def test_stop(self):
+        yield self.running_builds.start()
+        self.running_builds.stop()
+        self.assertEqual(self.master.mq.qrefs, [])
+
+    def test_get_running_builds(self):
+        running_builds = get_running_builds(self.master, 10)
+        self.assertIs(get_running_builds(self.master, 10), running_builds)
+        self.assertEqual(running_builds.reconcile_interval, 10)
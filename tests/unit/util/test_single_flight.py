@@ -0,0 +1,85 @@
+"""Unit tests of `eve.util.single_flight`."""
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.util.single_flight import SingleFlight
+
+
+class Operation(object):
+    def __init__(self, name, running):
+        self.name = name
+        self.running = running
+        self.calls = 0
+        self.deferred = None
+
+    def __call__(self):
+        self.calls += 1
+        self.running.append(self.name)
+        self.deferred = defer.Deferred()
+        self.deferred.addBoth(self.done)
+        return self.deferred
+
+    def done(self, result):
+        self.running.remove(self.name)
+        return result
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.running = []
+        self.flight = SingleFlight(max_concurrent=2)
+
+    def test_coalesce(self):
+        build = Operation('build', self.running)
+        first = self.flight.run(('build', 'a'), build, lock_key='a')
+        second = self.flight.run(('build', 'a'), build, lock_key='a')
+        self.assertEqual(build.calls, 1)
+        self.assertEqual(len(self.flight), 1)
+
+        build.deferred.callback(0)
+        self.assertEqual(self.successResultOf(first), (0, False))
+        self.assertEqual(self.successResultOf(second), (0, True))
+        self.assertEqual(len(self.flight), 0)
+
+        # the operation runs again once the previous one is over
+        third = self.flight.run(('build', 'a'), build, lock_key='a')
+        self.assertEqual(build.calls, 2)
+        build.deferred.callback(2)
+        self.assertEqual(self.successResultOf(third), (2, False))
+
+    def test_failure(self):
+        build = Operation('build', self.running)
+        first = self.flight.run('build', build)
+        second = self.flight.run('build', build)
+        build.deferred.errback(RuntimeError('oops'))
+        self.failureResultOf(first, RuntimeError)
+        self.failureResultOf(second, RuntimeError)
+        self.assertEqual(len(self.flight), 0)
+
+    def test_lock_key(self):
+        build = Operation('build', self.running)
+        push = Operation('push', self.running)
+        other = Operation('other', self.running)
+        d_build = self.flight.run(('build', 'a'), build, lock_key='a')
+        d_push = self.flight.run(('push', 'a'), push, lock_key='a')
+        d_other = self.flight.run(('build', 'b'), other, lock_key='b')
+        self.assertEqual(self.running, ['build', 'other'])
+
+        build.deferred.callback(0)
+        self.assertEqual(self.running, ['other', 'push'])
+        push.deferred.callback(0)
+        other.deferred.callback(0)
+        for d in (d_build, d_push, d_other):
+            self.assertEqual(self.successResultOf(d), (0, False))
+        self.assertEqual(self.flight._locks, {})
+
+    def test_max_concurrent(self):
+        operations = [Operation(name, self.running)
+                      for name in ('a', 'b', 'c')]
+        for operation in operations:
+            self.flight.run(operation.name, operation,
+                            lock_key=operation.name)
+        self.assertEqual(self.running, ['a', 'b'])
+        operations[1].deferred.callback(0)
+        self.assertEqual(self.running, ['a', 'c'])
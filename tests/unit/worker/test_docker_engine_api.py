@@ -0,0 +1,142 @@
+"""Unit tests of `eve.worker.docker.engine_api`."""
+
+import unittest
+from http.client import RemoteDisconnected
+
+from buildbot.interfaces import LatentWorkerCannotSubstantiate
+
+from eve.worker.docker.docker_worker import EveDockerLatentWorker
+from eve.worker.docker.engine_api import (DEFAULT_SOCKET_PATH,
+                                          DockerEngineClient,
+                                          DockerEngineError,
+                                          socket_path_from_docker_host)
+from tests.util.fake_docker_daemon import FakeDockerDaemon
+
+
+class TestDockerEngineClient(unittest.TestCase):
+    def setUp(self):
+        self.daemon = FakeDockerDaemon().start()
+        self.addCleanup(self.daemon.stop)
+        self.daemon.add_image('registry/worker:1234')
+        self.client = DockerEngineClient(self.daemon.socket_path,
+                                         api_version='1.40')
+        self.addCleanup(self.client.close)
+
+    def test_socket_path_from_docker_host(self):
+        self.assertEqual(socket_path_from_docker_host(''),
+                         DEFAULT_SOCKET_PATH)
+        self.assertEqual(socket_path_from_docker_host('unix:///a/b.sock'),
+                         '/a/b.sock')
+        self.assertIsNone(socket_path_from_docker_host('tcp://docker:2376'))
+
+    def test_keep_alive(self):
+        for _ in range(5):
+            self.assertTrue(self.client.image_exists('registry/worker:1234'))
+        self.assertFalse(self.client.image_exists('registry/worker:4321'))
+        self.assertEqual(self.client.connections_opened, 1)
+        self.assertEqual(self.daemon.connections, 1)
+
+    def test_reconnect(self):
+        self.client.image_exists('registry/worker:1234')
+        # the daemon closed the idle connection
+        self.client._pool.queue[0].sock.close()
+        self.assertTrue(self.client.image_exists('registry/worker:1234'))
+        self.assertEqual(self.client.connections_opened, 2)
+
+    def lose_response(self):
+        """Lose the response to the next request on the idle connection."""
+        connection = self.client._pool.queue[0]
+        getresponse = connection.getresponse
+
+        def lost():
+            # the daemon handled the request
+            getresponse().read()
+            raise RemoteDisconnected('closed without response')
+        connection.getresponse = lost
+
+    def test_unanswered_requests(self):
+        self.client.image_exists('registry/worker:1234')
+
+        # an idempotent request is sent again
+        self.lose_response()
+        self.assertTrue(self.client.image_exists('registry/worker:1234'))
+        self.assertEqual(self.client.connections_opened, 2)
+
+        # the creation of the container is not sent again
+        self.lose_response()
+        with self.assertRaises(RemoteDisconnected):
+            self.client.run_container('worker', 'registry/worker:1234')
+        self.assertEqual(self.daemon.requests.count(
+            ('POST', '/containers/create')), 1)
+        self.assertEqual(len(self.daemon.containers), 1)
+
+    def test_run_and_remove(self):
+        container_id = self.client.run_container(
+            'worker', 'registry/worker:1234',
+            env={'WORKERNAME': 'dw000'}, labels={'buildnumber': '12'},
+            memory=1024, cpus='0.5', binds=['/a:/b'], privileged=True)
+        container = self.daemon.containers[container_id]
+        self.assertEqual(container['State'], 'running')
+        self.assertEqual(container['Env'], ['WORKERNAME=dw000'])
+        self.assertEqual(container['HostConfig'], {
+            'Privileged': True,
+            'Binds': ['/a:/b'],
+            'Memory': 1024,
+            'NanoCpus': 500000000,
+        })
+        self.assertEqual(self.daemon.requests, [
+            ('POST', '/containers/create'),
+            ('POST', '/containers/%s/start' % container_id),
+        ])
+
+        with self.assertRaises(DockerEngineError) as context:
+            self.client.run_container('worker', 'registry/worker:1234')
+        self.assertEqual(context.exception.status, 409)
+
+        self.assertTrue(self.client.remove_container('worker'))
+        self.assertFalse(self.client.remove_container('worker'))
+        self.assertEqual(self.daemon.containers, {})
+
+    def test_missing_image(self):
+        with self.assertRaises(DockerEngineError) as context:
+            self.client.run_container('worker', 'registry/worker:4321')
+        self.assertEqual(context.exception.status, 404)
+
+
+class TestEveDockerLatentWorkerEngine(unittest.TestCase):
+    def setUp(self):
+        self.daemon = FakeDockerDaemon().start()
+        self.addCleanup(self.daemon.stop)
+        self.daemon.add_image('worker:1')
+        self.worker = EveDockerLatentWorker(
+            'dw000', 'pass', image='worker:1', master_fqdn='master',
+            pb_port=9999, max_memory='1G', max_cpus='1',
+            engine=DockerEngineClient(self.daemon.socket_path))
+        self.worker.instance = 'eve-worker-1'
+
+    def test_start_and_stop(self):
+        self.assertEqual(
+            self.worker._thd_start_instance('worker:1', '512M', ['/a:/b'],
+                                            12, 'v1'),
+            ['eve-worker-1', 'worker:1'])
+        container, = self.daemon.containers.values()
+        self.assertEqual(container['Name'], 'eve-worker-1')
+        self.assertEqual(container['Labels'],
+                         {'buildnumber': '12', 'docker_hook': 'v1'})
+        self.assertEqual(container['HostConfig']['Memory'], 512 * 1024 ** 2)
+        self.assertIn('WORKERPASS=pass', container['Env'])
+
+        self.worker._thd_stop_instance('eve-worker-1')
+        self.assertEqual(self.daemon.containers, {})
+        self.assertEqual(len(self.daemon.requests), 3)
+
+    def test_image_not_found(self):
+        self.assertRaises(LatentWorkerCannotSubstantiate,
+                          self.worker._thd_start_instance,
+                          'worker:2', None, [], 12, None)
+
+    def test_memory_limit(self):
+        self.assertRaises(LatentWorkerCannotSubstantiate,
+                          self.worker._thd_start_instance,
+                          'worker:1', '2G', [], 12, None)
+        self.assertEqual(self.daemon.requests, [])
@@ -0,0 +1,210 @@
+"""Unit tests of `eve.worker.docker.warm_pool`."""
+
+from buildbot.process.properties import Properties, Property
+from buildbot.test.fake import fakemaster
+from buildbot.test.util.misc import TestReactorMixin
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.setup.builders import nextWorker
+from eve.worker.docker.docker_worker import EveDockerLatentWorker
+from eve.worker.docker.warm_pool import DockerWarmPool, image_repository
+
+
+class FakeWorker(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class TestDockerWarmPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = DockerWarmPool(max_idle_per_image=2, ttl=60, window=100)
+
+    def test_image_repository(self):
+        self.assertEqual(image_repository('worker:1'), 'worker')
+        self.assertEqual(image_repository('registry:5000/worker:1'),
+                         'registry:5000/worker')
+        self.assertEqual(image_repository('registry:5000/worker'),
+                         'registry:5000/worker')
+
+    def test_keep_follows_demand(self):
+        worker1, worker2, worker3 = (FakeWorker('dw%d' % i) for i in range(3))
+        self.pool.record_start(worker1, 'worker:1', 0, warm=False)
+        self.assertTrue(self.pool.keep(worker1, 'worker:1', 10))
+        # a single build during the window: a single idle worker
+        self.assertFalse(self.pool.keep(worker2, 'worker:1', 10))
+
+        self.pool.record_start(worker2, 'worker:1', 20, warm=False)
+        self.pool.record_start(worker3, 'worker:1', 20, warm=False)
+        self.assertTrue(self.pool.keep(worker2, 'worker:1', 30))
+        self.assertFalse(self.pool.keep(worker3, 'worker:1', 30))
+        self.assertEqual(self.pool.idle('worker:1'), ['dw0', 'dw1'])
+
+        # the builds are out of the window
+        self.pool.release(worker1)
+        self.assertFalse(self.pool.keep(worker1, 'worker:1', 130))
+        self.assertEqual(self.pool.idle('worker:1'), ['dw1'])
+
+    def test_warm_start(self):
+        worker = FakeWorker('dw0')
+        self.pool.record_start(worker, 'worker:1', 0, warm=False)
+        self.pool.keep(worker, 'worker:1', 10)
+        self.pool.record_start(worker, 'worker:1', 20, warm=True)
+        self.assertEqual(self.pool.idle('worker:1'), [])
+        self.assertEqual(self.pool.stats(),
+                         {'hits': 1, 'misses': 1, 'idle': 0})
+
+    def test_retire_previous_tags(self):
+        worker1, worker2 = FakeWorker('dw0'), FakeWorker('dw1')
+        self.pool.record_start(worker1, 'worker:1', 0, warm=False)
+        self.pool.keep(worker1, 'worker:1', 10)
+        self.assertEqual(
+            self.pool.record_start(worker2, 'other:2', 20, warm=False), [])
+        self.assertEqual(
+            self.pool.record_start(worker2, 'worker:2', 20, warm=False),
+            [worker1])
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_evict(self):
+        worker1, worker2, worker3 = (FakeWorker('dw%d' % i) for i in range(3))
+        for worker, image in ((worker1, 'a:1'), (worker2, 'b:1')):
+            self.pool.record_start(worker, image, 0, warm=False)
+        self.pool.keep(worker2, 'b:1', 10)
+        self.pool.keep(worker1, 'a:1', 20)
+        self.assertIsNone(self.pool.evict([worker3]))
+
+        # the worker idle for the longest time is stopped, once
+        self.assertIs(self.pool.evict([worker1, worker2]), worker2)
+        self.assertEqual(self.pool.idle('b:1'), [])
+        self.assertIsNone(self.pool.evict([worker1, worker2]))
+        self.pool.release(worker2)
+        self.assertIs(self.pool.evict([worker1, worker2]), worker1)
+
+
+class FakeWorkerForBuilder(object):
+    def __init__(self, worker):
+        self.worker = worker
+
+    def isBusy(self):
+        return False
+
+
+class FakeBuildRequest(object):
+    def __init__(self, properties):
+        self.properties = properties
+
+
+class TestEveDockerLatentWorkerWarmPool(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        self.master = fakemaster.make_master(self)
+        self.pool = DockerWarmPool(max_idle_per_image=1, ttl=60, window=100)
+        self.worker = EveDockerLatentWorker(
+            'dw000', 'pass', image=Property('docker_image'),
+            master_fqdn='master', pb_port=9999, max_memory='1G',
+            max_cpus='1', warm_pool=self.pool)
+        self.worker.parent = self.master
+        self.worker.build_wait_timeout = \
+            self.worker._config_kwargs['build_wait_timeout']
+        self.disconnects = 0
+        self.worker._soft_disconnect = self.soft_disconnect
+        self.wfb = FakeWorkerForBuilder(self.worker)
+
+    def soft_disconnect(self):
+        self.disconnects += 1
+
+    def props(self, image='worker:1', memory='1G'):
+        props = Properties()
+        props.setProperty('docker_image', image, 'test')
+        props.setProperty('docker_memory', memory, 'test')
+        props.setProperty('docker_volumes', ['/a:/b'], 'test')
+        return props
+
+    @defer.inlineCallbacks
+    def test_compatibility(self):
+        self.assertTrue(self.worker.builds_may_be_incompatible)
+        self.assertEqual(self.worker.build_wait_timeout, 60)
+        compatible = yield self.worker.isCompatibleWithBuild(self.props())
+        self.assertTrue(compatible)
+
+        self.worker.container_spec = yield self.worker.render_container_spec(
+            self.props())
+        self.assertEqual(self.worker.container_spec,
+                         ('worker:1', '1G', ('/a:/b',), None))
+        compatible = yield self.worker.isCompatibleWithBuild(self.props())
+        self.assertTrue(compatible)
+        compatible = yield self.worker.isCompatibleWithBuild(
+            self.props(image='worker:2'))
+        self.assertFalse(compatible)
+        compatible = yield self.worker.isCompatibleWithBuild(
+            self.props(memory='2G'))
+        self.assertFalse(compatible)
+
+    def test_build_finished(self):
+        self.worker.container_spec = ('worker:1', '1G', (), None)
+        self.pool.record_start(self.worker, 'worker:1', 0, warm=False)
+        self.worker.buildFinished(self.wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 0)
+        self.assertEqual(self.pool.idle('worker:1'), ['dw000'])
+
+        # kept up to the build wait timeout
+        self.reactor.advance(60)
+        self.assertEqual(self.disconnects, 1)
+
+    def test_build_finished_no_demand(self):
+        self.worker.container_spec = ('worker:1', '1G', (), None)
+        self.pool.record_start(self.worker, 'worker:1', 0, warm=False)
+        self.reactor.advance(100)
+        self.worker.buildFinished(self.wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 1)
+        self.assertIsNone(self.worker.build_wait_timer)
+
+    @defer.inlineCallbacks
+    def test_prefer_warm_worker(self):
+        fresh = FakeWorkerForBuilder(FakeWorker('dw001'))
+        warm = FakeWorkerForBuilder(self.worker)
+        self.worker.container_spec = yield self.worker.render_container_spec(
+            self.props())
+
+        wfb = yield nextWorker(None, [fresh, warm],
+                               FakeBuildRequest(self.props()))
+        self.assertIs(wfb, warm)
+        wfb = yield nextWorker(None, [fresh, warm],
+                               FakeBuildRequest(self.props(image='other:1')))
+        self.assertIs(wfb, fresh)
+        wfb = yield nextWorker(None, [], FakeBuildRequest(self.props()))
+        self.assertIsNone(wfb)
+
+    @defer.inlineCallbacks
+    def test_all_workers_warm(self):
+        other = EveDockerLatentWorker(
+            'dw001', 'pass', image=Property('docker_image'),
+            master_fqdn='master', pb_port=9999, max_memory='1G',
+            max_cpus='1', warm_pool=self.pool)
+        other.parent = self.master
+        other._soft_disconnect = self.soft_disconnect
+        for worker, image, now in ((other, 'a:1', 0),
+                                   (self.worker, 'b:1', 10)):
+            worker.container_spec = yield worker.render_container_spec(
+                self.props(image=image))
+            self.pool.record_start(worker, image, now, warm=False)
+            self.assertTrue(self.pool.keep(worker, image, now))
+        wfbs = [FakeWorkerForBuilder(self.worker), FakeWorkerForBuilder(other)]
+
+        # no worker can run the build: the least recently used one stops
+        wfb = yield nextWorker(None, wfbs,
+                               FakeBuildRequest(self.props(image='c:1')))
+        self.assertIsNone(wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 1)
+        self.assertEqual(self.pool.idle('a:1'), [])
+        self.assertEqual(self.pool.idle('b:1'), ['dw000'])
+
+        # until it is stopped, no other worker is
+        wfb = yield nextWorker(None, wfbs,
+                               FakeBuildRequest(self.props(image='c:1')))
+        self.assertIsNone(wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 1)
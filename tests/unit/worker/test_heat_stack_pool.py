@@ -0,0 +1,172 @@
+"""Unit tests of `eve.worker.openstack_heat.stack_pool`."""
+
+from buildbot.process.properties import Properties, Property
+from buildbot.test.fake import fakemaster
+from buildbot.test.util.misc import TestReactorMixin
+from mock import patch
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.setup.builders import nextWorker
+from eve.worker.openstack_heat.openstack_heat_worker import HeatLatentWorker
+from eve.worker.openstack_heat.stack_pool import HeatStackPool, stack_spec
+from eve.worker.openstack_heat.stack_tracker import StackTracker
+
+
+class FakeWorker(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeWorkerForBuilder(object):
+    def __init__(self, worker):
+        self.worker = worker
+
+    def isBusy(self):
+        return False
+
+
+class FakeBuildRequest(object):
+    def __init__(self, properties):
+        self.properties = properties
+
+
+class TestStackSpec(unittest.TestCase):
+    def test_worker_params(self):
+        spec = stack_spec('template', {
+            'image': 'centos7', 'flavor': 'm1.medium', 'script_init': 'a',
+            'worker_name': 'hw000', 'worker_password': 'pass0'})
+        self.assertEqual(spec[:2], ('centos7', 'm1.medium'))
+        self.assertEqual(spec, stack_spec('template', {
+            'image': 'centos7', 'flavor': 'm1.medium', 'script_init': 'a',
+            'worker_name': 'hw001', 'worker_password': 'pass1'}))
+        self.assertNotEqual(spec, stack_spec('template', {
+            'image': 'centos7', 'flavor': 'm1.medium', 'script_init': 'b'}))
+        self.assertNotEqual(spec, stack_spec('other', {
+            'image': 'centos7', 'flavor': 'm1.medium', 'script_init': 'a'}))
+
+
+class TestHeatStackPool(unittest.TestCase):
+    def test_keep_follows_demand(self):
+        pool = HeatStackPool(max_idle_per_flavor=1, ttl=60, window=100)
+        worker1, worker2 = FakeWorker('hw0'), FakeWorker('hw1')
+        key = ('centos7', 'm1.medium')
+        pool.record_start(worker1, key, 0, warm=False)
+        pool.record_start(worker2, key, 0, warm=False)
+        self.assertTrue(pool.keep(worker1, key, 10))
+        self.assertFalse(pool.keep(worker2, key, 10))
+        self.assertFalse(pool.keep(worker2, ('ubuntu', 'm1.medium'), 10))
+
+        pool.record_start(worker1, key, 20, warm=True)
+        self.assertEqual(pool.idle(key), [])
+        self.assertEqual(pool.stats(), {'hits': 1, 'misses': 2, 'idle': 0})
+
+
+class TestHeatLatentWorkerStackPool(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        self.master = fakemaster.make_master(self)
+        self.pool = HeatStackPool(max_idle_per_flavor=1, ttl=60, window=100)
+        self.worker = HeatLatentWorker(
+            'hw000', 'pass', 'template', {
+                'image': Property('openstack_image'),
+                'flavor': Property('openstack_flavor'),
+                'script_init': Property('init.sh'),
+            }, 'url', 'user', 'pass', 'default', 'project', 'region', '2',
+            stack_tracker=StackTracker(None, reactor=self.reactor),
+            stack_pool=self.pool)
+        self.worker.parent = self.master
+        self.worker.build_wait_timeout = \
+            self.worker._config_kwargs['build_wait_timeout']
+        self.disconnects = 0
+        self.worker._soft_disconnect = self.soft_disconnect
+        self.wfb = FakeWorkerForBuilder(self.worker)
+
+    def soft_disconnect(self):
+        self.disconnects += 1
+
+    def props(self, image='centos7', init='echo init'):
+        props = Properties()
+        props.setProperty('openstack_image', image, 'test')
+        props.setProperty('openstack_flavor', 'm1.medium', 'test')
+        props.setProperty('init.sh', init, 'test')
+        return props
+
+    @defer.inlineCallbacks
+    def set_stack(self, props):
+        template, params = yield self.worker.render_stack(props)
+        self.worker.stack_spec = stack_spec(template, params)
+        self.pool.record_start(self.worker, self.worker.stack_spec[:2], 0,
+                               warm=False)
+        self.worker._reusable = True
+
+    @defer.inlineCallbacks
+    def test_compatibility(self):
+        self.assertTrue(self.worker.builds_may_be_incompatible)
+        self.assertEqual(self.worker.build_wait_timeout, 60)
+        compatible = yield self.worker.isCompatibleWithBuild(self.props())
+        self.assertTrue(compatible)
+
+        yield self.set_stack(self.props())
+        compatible = yield self.worker.isCompatibleWithBuild(self.props())
+        self.assertTrue(compatible)
+        compatible = yield self.worker.isCompatibleWithBuild(
+            self.props(image='ubuntu'))
+        self.assertFalse(compatible)
+        compatible = yield self.worker.isCompatibleWithBuild(
+            self.props(init='echo other'))
+        self.assertFalse(compatible)
+
+    @defer.inlineCallbacks
+    def test_build_finished(self):
+        yield self.set_stack(self.props())
+        self.worker.buildFinished(self.wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 0)
+        self.assertEqual(self.pool.idle(('centos7', 'm1.medium')),
+                         ['hw000'])
+
+        # kept up to the build wait timeout
+        self.reactor.advance(60)
+        self.assertEqual(self.disconnects, 1)
+
+    @defer.inlineCallbacks
+    def test_build_finished_redhat(self):
+        yield self.set_stack(self.props())
+        with patch('eve.worker.openstack_heat.openstack_heat_worker.util.'
+                   'isRedhat', return_value=defer.succeed(True)):
+            unregister = yield self.worker.unregister_redhat(None)
+        self.assertTrue(unregister)
+        self.worker.buildFinished(self.wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 1)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    @defer.inlineCallbacks
+    def test_prefer_warm_worker(self):
+        fresh = FakeWorkerForBuilder(FakeWorker('hw001'))
+        warm = FakeWorkerForBuilder(self.worker)
+        yield self.set_stack(self.props())
+
+        wfb = yield nextWorker(None, [fresh, warm],
+                               FakeBuildRequest(self.props()))
+        self.assertIs(wfb, warm)
+        wfb = yield nextWorker(None, [fresh, warm],
+                               FakeBuildRequest(self.props(image='ubuntu')))
+        self.assertIs(wfb, fresh)
+
+    @defer.inlineCallbacks
+    def test_all_workers_warm(self):
+        yield self.set_stack(self.props())
+        self.worker.buildFinished(self.wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.pool.idle(('centos7', 'm1.medium')),
+                         ['hw000'])
+
+        # the idle stack cannot run the build: it is deleted
+        wfb = yield nextWorker(None, [self.wfb],
+                               FakeBuildRequest(self.props(image='ubuntu')))
+        self.assertIsNone(wfb)
+        self.reactor.advance(0)
+        self.assertEqual(self.disconnects, 1)
+        self.assertEqual(self.pool.stats()['idle'], 0)
@@ -0,0 +1,157 @@
+"""Unit tests of `eve.worker.openstack_heat.stack_tracker`."""
+
+from buildbot.test.util.misc import TestReactorMixin
+from buildbot.util import deferwaiter
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.worker.openstack_heat.openstack_heat_worker import (HeatLatentWorker,
+                                                             creation_finished)
+from eve.worker.openstack_heat.stack_tracker import StackTracker
+
+
+class FakeStack(object):
+    def __init__(self, stack_id, stack_status):
+        self.id = stack_id
+        self.stack_status = stack_status
+
+
+class FakeStacks(object):
+    def __init__(self):
+        self.statuses = {}
+        self.lists = []
+        self.deletes = []
+        self.error = None
+
+    def list(self, filters, show_deleted):
+        assert show_deleted
+        self.lists.append(filters['id'])
+        if self.error is not None:
+            raise self.error  # pylint: disable=raising-bad-type
+        return iter([FakeStack(stack_id, self.statuses[stack_id])
+                     for stack_id in filters['id']
+                     if stack_id in self.statuses])
+
+    def create(self, stack_name, template, parameters):
+        self.statuses[stack_name] = 'CREATE_IN_PROGRESS'
+        return {'stack': {'id': stack_name}}
+
+    def delete(self, stack_id):
+        self.deletes.append(stack_id)
+
+
+class FakeHeatClient(object):
+    def __init__(self):
+        self.stacks = FakeStacks()
+
+
+class TestStackTracker(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        self.client = FakeHeatClient()
+        self.stacks = self.client.stacks
+        self.tracker = StackTracker(self.client, reactor=self.reactor,
+                                    min_interval=2, max_interval=10,
+                                    backoff=2)
+
+    def test_batched_polls(self):
+        self.stacks.statuses.update(a='CREATE_IN_PROGRESS',
+                                    b='CREATE_IN_PROGRESS')
+        created_a = self.tracker.wait('a', creation_finished)
+        created_b = self.tracker.wait('b', creation_finished)
+        self.reactor.advance(2)
+        self.assertEqual(self.stacks.lists, [['a', 'b']])
+
+        self.stacks.statuses['a'] = 'CREATE_COMPLETE'
+        self.reactor.advance(2)
+        self.assertEqual(self.successResultOf(created_a).stack_status,
+                         'CREATE_COMPLETE')
+        self.assertNoResult(created_b)
+        self.assertEqual(self.stacks.lists[-1], ['a', 'b'])
+
+        # nothing changes: the polls get further apart
+        for delay in (2, 4, 8, 10, 10):
+            self.reactor.advance(delay)
+        self.assertEqual(len(self.stacks.lists), 7)
+        self.assertEqual(self.stacks.lists[-1], ['b'])
+
+        # a new stack is polled for soon
+        self.tracker.wait('c', creation_finished)
+        self.reactor.advance(2)
+        self.assertEqual(self.stacks.lists[-1], ['b', 'c'])
+
+        # a stack which is not listed anymore is gone
+        del self.stacks.statuses['b']
+        self.reactor.advance(2)
+        self.assertIsNone(self.successResultOf(created_b))
+        self.assertEqual(self.tracker.polls, 9)
+
+    def test_list_error(self):
+        self.stacks.statuses['a'] = 'CREATE_COMPLETE'
+        self.stacks.error = Exception('unavailable')
+        created = self.tracker.wait('a', creation_finished)
+        self.reactor.advance(2)
+        self.assertNoResult(created)
+        self.flushLoggedErrors()
+
+        self.stacks.error = None
+        self.reactor.advance(4)
+        self.assertIsNotNone(self.successResultOf(created))
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+    def test_stop(self):
+        created = self.tracker.wait('a', creation_finished)
+        self.tracker.stop()
+        self.failureResultOf(created, defer.CancelledError)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+
+class TestHeatLatentWorker(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        self.client = FakeHeatClient()
+        self.stacks = self.client.stacks
+        self.tracker = StackTracker(self.client, reactor=self.reactor)
+        self.worker = HeatLatentWorker(
+            'hw000', 'pass', 'template', {}, 'url', 'user', 'pass',
+            'default', 'project', 'region', '2',
+            stack_tracker=self.tracker)
+        self.worker._deferwaiter = deferwaiter.DeferWaiter()
+
+    def test_shared_client(self):
+        self.assertIs(self.worker.heat_client, self.client)
+
+    @defer.inlineCallbacks
+    def test_create_stack(self):
+        created = self.worker._thd_create_stack('hw000', 'template', {})
+        self.assertEqual(created, 'hw000')
+        stack = self.tracker.wait('hw000', creation_finished)
+        self.stacks.statuses['hw000'] = 'CREATE_COMPLETE'
+        self.reactor.advance(2)
+        stack = yield stack
+        self.assertEqual(stack.stack_status, 'CREATE_COMPLETE')
+
+    def test_background_deletion(self):
+        self.worker.stack_id = 'hw000'
+        self.stacks.statuses['hw000'] = 'CREATE_COMPLETE'
+        self.successResultOf(self.worker.stop_instance())
+        self.assertIsNone(self.worker.stack_id)
+        deleting = self.worker._deleting
+        self.assertEqual(self.stacks.deletes, ['hw000'])
+
+        # the deletion is requested again until heat takes it into account
+        self.reactor.advance(2)
+        self.assertEqual(self.stacks.deletes, ['hw000', 'hw000'])
+        self.stacks.statuses['hw000'] = 'DELETE_IN_PROGRESS'
+        self.reactor.advance(2)
+        self.assertNoResult(deleting)
+
+        self.stacks.statuses['hw000'] = 'DELETE_COMPLETE'
+        self.reactor.advance(2)
+        self.successResultOf(deleting)
+        self.assertIsNone(self.worker._deleting)
+        self.assertEqual(self.stacks.deletes, ['hw000', 'hw000'])
+
+    def test_no_stack(self):
+        self.successResultOf(self.worker.stop_instance())
+        self.assertEqual(self.stacks.deletes, [])
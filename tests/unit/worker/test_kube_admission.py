@@ -0,0 +1,99 @@
+"""Unit tests of `eve.worker.kubernetes.admission`."""
+
+import unittest
+
+from kubernetes import client
+from mock import patch
+
+from eve.worker.kubernetes.admission import AdmissionController, pod_requests
+
+GIB = 1024 ** 3
+
+
+def pod_state(name, cpu='1', memory='1G', phase='Running', workername=None):
+    labels = {'app': 'eve'}
+    if workername:
+        labels['workername'] = workername
+    return client.V1Pod(
+        metadata=client.V1ObjectMeta(name=name, labels=labels),
+        spec=client.V1PodSpec(containers=[client.V1Container(
+            name='worker', resources=client.V1ResourceRequirements(
+                requests={'cpu': cpu, 'memory': memory}))]),
+        status=client.V1PodStatus(phase=phase))
+
+
+class TestPodRequests(unittest.TestCase):
+    def test_dict(self):
+        self.assertEqual(pod_requests({'spec': {'containers': [
+            {'resources': {'requests': {'cpu': '500m', 'memory': '1G'}}},
+            {'resources': {'requests': {'cpu': '1'}}},
+            {'name': 'no-resources'},
+        ]}}), (1.5, GIB))
+
+    def test_state(self):
+        self.assertEqual(pod_requests(pod_state('foo', '250m', '2Gi')),
+                         (0.25, 2 * GIB))
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self):
+        self.controller = AdmissionController(cpu_budget=4,
+                                              memory_budget=4 * GIB)
+
+    def test_reservations(self):
+        self.assertTrue(self.controller.admit(1, 'kw0', 3, GIB))
+        self.assertFalse(self.controller.admit(2, 'kw1', 2, GIB))
+        self.assertTrue(self.controller.admit(3, 'kw1', 1, 3 * GIB))
+        self.assertEqual(self.controller.usage(), (4, 4 * GIB))
+        self.assertEqual(self.controller.queue_depth, 1)
+
+        self.assertTrue(self.controller.release('kw0'))
+        self.assertFalse(self.controller.release('kw0'))
+        self.assertTrue(self.controller.admit(2, 'kw0', 2, 0))
+        self.assertEqual(self.controller.queue_depth, 0)
+        self.assertEqual(self.controller.admitted, 3)
+        self.assertEqual(self.controller.wait_times.count, 1)
+
+    def test_pods(self):
+        pods = [
+            pod_state('kw0-1-1', '2', '1G', workername='kw0'),
+            pod_state('kw1-1-2', '2', '1G', workername='kw1'),
+            pod_state('done', '2', '1G', phase='Succeeded'),
+            pod_state('odd', '1 cpu', '1G'),
+        ]
+        self.assertFalse(self.controller.admit(1, 'kw2', 1, 0, pods))
+
+        # the reservation of a worker stands for its pod
+        self.controller.reservations['kw0'] = (1, GIB, 0, True)
+        self.assertTrue(self.controller.admit(1, 'kw2', 1, 0, pods))
+        self.assertEqual(self.controller.usage(pods), (4, 2 * GIB))
+
+    def test_empty_namespace(self):
+        self.assertTrue(self.controller.admit(1, 'kw0', 8, 0))
+        self.assertFalse(self.controller.admit(2, 'kw1', 1, 0))
+
+    def test_unlimited_memory(self):
+        controller = AdmissionController(cpu_budget=4)
+        self.assertTrue(controller.admit(1, 'kw0', 1, 64 * GIB))
+        self.assertTrue(controller.admit(2, 'kw1', 1, 64 * GIB))
+
+    @patch('eve.worker.kubernetes.admission.monotonic')
+    def test_expirations(self, monotonic):
+        monotonic.return_value = 1000
+        self.controller.admit(1, 'kw0', 4, 0)
+        self.controller.admit(2, 'kw1', 4, 0)
+        self.controller.admit(3, 'kw2', 4, 0)
+        self.controller.started('kw0')
+        self.controller.admit(4, 'kw3', 4, 0)
+        self.assertEqual(self.controller.queue_depth, 3)
+
+        # the pod of kw0 started, the reservation of kw1 was never used
+        monotonic.return_value = 1121
+        self.assertEqual(self.controller.usage(), (4, 0))
+        self.assertEqual(sorted(self.controller.reservations), ['kw0'])
+
+        # held requests which are not checked anymore were cancelled
+        self.controller.admit(3, 'kw2', 4, 0)
+        monotonic.return_value = 1000 + 3601
+        self.assertEqual(self.controller.queue_depth, 1)
+        self.assertEqual(self.controller.stats()['queue_depth'], 1)
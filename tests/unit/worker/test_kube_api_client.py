@@ -0,0 +1,61 @@
+"""Unit tests of `eve.worker.kubernetes.api_client`."""
+
+import unittest
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from eve.worker.kubernetes.api_client import KubeClient
+from tests.util.fake_kube_apiserver import FakeKubeApiServer
+
+
+class TestKubeClient(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeKubeApiServer().start()
+        self.addCleanup(self.server.stop)
+        self.tokens = []
+
+    def load(self):
+        configuration = client.Configuration()
+        configuration.host = self.server.url
+        if self.tokens:
+            configuration.api_key = {'authorization': self.tokens.pop(0)}
+            configuration.api_key_prefix = {'authorization': 'Bearer'}
+        return configuration
+
+    def test_shared_connections(self):
+        kube_client = KubeClient(pool_size=4, loader=self.load)
+        for _ in range(5):
+            kube_client.call('list_namespaced_pod', 'ns')
+        with self.assertRaises(ApiException):
+            kube_client.call('read_namespaced_pod', 'foo', 'ns')
+        self.assertEqual(kube_client.config_loads, 1)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(
+            kube_client.core_api().api_client.configuration
+            .connection_pool_maxsize, 4)
+        self.assertEqual(kube_client.latencies['list_namespaced_pod'].count,
+                         5)
+        self.assertEqual(kube_client.latencies['read_namespaced_pod'].count,
+                         1)
+        self.assertIn('list_namespaced_pod: count=5', kube_client.summary())
+
+    def test_refresh_credentials(self):
+        self.server.token = 'new'
+        self.tokens = ['expired', 'new']
+        kube_client = KubeClient(loader=self.load)
+        kube_client.call('list_namespaced_pod', 'ns')
+        self.assertEqual(kube_client.config_loads, 2)
+
+        # rejected again after the refresh
+        self.server.token = 'newer'
+        self.tokens = ['expired', 'expired']
+        with self.assertRaises(ApiException) as context:
+            kube_client.call('list_namespaced_pod', 'ns')
+        self.assertEqual(context.exception.status, 401)
+
+    def test_refresh_interval(self):
+        kube_client = KubeClient(refresh_interval=0, loader=self.load)
+        kube_client.call('list_namespaced_pod', 'ns')
+        kube_client.call('list_namespaced_pod', 'ns')
+        self.assertEqual(kube_client.config_loads, 2)
@@ -0,0 +1,91 @@
+"""Unit tests of `eve.worker.kubernetes.pod_informer`."""
+
+from kubernetes import client
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from eve.worker.kubernetes.pod_informer import PodInformer
+from tests.util.fake_kube_apiserver import FakeKubeApiServer
+
+
+def pod(name, labels=None):
+    return {
+        'metadata': {'name': name, 'labels': labels or {'app': 'eve'}},
+        'spec': {'containers': [{'name': 'worker', 'image': 'worker'}]},
+    }
+
+
+def phase(state):
+    return state.status.phase if state is not None else None
+
+
+class KubeApiServerMixin(object):
+    def setUpApiServer(self):
+        self.server = FakeKubeApiServer().start()
+        self.addCleanup(self.server.stop)
+        configuration = client.Configuration()
+        configuration.host = self.server.url
+        client.Configuration.set_default(configuration)
+        self.addCleanup(client.Configuration.set_default, None)
+        self.api = client.CoreV1Api()
+        self.informer = PodInformer('ns', reactor=reactor, timeout=1,
+                                    retry_delay=0.1)
+        self.addCleanup(self.informer.stop)
+        self.informer.start()
+
+
+class TestPodInformer(KubeApiServerMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpApiServer()
+
+    @defer.inlineCallbacks
+    def test_wait(self):
+        self.server.start_phase = None
+        self.api.create_namespaced_pod('ns', pod('foo'))
+        state = yield self.informer.wait('foo', lambda state: True)
+        self.assertEqual(phase(state), 'Pending')
+
+        running = self.informer.wait(
+            'foo', lambda state: phase(state) == 'Running')
+        self.server.set_phase('ns', 'foo', 'Running')
+        state = yield running
+        self.assertEqual(phase(state), 'Running')
+
+        # the state is already known
+        state = yield self.informer.wait(
+            'foo', lambda state: phase(state) == 'Running')
+        self.assertEqual(phase(state), 'Running')
+
+        self.api.delete_namespaced_pod('foo', 'ns',
+                                       body=client.V1DeleteOptions())
+        state = yield self.informer.wait('foo', lambda state: state is None)
+        self.assertIsNone(state)
+        self.assertEqual(self.informer.pods, {})
+        self.assertEqual(self.informer.lists, 1)
+
+    @defer.inlineCallbacks
+    def test_label_selector(self):
+        self.api.create_namespaced_pod('ns', pod('other', {'app': 'other'}))
+        self.api.create_namespaced_pod('ns', pod('foo'))
+        yield self.informer.wait('foo', lambda state: True)
+        self.assertEqual(list(self.informer.pods), ['foo'])
+
+    @defer.inlineCallbacks
+    def test_timeout(self):
+        with self.assertRaises(defer.TimeoutError):
+            yield self.informer.wait('foo', lambda state: True, timeout=0.1)
+        self.assertEqual(dict(self.informer._waiters), {})
+
+    @defer.inlineCallbacks
+    def test_expired_watch(self):
+        self.api.create_namespaced_pod('ns', pod('foo'))
+        yield self.informer.wait('foo', lambda state: True)
+        # the resource version of the informer expires: the ERROR event of
+        # the watch goes through the deserialization of the client
+        self.server.compact()
+        self.server.oldest_version += 1
+        while self.informer.lists < 2:
+            yield task.deferLater(reactor, 0.05, lambda: None)
+        self.api.create_namespaced_pod('ns', pod('bar'))
+        yield self.informer.wait('bar', lambda state: True)
+        self.assertEqual(sorted(self.informer.pods), ['bar', 'foo'])
@@ -0,0 +1,108 @@
+"""Unit tests of `eve.worker.kubernetes.pod_reaper`."""
+
+from datetime import datetime, timedelta, timezone
+
+from buildbot.test.fake import fakemaster
+from buildbot.test.util.misc import TestReactorMixin
+from kubernetes import client
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.worker.kubernetes.api_client import KubeClient
+from eve.worker.kubernetes.pod_reaper import KubePodReaper, stale_pods
+from tests.util.fake_kube_apiserver import FakeKubeApiServer
+
+NOW = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def pod_state(workername, buildid, age=3600):
+    return client.V1Pod(metadata=client.V1ObjectMeta(
+        name='%s-%s' % (workername, buildid),
+        labels={'app': 'eve', 'workername': workername, 'buildid': buildid},
+        creation_timestamp=NOW - timedelta(seconds=age)))
+
+
+def pod(workername, buildid):
+    return {
+        'metadata': {'name': '%s-1-%s' % (workername, buildid), 'labels': {
+            'app': 'eve', 'workername': workername, 'buildid': buildid}},
+        'spec': {'containers': [{'name': 'worker', 'image': 'worker'}]},
+    }
+
+
+class TestStalePods(unittest.TestCase):
+    def test_stale_pods(self):
+        pods = [
+            pod_state('kw000', '12'),
+            pod_state('kw000', '11'),
+            pod_state('kw000', '10'),
+            pod_state('kw001', '5'),
+            pod_state('kw001', '6', age=10),
+            client.V1Pod(metadata=client.V1ObjectMeta(
+                name='prepull', labels={'app': 'eve'})),
+        ]
+        self.assertEqual(
+            stale_pods(pods, {('kw000', '12')}, NOW, min_age=600),
+            {'kw000': ['10', '11'], 'kw001': ['5']})
+
+
+class TestKubePodReaper(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        self.server = FakeKubeApiServer().start()
+        self.addCleanup(self.server.stop)
+        configuration = client.Configuration()
+        configuration.host = self.server.url
+        self.kube_client = KubeClient(loader=lambda: configuration)
+        for workername, buildid in (('kw000', '12'), ('kw000', '11'),
+                                    ('kw001', '5'), ('other', '3')):
+            self.kube_client.call('create_namespaced_pod', 'ns',
+                                  pod(workername, buildid))
+
+        self.master = fakemaster.make_master(self, wantDb=True)
+        self.builds = [{'workerid': 1, 'number': 12}]
+        self.master.db.builds.getBuilds = \
+            lambda complete: defer.succeed(self.builds)
+        self.master.db.workers.getWorkers = lambda: defer.succeed([
+            {'id': 1, 'name': 'kw000'}, {'id': 2, 'name': 'kw001'}])
+
+    @defer.inlineCallbacks
+    def start_reaper(self):
+        reaper = KubePodReaper('ns', ['kw000', 'kw001'], interval=60,
+                               min_age=0, kube_client=self.kube_client)
+        yield reaper.setServiceParent(self.master)
+        yield reaper.startService()
+        self.addCleanup(reaper.stopService)
+        defer.returnValue(reaper)
+
+    def pods(self):
+        return sorted(name for _, name in self.server.pods)
+
+    @defer.inlineCallbacks
+    def test_reap_at_start(self):
+        reaper = yield self.start_reaper()
+        yield reaper.reap()
+        self.assertEqual(self.pods(), ['kw000-1-12', 'other-1-3'])
+        self.assertEqual(reaper.reaped_builds, 2)
+        self.assertEqual(self.server.collection_deletions, [
+            ('ns', 'app=eve,workername=kw000,buildid in (11)'),
+            ('ns', 'app=eve,workername=kw001,buildid in (5)'),
+        ])
+
+    @defer.inlineCallbacks
+    def test_reap_periodically(self):
+        reaper = yield self.start_reaper()
+        yield reaper.reap()
+        self.builds = []
+        self.reactor.advance(60)
+        yield reaper.reap()
+        self.assertEqual(reaper.reaped_builds, 3)
+        self.assertEqual(self.pods(), ['other-1-3'])
+
+    @defer.inlineCallbacks
+    def test_api_error(self):
+        self.server.token = 'secret'
+        reaper = yield self.start_reaper()
+        yield reaper.reap()
+        self.assertEqual(reaper.reaped_builds, 0)
+        self.assertEqual(len(self.pods()), 4)
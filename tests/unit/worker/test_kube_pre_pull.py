@@ -0,0 +1,97 @@
+"""Unit tests of `eve.worker.kubernetes.pre_pull`."""
+
+from buildbot.plugins import util
+from buildbot.process.properties import Interpolate
+from buildbot.process.results import SUCCESS, WARNINGS
+from buildbot.test.util import steps
+from buildbot.test.util.misc import TestReactorMixin
+from kubernetes.client.rest import ApiException
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from eve.worker.kubernetes.pre_pull import KubePrePullImages, prepull_pod
+
+POD_NAME = 'prepull-92-e4aa1a48'
+
+
+class FakeKubeClient(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def call(self, method, *args, **kwargs):
+        self.calls.append((method, args))
+        if self.error is not None:
+            raise self.error
+
+
+class TestPrePullPod(unittest.TestCase):
+    def test_pod(self):
+        pod = prepull_pod('prepull', ['image:1', 'image:2'], 'pool:worker',
+                          deadline=60)
+        self.assertEqual([(c['name'], c['image'])
+                          for c in pod['spec']['containers']],
+                         [('prepull-0', 'image:1'), ('prepull-1', 'image:2')])
+        self.assertEqual(pod['spec']['activeDeadlineSeconds'], 60)
+        self.assertEqual(pod['metadata']['labels']['app'], 'eve')
+        term = pod['spec']['affinity']['nodeAffinity'][
+            'requiredDuringSchedulingIgnoredDuringExecution'][
+                'nodeSelectorTerms'][0]
+        self.assertEqual(term['matchExpressions'][0]['values'], ['worker'])
+
+    def test_no_affinity(self):
+        pod = prepull_pod('prepull', ['image:1'])
+        self.assertNotIn('affinity', pod['spec'])
+
+
+class TestKubePrePullImages(steps.BuildStepMixin, TestReactorMixin,
+                            unittest.TestCase):
+    def setUp(self):
+        util.env = util.load_env([('HIDE_INTERNAL_STEPS', '1', int)])
+        self.setUpTestReactor()
+        return self.setUpBuildStep()
+
+    def tearDown(self):
+        return self.tearDownBuildStep()
+
+    def setupStep(self, kube_client):
+        self.kube_client = kube_client
+        super(TestKubePrePullImages, self).setupStep(KubePrePullImages(
+            'pre-merge', {
+                'worker': Interpolate('registry/worker:%(prop:fp)s'),
+                'other': 'registry/other:1',
+                'same': 'registry/other:1',
+            }, namespace='ns', deadline=600, kube_client=kube_client,
+            name='prepull'))
+        self.properties.setProperty('fp', '1234', 'test')
+
+    @defer.inlineCallbacks
+    def test_create_pod(self):
+        self.setupStep(FakeKubeClient())
+        self.expectOutcome(result=SUCCESS)
+        self.expectProperty('prepull_pod_pre-merge', POD_NAME)
+        yield self.runStep()
+
+        [(method, (namespace, pod))] = self.kube_client.calls
+        self.assertEqual((method, namespace), ('create_namespaced_pod', 'ns'))
+        self.assertEqual(pod['metadata']['name'], POD_NAME)
+        self.assertEqual([c['image'] for c in pod['spec']['containers']],
+                         ['registry/other:1', 'registry/worker:1234'])
+
+        # the pod is deleted if no worker did it before its deadline
+        [delayed] = self.master.reactor.getDelayedCalls()
+        self.assertEqual(delayed.getTime(), 600)
+        self.assertEqual(delayed.func, self.step.delete_pod)
+        self.kube_client.error = ApiException(status=404)
+        yield self.step.delete_pod(POD_NAME)
+        self.assertEqual(self.kube_client.calls[-1][0],
+                         'delete_namespaced_pod')
+
+    def test_create_failed(self):
+        self.setupStep(FakeKubeClient(ApiException(status=403,
+                                                   reason='Forbidden')))
+        self.expectOutcome(result=WARNINGS)
+        self.expectLogfile('prepull', 'unable to create pod %s: Forbidden\n'
+                           % POD_NAME)
+        self.expectNoProperty('prepull_pod_pre-merge')
+        return self.runStep()
@@ -0,0 +1,319 @@
+"""Unit tests of `eve.worker.kubernetes.kubernetes_worker`."""
+
+from buildbot.interfaces import LatentWorkerCannotSubstantiate
+from buildbot.process.properties import Properties
+from buildbot.test.fake.fakebuild import FakeBuild
+from buildbot.util import deferwaiter
+from buildbot.worker.latent import AbstractLatentWorker
+from kubernetes import client
+from mock import Mock, patch
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from eve.worker.kubernetes.admission import AdmissionController
+from eve.worker.kubernetes.api_client import KubeClient
+from eve.worker.kubernetes.kubernetes_worker import (POD_CACHE,
+                                                     SERVICE_POD_TEMPLATE,
+                                                     TEMPLATE_CACHE,
+                                                     EveKubeLatentWorker)
+from eve.worker.kubernetes.pod_informer import PodInformer
+from tests.util.fake_kube_apiserver import FakeKubeApiServer
+
+WORKER_TEMPLATE = """
+apiVersion: v1
+kind: Pod
+metadata:
+  name: worker
+spec:
+  containers:
+    - name: worker
+      image: worker
+      resources:
+        requests: {cpu: "1", memory: 1G}
+        limits: {cpu: "1", memory: 1G}
+"""
+
+WORKER_POD = 'kw000-12-34'
+INIT_POD = WORKER_POD + '-service-init'
+TEARDOWN_POD = WORKER_POD + '-service-teardown'
+
+
+def pod(name):
+    return {
+        'metadata': {'name': name, 'labels': {'app': 'eve'}},
+        'spec': {'containers': [{'name': 'worker', 'image': 'worker'}]},
+    }
+
+
+class TestEveKubeLatentWorker(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeKubeApiServer().start()
+        self.addCleanup(self.server.stop)
+        configuration = client.Configuration()
+        configuration.host = self.server.url
+        kube_client = KubeClient(loader=lambda: configuration)
+        informer = PodInformer('ns', reactor=reactor, timeout=1,
+                               api_factory=kube_client.core_api)
+        self.addCleanup(informer.stop)
+        informer.start()
+
+        self.worker = EveKubeLatentWorker.__new__(EveKubeLatentWorker)
+        self.worker.name = 'kw000'
+        self.worker.password = 'pass'
+        self.worker.registration = None
+        self.worker.master_fqdn = 'master'
+        self.worker.pb_port = '9989'
+        self.worker.namespace = 'ns'
+        self.worker.node_affinity = None
+        self.worker.gitconfig = None
+        self.worker.max_memory = '4G'
+        self.worker.max_cpus = '2'
+        self.worker.deadline = 3600
+        self.worker.service = 'service-image'
+        self.worker.service_data = ''
+        self.worker.kube_client = kube_client
+        self.worker.pod_informer = informer
+        self.worker._deferwaiter = deferwaiter.DeferWaiter()
+
+    def build(self, worker_service=None, prepull_pod=None):
+        props = Properties()
+        for name, value in {
+                'bootstrap': 12,
+                'buildnumber': 34,
+                'repository': 'git@host:repo',
+                'stage_name': 'pre-merge',
+                'worker_images': {},
+                'worker_path': 'eve/workers/pod.yaml',
+                'worker_prepull_pod': prepull_pod,
+                'worker_service': worker_service,
+                'worker_template': WORKER_TEMPLATE,
+                'worker_vars': {},
+                'workername': 'kw000'}.items():
+            props.setProperty(name, value, 'test')
+        return FakeBuild(props)
+
+    @defer.inlineCallbacks
+    def wait_for(self, condition):
+        while not condition():
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+    @defer.inlineCallbacks
+    def test_start_and_delete_pod(self):
+        name = yield self.worker.start_pod(pod('worker'))
+        self.assertEqual(name, 'worker')
+        self.server.deletion_delay = 0.1
+        yield self.worker.delete_pod('worker')
+        self.assertEqual(self.server.pods, {})
+        # no status polling
+        self.assertNotIn(('GET', '/api/v1/namespaces/ns/pods/worker/status'),
+                         self.server.requests)
+
+    @defer.inlineCallbacks
+    def test_start_pod_failed(self):
+        self.server.phases['worker'] = 'Failed'
+        with self.assertRaises(LatentWorkerCannotSubstantiate):
+            yield self.worker.start_pod(pod('worker'))
+        yield self.worker.pod_informer.wait('worker',
+                                            lambda state: state is None)
+        self.assertEqual(self.server.pods, {})
+
+    @defer.inlineCallbacks
+    def test_wait_for_completion(self):
+        self.server.phases['service'] = 'Succeeded'
+        name = yield self.worker.start_pod(pod('service'),
+                                           wait_for_completion=True)
+        self.assertEqual(name, 'service')
+        self.assertEqual(self.server.pods, {})
+
+    @defer.inlineCallbacks
+    def test_forced_deletion(self):
+        self.worker._delete_timeout = 0.1
+        self.server.deletion_delay = 60
+        yield self.worker.start_pod(pod('worker'))
+        yield self.worker.delete_pod('worker')
+        self.assertEqual(self.server.pods, {})
+
+    @defer.inlineCallbacks
+    def test_start_without_service(self):
+        name = yield self.worker.start_instance(self.build())
+        self.assertEqual(name, WORKER_POD)
+        self.assertIsNone(self.worker.service_ready)
+        self.assertEqual(list(self.server.pods), [('ns', WORKER_POD)])
+
+    @defer.inlineCallbacks
+    def test_prepull_pod(self):
+        self.server.node_name = 'node-7'
+        yield self.worker.start_pod(pod('prepull-1'))
+        self.server.node_name = 'node-1'
+        yield self.worker.start_instance(self.build(prepull_pod='prepull-1'))
+
+        # the worker pod prefers the node which pulled its images
+        worker_pod = self.server.pods[('ns', WORKER_POD)]
+        [preference] = worker_pod['spec']['affinity']['nodeAffinity'][
+            'preferredDuringSchedulingIgnoredDuringExecution']
+        self.assertEqual(
+            preference['preference']['matchExpressions'][0]['values'],
+            ['node-7'])
+
+        # then the placeholder is deleted
+        yield self.worker._deferwaiter.wait()
+        self.assertEqual(list(self.server.pods), [('ns', WORKER_POD)])
+
+    @defer.inlineCallbacks
+    def test_prepull_pod_stopped_instance(self):
+        yield self.worker.start_pod(pod('prepull-1'))
+        self.server.phases[WORKER_POD] = None
+        started = self.worker.start_instance(
+            self.build(prepull_pod='prepull-1'))
+        yield self.wait_for(lambda: ('ns', WORKER_POD) in self.server.pods)
+
+        # the build is cancelled while its pod is pending
+        yield self.worker.stop_instance()
+        yield self.worker._deferwaiter.wait()
+        self.assertNotIn(('ns', 'prepull-1'), self.server.pods)
+
+        started.cancel()
+        with self.assertRaises(defer.CancelledError):
+            yield started
+
+    @defer.inlineCallbacks
+    def test_unknown_prepull_pod(self):
+        yield self.worker.start_instance(self.build(prepull_pod='prepull-1'))
+        worker_pod = self.server.pods[('ns', WORKER_POD)]
+        self.assertNotIn('affinity', worker_pod['spec'])
+        yield self.worker._deferwaiter.wait()
+
+    @defer.inlineCallbacks
+    def test_admission(self):
+        self.worker.admission = AdmissionController(cpu_budget=1.5)
+        self.worker.parent = Mock()
+        request = Mock(id=1, properties=self.build().properties)
+
+        other = pod('kw001-12-34')
+        other['spec']['containers'][0]['resources'] = {
+            'requests': {'cpu': '1'}}
+        yield self.worker.start_pod(other)
+        self.assertFalse(self.worker.admit(request))
+        self.assertEqual(self.worker.admission.queue_depth, 1)
+
+        yield self.worker.delete_pod('kw001-12-34')
+        self.assertTrue(self.worker.admit(request))
+        self.assertEqual(self.worker.admission.queue_depth, 0)
+
+        yield self.worker.start_instance(self.build())
+        request.id = 2
+        self.assertFalse(self.worker.admit(request))
+        yield self.worker.stop_instance()
+        self.assertEqual(self.worker.admission.reservations, {})
+        # the held request is checked again
+        botmaster = self.worker.parent.master.botmaster
+        botmaster.maybeStartBuildsForWorker.assert_called_once_with('kw000')
+
+    @defer.inlineCallbacks
+    def test_service_init_in_parallel(self):
+        self.server.phases[INIT_POD] = None
+        started = self.worker.start_instance(
+            self.build({'namespaces': ['ns1']}))
+        yield self.wait_for(lambda: ('ns', WORKER_POD) in self.server.pods)
+        self.assertIn(('ns', INIT_POD), self.server.pods)
+        self.assertFalse(started.called)
+
+        # the worker is held until the service is initialized
+        with patch.object(AbstractLatentWorker, 'attached',
+                          return_value=defer.succeed(None)) as attached:
+            attaching = self.worker.attached('bot')
+            self.assertFalse(attached.called)
+            self.server.set_phase('ns', INIT_POD, 'Succeeded')
+            yield attaching
+            attached.assert_called_once_with('bot')
+
+        name = yield started
+        self.assertEqual(name, WORKER_POD)
+        self.assertIsNone(self.worker.service_ready)
+        yield self.wait_for(lambda: ('ns', INIT_POD) not in self.server.pods)
+
+    @defer.inlineCallbacks
+    def test_service_init_failed(self):
+        self.server.phases[INIT_POD] = 'Failed'
+        with self.assertRaises(LatentWorkerCannotSubstantiate):
+            yield self.worker.start_instance(
+                self.build({'namespaces': ['ns1']}))
+        self.assertNotIn(('ns', WORKER_POD), self.server.pods)
+        self.assertIsNone(self.worker.instance)
+
+    @defer.inlineCallbacks
+    def test_async_teardown(self):
+        self.server.phases[INIT_POD] = 'Succeeded'
+        self.server.phases[TEARDOWN_POD] = None
+        yield self.worker.start_instance(self.build({'namespaces': ['ns1']}))
+        yield self.worker.stop_instance()
+        self.assertIsNone(self.worker.instance)
+        self.assertEqual(len(self.worker._deferwaiter._waited), 1)
+        yield self.wait_for(lambda: list(self.server.pods) == [
+            ('ns', TEARDOWN_POD)])
+
+        self.server.set_phase('ns', TEARDOWN_POD, 'Succeeded')
+        yield self.worker._deferwaiter.wait()
+        self.assertEqual(self.server.pods, {})
+
+
+class TestPodConfig(unittest.TestCase):
+    def setUp(self):
+        TEMPLATE_CACHE.clear()
+        POD_CACHE.clear()
+        self.addCleanup(TEMPLATE_CACHE.clear)
+        self.addCleanup(POD_CACHE.clear)
+        self.worker = EveKubeLatentWorker.__new__(EveKubeLatentWorker)
+        self.template = WORKER_TEMPLATE.replace('image: worker',
+                                                'image: {{ images.worker }}')
+
+    def get(self, image='worker:1', **kwargs):
+        return self.worker.get_pod_config(
+            'pod.yaml', self.template,
+            {'images': {'worker': image}, 'vars': {}}, **kwargs)
+
+    def test_reuse_pod(self):
+        pod = self.get()
+        self.assertEqual(pod['spec']['containers'][0]['image'], 'worker:1')
+        pod['spec']['containers'].append({'name': 'other'})
+
+        # the cached pod is not modified by the caller
+        again = self.get()
+        self.assertEqual(len(again['spec']['containers']), 1)
+        self.assertEqual(POD_CACHE.stats()['hits'], 1)
+        self.assertEqual(TEMPLATE_CACHE.stats()['misses'], 1)
+
+    def test_other_variables(self):
+        self.get()
+        pod = self.get('worker:2')
+        self.assertEqual(pod['spec']['containers'][0]['image'], 'worker:2')
+        self.assertEqual(POD_CACHE.stats()['misses'], 2)
+        self.assertEqual(TEMPLATE_CACHE.hit_rate, 0.5)
+
+    def test_no_reuse(self):
+        self.worker.get_pod_config('SERVICE_POD_TEMPLATE',
+                                   SERVICE_POD_TEMPLATE, {
+                                       'buildid': 1,
+                                       'buildnumber': 2,
+                                       'image': 'service',
+                                       'namespaces': ['ns1'],
+                                       'service_data': '',
+                                       'service_requests': {},
+                                       'uuid': 'uuid',
+                                       'worker_pod_name': 'pod',
+                                   }, reuse=False)
+        self.assertEqual(len(TEMPLATE_CACHE), 1)
+        self.assertEqual(len(POD_CACHE), 0)
+
+    def test_errors_are_not_cached(self):
+        with self.assertRaisesRegex(LatentWorkerCannotSubstantiate,
+                                    'Unable to render'):
+            self.worker.get_pod_config('pod.yaml', '{% if %}', {})
+        with self.assertRaisesRegex(LatentWorkerCannotSubstantiate,
+                                    'Unable to render'):
+            self.worker.get_pod_config('pod.yaml', self.template, {})
+        with self.assertRaisesRegex(LatentWorkerCannotSubstantiate,
+                                    'not a valid'):
+            self.worker.get_pod_config('pod.yaml', 'kind: Service', {})
+        self.assertEqual(len(TEMPLATE_CACHE), 2)
+        self.assertEqual(len(POD_CACHE), 0)
@@ -0,0 +1,73 @@
+"""Unit tests of `eve.worker.openstack_heat.openstack_heat_worker`."""
+
+from buildbot.interfaces import IRenderable
+from buildbot.process.properties import Properties, Property
+from buildbot.test.util.misc import TestReactorMixin
+from twisted.internet import defer
+from twisted.trial import unittest
+from zope.interface import implementer
+
+from eve.worker.openstack_heat.openstack_heat_worker import (RENDER_LATENCIES,
+                                                             HeatLatentWorker,
+                                                             render_summary)
+from eve.worker.openstack_heat.stack_tracker import StackTracker
+
+
+@implementer(IRenderable)
+class SlowRenderable(object):
+    def __init__(self):
+        self.deferreds = []
+
+    def getRenderingFor(self, props):
+        deferred = defer.Deferred()
+        self.deferreds.append(deferred)
+        return deferred
+
+
+class TestRenderStack(TestReactorMixin, unittest.TestCase):
+    def setUp(self):
+        self.setUpTestReactor()
+        RENDER_LATENCIES.clear()
+        self.addCleanup(RENDER_LATENCIES.clear)
+
+    def worker(self, heat_params):
+        return HeatLatentWorker(
+            'hw000', 'pass', 'template', heat_params, 'url', 'user', 'pass',
+            'default', 'project', 'region', '2',
+            stack_tracker=StackTracker(None, reactor=self.reactor))
+
+    def test_concurrent_render(self):
+        slow = SlowRenderable()
+        props = Properties()
+        props.setProperty('openstack_image', 'centos7', 'test')
+        worker = self.worker({'a': slow, 'b': slow,
+                              'image': Property('openstack_image')})
+        rendered = worker.render_stack(props)
+
+        # all the parameters are rendering at the same time
+        self.assertEqual(len(slow.deferreds), 2)
+        self.assertNoResult(rendered)
+        slow.deferreds[1].callback('b')
+        slow.deferreds[0].callback('a')
+        self.assertEqual(self.successResultOf(rendered), (
+            'template', {'a': 'a', 'b': 'b', 'image': 'centos7'}))
+        self.assertEqual(sorted(RENDER_LATENCIES), ['a', 'b', 'image'])
+        self.assertEqual(RENDER_LATENCIES['a'].count, 1)
+        self.assertIn('image: count=1', render_summary())
+
+    def test_compatibility_not_recorded(self):
+        props = Properties()
+        props.setProperty('openstack_image', 'centos7', 'test')
+        worker = self.worker({'image': Property('openstack_image')})
+        worker.stack_spec = ('centos7', None, 'digest')
+        compatible = worker.isCompatibleWithBuild(props)
+        self.assertFalse(self.successResultOf(compatible))
+        self.assertEqual(RENDER_LATENCIES, {})
+
+    def test_render_error(self):
+        slow = SlowRenderable()
+        worker = self.worker({'a': slow, 'b': slow})
+        rendered = worker.render_stack(Properties())
+        slow.deferreds[0].errback(IOError('no such file'))
+        slow.deferreds[1].callback('b')
+        self.failureResultOf(rendered, IOError)
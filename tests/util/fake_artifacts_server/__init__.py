@@ -0,0 +1,3 @@
+from .fake_artifacts_server import FakeArtifactsServer
+
+__all__ = ['FakeArtifactsServer']
@@ -0,0 +1,175 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""FakeArtifactsServer: the artifacts upload API used by eve."""
+
+import json
+import re
+import threading
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlparse
+
+UPLOAD_PATH = re.compile(r'^/upload/([^/]+)/(.+)$')
+DOWNLOAD_PATH = re.compile(r'^/download/([^/]+)/(.+)$')
+LINK_PATH = re.compile(r'^/link/([^/]+)/(.+)$')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        with self.server.artifacts.lock:
+            self.server.artifacts.connections += 1
+        super(_Handler, self).handle()
+
+    def _send(self, status, data=b''):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):  # NOQA flake8 to ignore camelCase
+        server = self.server.artifacts
+        path = unquote(urlparse(self.path).path)
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length)
+        digest = self.headers.get('X-Checksum-Sha256')
+        with server.lock:
+            server.requests.append(('PUT', path))
+            status = server.put(path, data, digest)
+        self._send(status)
+
+    def do_POST(self):  # NOQA flake8 to ignore camelCase
+        server = self.server.artifacts
+        path = urlparse(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length)
+        with server.lock:
+            server.requests.append(('POST', path))
+            if path != '/lookup' or not server.dedup:
+                self._send(404)
+                return
+            digests = json.loads(data.decode('utf-8'))['sha256']
+            answer = {'sha256': [digest for digest in digests
+                                 if digest in server.blobs]}
+        self._send(200, json.dumps(answer).encode('utf-8'))
+
+    def do_GET(self):  # NOQA flake8 to ignore camelCase
+        server = self.server.artifacts
+        path = unquote(urlparse(self.path).path)
+        match = DOWNLOAD_PATH.match(path)
+        with server.lock:
+            server.requests.append(('GET', path))
+            data = server.files.get(match.groups()) if match else None
+        if data is None:
+            self._send(404)
+        else:
+            self._send(200, data)
+
+
+class FakeArtifactsServer(object):
+    """Serve a fake artifacts API on localhost, in a thread.
+
+    Files sent with ``PUT /upload/<container>/<path>`` are kept in memory,
+    in `files`, keyed by ``(container, path)``, and can be read back with
+    ``GET /download/<container>/<path>``. Uploads of the paths listed in
+    `failures` are answered with an error.
+
+    Their content is also kept in `blobs`, keyed by sha256 digest. Unless
+    `dedup` is unset, ``POST /lookup`` tells which of a list of digests
+    are held, and ``PUT /link/<container>/<path>`` stores the blob of the
+    digest given in the ``X-Checksum-Sha256`` header at path.
+
+    Every request received is recorded in `requests` as a
+    ``(method, path)`` tuple, and `connections` counts the connections
+    accepted.
+
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.blobs = {}
+        self.dedup = True
+        self.failures = set()
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        """Start serving requests.
+
+        Returns:
+            self
+
+        """
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.artifacts = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def put(self, path, data, digest):
+        """Handle an upload or a link, return the HTTP status."""
+        match = UPLOAD_PATH.match(path)
+        if match is not None:
+            if match.group(2) in self.failures:
+                return 500
+            if digest is not None and sha256(data).hexdigest() != digest:
+                return 400
+            self.files[match.groups()] = data
+            self.blobs[sha256(data).hexdigest()] = data
+            return 200
+        match = LINK_PATH.match(path)
+        if match is not None and self.dedup:
+            if match.group(2) in self.failures:
+                return 500
+            if digest not in self.blobs:
+                return 404
+            self.files[match.groups()] = self.blobs[digest]
+            return 200
+        return 404
+
+    def container(self, name):
+        """Return the files of a container, keyed by path."""
+        with self.lock:
+            return {path: data for (container, path), data
+                    in self.files.items() if container == name}
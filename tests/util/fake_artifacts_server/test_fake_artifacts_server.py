@@ -0,0 +1,59 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Test the FakeArtifactsServer."""
+
+from http.client import HTTPConnection
+from unittest import TestCase
+
+from tests.util.fake_artifacts_server import FakeArtifactsServer
+
+
+class TestFakeArtifactsServer(TestCase):
+    def test_upload(self):
+        """Test uploads to a fake artifacts server.
+
+        Steps:
+            - Start a FakeArtifactsServer.
+            - Upload two files on the same connection and read one back.
+            - Check that an upload set to fail is refused.
+            - Stop the FakeArtifactsServer.
+
+        """
+        server = FakeArtifactsServer().start()
+        self.addCleanup(server.stop)
+        server.failures.add('broken')
+        connection = HTTPConnection('127.0.0.1',
+                                    server._server.server_address[1])
+        self.addCleanup(connection.close)
+
+        def request(method, path, body=None):
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, response.read()
+
+        self.assertEqual(request('PUT', '/upload/c1/a/b%20c', b'abc'),
+                         (200, b''))
+        self.assertEqual(request('PUT', '/upload/c1/d', b'd'), (200, b''))
+        self.assertEqual(request('GET', '/download/c1/a/b%20c'),
+                         (200, b'abc'))
+        self.assertEqual(request('PUT', '/upload/c1/broken', b''),
+                         (500, b''))
+        self.assertEqual(request('GET', '/download/c2/d'), (404, b''))
+
+        self.assertEqual(server.container('c1'), {'a/b c': b'abc', 'd': b'd'})
+        self.assertEqual(server.connections, 1)
@@ -0,0 +1,3 @@
+from .fake_docker_daemon import FakeDockerDaemon
+
+__all__ = ['FakeDockerDaemon']
@@ -0,0 +1,162 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""FakeDockerDaemon: the docker engine API subset used by eve."""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+VERSION_PREFIX = re.compile(r'^/v[0-9.]+/')
+
+
+class _Server(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return 'fake-docker'
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        self.server.daemon.connections += 1
+        super(_Handler, self).handle()
+
+    def _dispatch(self):
+        url = urlparse(self.path)
+        path = VERSION_PREFIX.sub('/', url.path)
+        query = {key: values[-1]
+                 for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        daemon = self.server.daemon
+        with daemon.lock:
+            daemon.requests.append((self.command, path))
+            status, answer = daemon.handle(self.command, path, query, body)
+        data = json.dumps(answer).encode('utf-8') if answer else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+
+class FakeDockerDaemon(object):
+    """Serve a fake docker engine API on a unix socket, in a thread.
+
+    Only the endpoints used by eve are implemented. Images are declared with
+    `add_image`, containers are kept in memory, and every request received
+    is recorded in `requests` as a ``(method, path)`` tuple.
+
+    """
+
+    def __init__(self):
+        self._base_path = tempfile.mkdtemp(suffix='_eve_fake_docker')
+        self.socket_path = os.path.join(self._base_path, 'docker.sock')
+        self.images = set()
+        self.containers = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start serving requests.
+
+        Returns:
+            self
+
+        """
+        self._server = _Server(self.socket_path, _Handler)
+        self._server.daemon = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and remove the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        shutil.rmtree(self._base_path, ignore_errors=True)
+
+    def add_image(self, image):
+        self.images.add(image)
+
+    def _find(self, name_or_id):
+        for container in self.containers.values():
+            if name_or_id in (container['Id'], container['Name']):
+                return container
+        return None
+
+    def handle(self, method, path, query, body):
+        """Return the (status, json body) answering a request."""
+        match = re.match(r'^/images/(.+)/json$', path)
+        if method == 'GET' and match:
+            image = unquote(match.group(1))
+            if image not in self.images:
+                return 404, {'message': 'No such image: %s' % image}
+            return 200, {'Id': 'sha256:' + image, 'RepoTags': [image]}
+
+        if method == 'POST' and path == '/containers/create':
+            if body['Image'] not in self.images:
+                return 404, {'message': 'No such image: %s' % body['Image']}
+            name = query.get('name') or uuid.uuid4().hex[:12]
+            if self._find(name) is not None:
+                return 409, {'message': 'Conflict: %s is in use' % name}
+            container = dict(body, Id=uuid.uuid4().hex, Name=name,
+                             State='created')
+            self.containers[container['Id']] = container
+            return 201, {'Id': container['Id'], 'Warnings': []}
+
+        match = re.match(r'^/containers/([^/]+)(/start|/json)?$', path)
+        if match:
+            container = self._find(unquote(match.group(1)))
+            if container is None:
+                return 404, {'message': 'No such container'}
+            if method == 'POST' and match.group(2) == '/start':
+                if container['State'] == 'running':
+                    return 304, None
+                container['State'] = 'running'
+                return 204, None
+            if method == 'GET' and match.group(2) == '/json':
+                return 200, container
+            if method == 'DELETE' and match.group(2) is None:
+                if (container['State'] == 'running'
+                        and query.get('force') != 'true'):
+                    return 409, {'message': 'container is running'}
+                del self.containers[container['Id']]
+                return 204, None
+
+        return 404, {'message': 'page not found'}
@@ -0,0 +1,45 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Test the FakeDockerDaemon."""
+
+from unittest import TestCase
+
+from eve.worker.docker.engine_api import DockerEngineClient
+from tests.util.fake_docker_daemon import FakeDockerDaemon
+
+
+class TestFakeDockerDaemon(TestCase):
+    def test_start_and_stop(self):
+        """Test a container lifecycle on a fake docker daemon.
+
+        Steps:
+            - Start a FakeDockerDaemon with an image.
+            - Run a container of this image.
+            - Check that the container is running.
+            - Remove it and stop the FakeDockerDaemon.
+
+        """
+        daemon = FakeDockerDaemon().start()
+        self.addCleanup(daemon.stop)
+        daemon.add_image('ubuntu:focal')
+        client = DockerEngineClient(daemon.socket_path)
+        container_id = client.run_container('foo', 'ubuntu:focal')
+        self.assertEqual(daemon.containers[container_id]['State'], 'running')
+        self.assertTrue(client.remove_container('foo'))
+        self.assertEqual(daemon.containers, {})
+        client.close()
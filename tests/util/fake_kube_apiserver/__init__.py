@@ -0,0 +1,3 @@
+from .fake_kube_apiserver import FakeKubeApiServer
+
+__all__ = ['FakeKubeApiServer']
@@ -0,0 +1,347 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""FakeKubeApiServer: the kubernetes pod API subset used by eve."""
+
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+POD_PATH = re.compile(
+    r'^/api/v1/namespaces/([^/]+)/pods(?:/([^/]+))?(/status|/log)?$')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        with self.server.apiserver.lock:
+            self.server.apiserver.connections += 1
+        super(_Handler, self).handle()
+
+    def _send(self, status, answer, content_type='application/json'):
+        if isinstance(answer, str):
+            data = answer.encode('utf-8')
+        else:
+            data = json.dumps(answer).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self):
+        url = urlparse(self.path)
+        query = {key: values[-1]
+                 for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        server = self.server.apiserver
+        with server.lock:
+            server.requests.append((self.command, url.path))
+        if (server.token is not None and self.headers.get('Authorization')
+                != 'Bearer %s' % server.token):
+            self._send(401, server.status(401, 'Unauthorized',
+                                          'Unauthorized'))
+            return
+
+        # parsed like the API server does, the client sends watch=True
+        watch = query.get('watch', '').lower() in ('true', '1', 't')
+        if self.command == 'GET' and watch:
+            self._watch(server, url.path, query)
+            return
+
+        with server.lock:
+            status, answer = server.handle(self.command, url.path, query,
+                                           body)
+        if isinstance(answer, str):
+            self._send(status, answer, 'text/plain')
+        else:
+            self._send(status, answer)
+
+    def _watch(self, server, path, query):
+        match = POD_PATH.match(path)
+        if not match or match.group(2):
+            self._send(404, server.status(404, 'NotFound', 'not found'))
+            return
+        # like the API server, send each event in its own chunk
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for event in server.events_since(
+                match.group(1), query.get('labelSelector'),
+                query.get('resourceVersion'),
+                int(query.get('timeoutSeconds', 5))):
+            data = json.dumps(event).encode('utf-8') + b'\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+
+LABEL_REQUIREMENT = re.compile(
+    r'\s*([\w./-]+)\s*(?:(!=|==|=)\s*([\w./-]*)'
+    r'|\s+(in|notin)\s*\(([^)]*)\))?\s*(?:,|$)')
+
+
+def _matches(pod, label_selector):
+    """Tell whether the labels of a pod match an equality or set selector."""
+    labels = pod['metadata'].get('labels') or {}
+    position = 0
+    label_selector = label_selector or ''
+    while position < len(label_selector):
+        match = LABEL_REQUIREMENT.match(label_selector, position)
+        if not match or match.end() == position:
+            raise ValueError('invalid label selector %r' % label_selector)
+        position = match.end()
+        key, operator, value, set_operator, values = match.groups()
+        if set_operator:
+            values = [item.strip() for item in values.split(',')]
+            if (labels.get(key) in values) != (set_operator == 'in'):
+                return False
+        elif operator == '!=':
+            if labels.get(key) == value:
+                return False
+        elif operator:
+            if labels.get(key) != value:
+                return False
+        elif key not in labels:
+            return False
+    return True
+
+
+class FakeKubeApiServer(object):
+    """Serve a fake kubernetes API on localhost, in a thread.
+
+    Pods are kept in memory. Created pods are ``Pending``, then move to
+    ``start_phase`` (or to the phase set in ``phases`` for their name);
+    `set_phase` changes the phase of a pod. Pods leaving ``Pending`` are
+    scheduled on ``node_name``. Deleted pods disappear after
+    ``deletion_delay`` seconds. Watches get every change made after the
+    requested resource version, until `compact` makes it expire.
+
+    When ``token`` is set, requests must carry it as bearer token. Every
+    request received is recorded in `requests` as a ``(method, path)``
+    tuple, and `connections` counts the connections accepted. Collections
+    of pods deleted by label selector are recorded in
+    `collection_deletions`.
+
+    """
+
+    def __init__(self):
+        self.pods = {}
+        self.requests = []
+        self.version = 0
+        self.oldest_version = 0
+        self.start_phase = 'Running'
+        self.phases = {}
+        self.deletion_delay = 0
+        self.node_name = 'node-1'
+        self.token = None
+        self.connections = 0
+        self.collection_deletions = []
+        self.lock = threading.Condition()
+        self._history = []
+        self._stopping = False
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        """Start serving requests.
+
+        Returns:
+            self
+
+        """
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.apiserver = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the running watches."""
+        with self.lock:
+            self._stopping = True
+            self.lock.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    @staticmethod
+    def status(code, reason, message):
+        return {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure',
+                'code': code, 'reason': reason, 'message': message}
+
+    def _record(self, event_type, pod):
+        self.version += 1
+        pod['metadata']['resourceVersion'] = str(self.version)
+        self._history.append((self.version, event_type, copy.deepcopy(pod)))
+        self.lock.notify_all()
+
+    def set_phase(self, namespace, name, phase, reason=None):
+        """Change the phase of a pod, as the kubelet would."""
+        with self.lock:
+            pod = self.pods[(namespace, name)]
+            if phase != 'Pending':
+                pod['spec'].setdefault('nodeName', self.node_name)
+            pod['status'].update(phase=phase, reason=reason)
+            self._record('MODIFIED', pod)
+
+    def remove(self, namespace, name):
+        """Remove a pod for good."""
+        with self.lock:
+            pod = self.pods.pop((namespace, name), None)
+            if pod is not None:
+                self._record('DELETED', pod)
+
+    def compact(self):
+        """Forget the history: older resource versions expire."""
+        with self.lock:
+            self._history = []
+            self.oldest_version = self.version
+
+    def events_since(self, namespace, label_selector, resource_version,
+                     timeout):
+        """Yield the watch events following resource_version."""
+        deadline = time.time() + timeout
+        with self.lock:
+            version = int(resource_version or self.version)
+            expired = version < self.oldest_version
+        if expired:
+            yield {'type': 'ERROR', 'object': self.status(
+                410, 'Expired', 'too old resource version: %d' % version)}
+            return
+        while True:
+            with self.lock:
+                while (not self._stopping and time.time() < deadline
+                       and (not self._history
+                            or self._history[-1][0] <= version)):
+                    self.lock.wait(max(0, deadline - time.time()))
+                if self._stopping or time.time() >= deadline:
+                    return
+                events = [event for event in self._history
+                          if event[0] > version]
+            for event_version, event_type, pod in events:
+                version = event_version
+                if (pod['metadata']['namespace'] == namespace
+                        and _matches(pod, label_selector)):
+                    yield {'type': event_type, 'object': pod}
+
+    def _create(self, namespace, body):
+        name = body['metadata']['name']
+        if (namespace, name) in self.pods:
+            return 409, self.status(409, 'AlreadyExists',
+                                    'pods "%s" already exists' % name)
+        pod = copy.deepcopy(body)
+        pod.setdefault('apiVersion', 'v1')
+        pod.setdefault('kind', 'Pod')
+        pod['metadata'].update(
+            namespace=namespace, uid=str(uuid.uuid4()),
+            creationTimestamp=time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                            time.gmtime()))
+        pod['status'] = {'phase': 'Pending', 'containerStatuses': []}
+        self.pods[(namespace, name)] = pod
+        self._record('ADDED', pod)
+        answer = copy.deepcopy(pod)
+        phase = self.phases.get(name, self.start_phase)
+        if phase is not None:
+            pod['spec']['nodeName'] = self.node_name
+            pod['status']['phase'] = phase
+            self._record('MODIFIED', pod)
+        return 201, answer
+
+    def _delete(self, namespace, name, body):
+        pod = self.pods[(namespace, name)]
+        answer = copy.deepcopy(pod)
+        grace = (body or {}).get('gracePeriodSeconds')
+        if self.deletion_delay and grace != 0:
+            if 'deletionTimestamp' not in pod['metadata']:
+                pod['metadata']['deletionTimestamp'] = '2021-01-01T00:00:00Z'
+                self._record('MODIFIED', pod)
+                timer = threading.Timer(self.deletion_delay, self.remove,
+                                        (namespace, name))
+                timer.daemon = True
+                timer.start()
+        else:
+            del self.pods[(namespace, name)]
+            self._record('DELETED', pod)
+        return 200, answer
+
+    def _delete_collection(self, namespace, label_selector):
+        names = [name for (pod_ns, name), pod in self.pods.items()
+                 if pod_ns == namespace and _matches(pod, label_selector)]
+        for name in names:
+            self._delete(namespace, name, None)
+        self.collection_deletions.append((namespace, label_selector))
+        return 200, {'kind': 'Status', 'apiVersion': 'v1',
+                     'status': 'Success', 'details': {'kind': 'pods'}}
+
+    def handle(self, method, path, query, body):
+        """Return the (status, body) answering a request."""
+        match = POD_PATH.match(path)
+        if not match:
+            return 404, self.status(404, 'NotFound', 'page not found')
+        namespace, name, subresource = match.groups()
+
+        if name is None:
+            if method == 'POST':
+                return self._create(namespace, body)
+            if method == 'DELETE':
+                return self._delete_collection(namespace,
+                                               query.get('labelSelector'))
+            if method == 'GET':
+                return 200, {
+                    'kind': 'PodList', 'apiVersion': 'v1',
+                    'metadata': {'resourceVersion': str(self.version)},
+                    'items': [pod for (pod_ns, _), pod in self.pods.items()
+                              if pod_ns == namespace
+                              and _matches(pod, query.get('labelSelector'))],
+                }
+            return 405, self.status(405, 'MethodNotAllowed', method)
+
+        if (namespace, name) not in self.pods:
+            return 404, self.status(404, 'NotFound',
+                                    'pods "%s" not found' % name)
+        if method == 'GET' and subresource == '/log':
+            return 200, 'log of %s' % name
+        if method == 'GET':
+            return 200, self.pods[(namespace, name)]
+        if method == 'DELETE' and subresource is None:
+            return self._delete(namespace, name, body)
+        return 405, self.status(405, 'MethodNotAllowed', method)
@@ -0,0 +1,91 @@
+# Copyright 2021 Scality
+#
+# This file is part of Eve.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor,
+# Boston, MA  02110-1301, USA.
+"""Test the FakeKubeApiServer."""
+
+from unittest import TestCase
+
+from kubernetes import client, watch
+
+from tests.util.fake_kube_apiserver import FakeKubeApiServer
+
+
+class TestFakeKubeApiServer(TestCase):
+    def test_pod_lifecycle(self):
+        """Test a pod lifecycle on a fake kubernetes API server.
+
+        Steps:
+            - Start a FakeKubeApiServer.
+            - Create a pod and check that it is running.
+            - Delete it and check that the watch saw it all.
+            - Stop the FakeKubeApiServer.
+
+        """
+        server = FakeKubeApiServer().start()
+        self.addCleanup(server.stop)
+        configuration = client.Configuration()
+        configuration.host = server.url
+        api = client.CoreV1Api(client.ApiClient(configuration))
+
+        pods = api.list_namespaced_pod('ns', label_selector='app=eve')
+        version = pods.metadata.resource_version
+        api.create_namespaced_pod('ns', {
+            'metadata': {'name': 'foo', 'labels': {'app': 'eve'}},
+            'spec': {'containers': [{'name': 'foo', 'image': 'foo'}]},
+        })
+        pod = api.read_namespaced_pod_status('foo', 'ns')
+        self.assertEqual(pod.status.phase, 'Running')
+        api.delete_namespaced_pod('foo', 'ns',
+                                  body=client.V1DeleteOptions())
+
+        events = watch.Watch().stream(
+            api.list_namespaced_pod, 'ns', label_selector='app=eve',
+            resource_version=version, timeout_seconds=1)
+        self.assertEqual(
+            [(event['type'], event['object'].status.phase)
+             for event in events],
+            [('ADDED', 'Pending'), ('MODIFIED', 'Running'),
+             ('DELETED', 'Running')])
+
+    def test_delete_collection(self):
+        """Test the deletion of pods by label selector.
+
+        Steps:
+            - Start a FakeKubeApiServer and create three pods.
+            - Delete two of them with a set based selector.
+            - Check that only the third one is left.
+
+        """
+        server = FakeKubeApiServer().start()
+        self.addCleanup(server.stop)
+        configuration = client.Configuration()
+        configuration.host = server.url
+        api = client.CoreV1Api(client.ApiClient(configuration))
+
+        for name, buildid in (('foo', '1'), ('bar', '2'), ('baz', '3')):
+            api.create_namespaced_pod('ns', {
+                'metadata': {'name': name, 'labels': {
+                    'app': 'eve', 'buildid': buildid}},
+                'spec': {'containers': [{'name': name, 'image': name}]},
+            })
+        api.delete_collection_namespaced_pod(
+            'ns', label_selector='app=eve,buildid in (1, 3)')
+        pods = api.list_namespaced_pod('ns', label_selector='buildid!=4')
+        self.assertEqual([pod.metadata.name for pod in pods.items], ['bar'])
+        self.assertIsNotNone(pods.items[0].metadata.creation_timestamp)
+        self.assertEqual(server.collection_deletions,
+                         [('ns', 'app=eve,buildid in (1, 3)')])